@@ -0,0 +1,1220 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import concurrent.futures
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from crawler import crawl
+from discovery import Frontier, discover
+from metrics import METRICS
+from fetch import STATS, make_session
+from ratelimit import AdaptiveRateLimiter
+from fixture_server import SEARCH_PAGE_SIZE, FixtureServer, start_fixture_server
+import pscraper
+from pscraper import BASE_URL
+
+# Benchmarks run offline against fixture_server.py, never against pazar3.mk.
+# Run from src/ so the saved CSVs resolve, e.g. `python bench.py crawl`.
+# `python bench.py suite` runs the standard set and keeps its results per
+# commit in RESULTS_DIR, so `suite --compare <commit>` can flag regressions.
+RESULTS_DIR = 'bench_results'
+# Relative slowdown beyond which suite --compare fails
+REGRESSION_THRESHOLD = 0.10
+# Import time budgets of the entry points, for short cron runs and worker
+# processes. scraper.py had 400 ms while it was its own crawler importing
+# requests and tenacity up front; as a shim over pscraper it defers even
+# the network stack and gets pscraper's budget
+STARTUP_BUDGETS_MS = {'pscraper': 150, 'scraper': 150}
+# Modules no entry point may load just by being imported
+HEAVY_MODULES = ['pandas', 'numpy', 'pyarrow', 'bs4', 'fake_useragent']
+STARTUP_PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+heavy = [name for name in {heavy!r} if name in sys.modules]
+import fetch
+start_headers = time.perf_counter()
+fetch.get_headers()
+print(json.dumps({{'import_ms': (imported - start) * 1000, 'headers_ms': (time.perf_counter() - start_headers) * 1000,
+                  'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 'heavy': heavy}}))
+"""
+
+
+def fixture_urls(server, limit=None):
+    urls = [f'{server.base_url}/ad/{ad_id}' for ad_id in server.ad_ids]
+    return urls[:limit] if limit else urls
+
+
+def paged_crawl(urls, page_size=50, workers=5, page_sleep=0):
+    """The old pscraper.main loop: one ThreadPoolExecutor per search page"""
+    all_data = []
+    for start in range(0, len(urls), page_size):
+        if start and page_sleep:
+            time.sleep(page_sleep)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(pscraper.scrape_listing, url) for url in urls[start:start + page_size]]
+            for future in concurrent.futures.as_completed(futures):
+                result = future.result()
+                if result:
+                    all_data.append(result)
+    return all_data
+
+
+def print_fetch_stats(session=None):
+    report = STATS.report(session)
+    if report['requests']:
+        print(f"  fetch: avg {report['avg_ms']:.1f} ms, wait {report['wait_time']:.2f}s, "
+              f"download {report['download_time']:.2f}s, {report['bytes'] / 1e6:.1f} MB, "
+              f"{report.get('connections', 0)} connections for {report['requests']} requests")
+
+
+def fixture_pages(server, limit=None):
+    pages = [(f'{BASE_URL}/ad/{ad_id}', server.page(ad_id).decode('utf-8')) for ad_id in server.ad_ids]
+    return pages[:limit] if limit else pages
+
+
+def bench_parse(args):
+    server = FixtureServer(('127.0.0.1', 0))
+    server.server_close()
+    pages = fixture_pages(server, args.limit)
+
+    # Parity: the compiled plan must reproduce the BeautifulSoup parser exactly
+    mismatches = [url for url, html in pages
+                  if pscraper.parse_listing(html, url) != pscraper.parse_listing_soup(html, url)]
+    print(f"parity: {len(pages) - len(mismatches)}/{len(pages)} pages identical")
+    for url in mismatches[:10]:
+        print(f"  mismatch: {url}")
+
+    for name, parse in [('soup', pscraper.parse_listing_soup), ('plan', pscraper.parse_listing)]:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for url, html in pages:
+                parse(html, url)
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {args.repeat * len(pages) / elapsed:.0f} pages/sec/core")
+    return 1 if mismatches else 0
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_storage(args):
+    import ast
+    import tempfile
+    import pandas as pd
+    from storage import read_listings, save_listings
+
+    df = pd.concat([pd.read_csv(args.csv)] * args.scale, ignore_index=True)
+    tmp = tempfile.mkdtemp()
+    csv_path = os.path.join(tmp, 'listings.csv')
+    parquet_path = os.path.join(tmp, 'listings.parquet')
+    df.to_csv(csv_path, index=False)
+    save_listings(df, parquet_path)
+    print(f"{len(df)} rows: csv {os.path.getsize(csv_path) / 1e6:.1f} MB, "
+          f"parquet {os.path.getsize(parquet_path) / 1e6:.1f} MB")
+
+    def load_csv():
+        # What every CSV consumer has to redo before using images
+        frame = pd.read_csv(csv_path)
+        frame['images'] = frame['images'].map(lambda value: ast.literal_eval(value) if isinstance(value, str) else [])
+        return frame
+
+    columns = ['manufacturer', 'model', 'year', 'price_numeric']
+    for name, load in [('csv', load_csv),
+                       ('parquet', lambda: read_listings(parquet_path)),
+                       ('csv, 4 columns', lambda: pd.read_csv(csv_path, usecols=columns)),
+                       ('parquet, 4 columns', lambda: read_listings(parquet_path, columns=columns))]:
+        frame, elapsed = timed(load)
+        print(f"{name}: {elapsed * 1000:.0f} ms, {frame.memory_usage(deep=True).sum() / 1e6:.1f} MB in memory")
+
+    # Two crawls on the same day, the second interrupted and resumed: each ad once in the dataset
+    from storage import ParquetSink
+    listings = pd.read_csv(args.csv).to_dict('records')
+    root = os.path.join(tmp, 'listings')
+    half = len(listings) // 2
+    for crawl, complete in ((listings, True), (listings[:half], False), (listings[half:], True)):
+        sink = ParquetSink(root, batch_size=100)
+        for listing in crawl:
+            sink.write(listing)
+        sink.close(complete=complete)
+    loaded = read_listings(root, columns=['url'])
+    print(f"same-day crawls into a partitioned dataset: {len(loaded)} rows, {loaded['url'].nunique()} ads")
+    failed = len(loaded) != len(listings) or loaded['url'].nunique() != len(listings)
+
+    # A CSV crawl killed inside a flush: the batch is in the file, only some of its ads in the checkpoint
+    from sink import CsvSink
+    from urls import ad_id_from_url
+    path = os.path.join(tmp, 'crawl.csv')
+    sink = CsvSink(path, batch_size=100)
+    for listing in listings[:half]:
+        sink.write(listing)
+    batch, sink.rows = listings[half:half + 100], []
+    sink._write_rows([sink.row(listing) for listing in batch])
+    sink._checkpoint.write(''.join(f'{ad_id_from_url(listing["url"])}\n' for listing in batch[:50]))
+    sink.close(complete=False)
+    sink = CsvSink(path, batch_size=100)
+    skip = sink.completed()
+    for listing in listings:
+        if ad_id_from_url(listing['url']) not in skip:
+            sink.write(listing)
+    sink.close()
+    loaded = pd.read_csv(path, usecols=['url'])
+    print(f"CSV crawl resumed after a crash mid-flush: {len(loaded)} rows, {loaded['url'].nunique()} ads")
+    failed = failed or len(loaded) != len(listings) or loaded['url'].nunique() != len(listings)
+    if failed:
+        print("FAIL: a same-day or resumed crawl duplicated listings")
+        return 1
+    return 0
+
+
+def bench_prices(args):
+    import numpy as np
+    import pandas as pd
+    from data_cleaner import extract_price, fill_missing_prices
+
+    corpus = pd.read_csv(args.csv)[['description', 'price_numeric']]
+    for rows in args.rows:
+        df = corpus.sample(rows, replace=True, random_state=0).reset_index(drop=True)
+
+        # The row-wise apply data_cleaner used before
+        expected, apply_time = timed(lambda: df.apply(
+            lambda row: extract_price(row['description']) if (pd.isna(row['price_numeric']) or row['price_numeric'] == 0) else row['price_numeric'],
+            axis=1))
+        filled, vector_time = timed(fill_missing_prices, df.copy())
+        identical = np.array_equal(expected.astype(float).to_numpy(), filled['price_numeric'].to_numpy())
+        print(f"{rows} rows: apply {apply_time:.2f}s, vectorized {vector_time:.2f}s "
+              f"({apply_time / vector_time:.1f}x), identical={identical}")
+
+
+def unlimited():
+    return AdaptiveRateLimiter(rate=1e6, min_rate=1e6, max_rate=1e6)
+
+
+def bench_throttle(args):
+    server = start_fixture_server(latency=args.latency, error_rate=args.error_rate, max_rate=args.max_rate)
+    urls = fixture_urls(server, args.limit)
+    print(f"Crawling {len(urls)} listings; server allows {args.max_rate} req/s, "
+          f"{args.error_rate:.0%} random 503s")
+
+    runs = [
+        ('paged, 5 s between pages', lambda: paged_crawl(urls, page_sleep=5), None),
+        ('async, unlimited', None, unlimited()),
+        ('async, adaptive', None, AdaptiveRateLimiter()),
+    ]
+    for name, run, limiter in runs:
+        server.statuses.clear()
+        start = time.perf_counter()
+        if run:
+            results = run()
+        else:
+            results = crawl(urls, pscraper.parse_listing, concurrency=args.concurrency, per_host=args.concurrency,
+                            parse_workers=0, limiter=limiter)
+        elapsed = time.perf_counter() - start
+        statuses = ', '.join(f'{status}: {count}' for status, count in sorted(server.statuses.items()))
+        rate = f", final rate {limiter.rate:.1f}/s" if limiter else ''
+        print(f"{name}: {len(results)}/{len(urls)} listings in {elapsed:.1f}s "
+              f"({len(results) / elapsed:.1f}/s){rate}; server saw {statuses}")
+
+    # The sync path (discovery, distributed workers) must stop at an open breaker too
+    from ratelimit import CircuitBreaker, fetch_with_retry
+    server.error_rate = 1.0
+    breaker = CircuitBreaker(threshold=2, reset_timeout=1.0)
+    start = time.perf_counter()
+    try:
+        fetch_with_retry(urls[0], limiter=unlimited(), breaker=breaker)
+    except Exception:
+        pass
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+    print(f"sync fetch, every response a 503: breaker {breaker.state} after {breaker.trips} trip(s), "
+          f"gave up in {elapsed:.1f}s")
+    # Each attempt after the first trip waits out the breaker and goes as its probe, failing it again
+    if breaker.trips < 2:
+        print("FAIL: the sync fetch path went past an open breaker")
+        return 1
+    return 0
+
+
+def bench_crawl(args):
+    server = start_fixture_server(latency=args.latency)
+    urls = fixture_urls(server, args.limit)
+    print(f"Crawling {len(urls)} fixture listings, {args.latency * 1000:.0f} ms server latency")
+
+    STATS.reset()
+    start = time.perf_counter()
+    results = paged_crawl(urls)
+    elapsed = time.perf_counter() - start
+    print(f"paged (5 threads/page): {len(results)} listings in {elapsed:.2f}s ({len(results) / elapsed:.1f}/s)")
+    print_fetch_stats()
+
+    for concurrency in args.concurrency:
+        for parse_workers in args.parse_workers:
+            STATS.reset()
+            start = time.perf_counter()
+            session = make_session(concurrency)
+            results = crawl(urls, pscraper.parse_listing, concurrency=concurrency, per_host=concurrency,
+                            parse_workers=parse_workers, session=session, limiter=unlimited())
+            elapsed = time.perf_counter() - start
+            print(f"async c={concurrency} parse_workers={parse_workers}: {len(results)} listings "
+                  f"in {elapsed:.2f}s ({len(results) / elapsed:.1f}/s)")
+            print_fetch_stats(session)
+    server.shutdown()
+
+
+def bench_discover(args):
+    server = start_fixture_server(latency=args.latency)
+    print(f"{len(server.search_ads)} ads on the fixture search pages, {args.latency * 1000:.0f} ms server latency")
+    with tempfile.TemporaryDirectory() as tmp:
+        frontier = Frontier(os.path.join(tmp, 'frontier.sqlite'))
+        runs = [('first run', 0), ('refresh, nothing new', 0), (f'refresh, {args.new} new ads', args.new)]
+        for name, new in runs:
+            server.search_ads[:0] = [str(90000000 + len(server.search_ads) + i) for i in range(new)]
+            start = time.perf_counter()
+            stats = discover(frontier, server.base_url, session=make_session(8), limiter=unlimited())
+            elapsed = time.perf_counter() - start
+            print(f"{name}: {stats['pages']} search pages, {stats['new']} new ads in {elapsed:.2f}s")
+        counts = frontier.counts()
+        frontier.close()
+    server.shutdown()
+    expected = len(set(server.search_ads))
+    if counts.get('pending') != expected:
+        print(f"FAIL: frontier holds {counts.get('pending')} ads, search pages list {expected}")
+        return 1
+    return 0
+
+
+def bench_cache(args):
+    from cache import ListingCache
+
+    def on_disk(cache):
+        paths = [os.path.join(directory, name) for directory, _, names in os.walk(os.path.join(cache.path, 'objects'))
+                 for name in names]
+        return len(paths), sum(os.path.getsize(path) for path in paths)
+
+    failures = []
+
+    def check(name, cache, objects=None):
+        files, size = on_disk(cache)
+        digests = {entry['digest'] for entry in cache.entries()}
+        print(f"{name}: {len(cache.entries())} entries, {files} object files, {size} bytes on disk, "
+              f"{cache.bytes} counted (limit {cache.max_bytes})")
+        if size != cache.bytes or files != len(digests) or size > cache.max_bytes or (objects is not None and files != objects):
+            failures.append(name)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = ListingCache(tmp, max_bytes=args.max_bytes)
+        url = f'{BASE_URL}/ad/1'
+        # Each update replaces the ad's body; the old one must not linger
+        for version in range(args.updates):
+            cache.store(url, f'version {version} '.encode() * (args.max_bytes // 40), 'utf-8')
+        check(f"{args.updates} updates of one ad", cache, objects=1)
+
+        # Two ads sharing a body keep it while either points at it
+        shared = b'same page ' * 50
+        cache.store(f'{BASE_URL}/ad/2', shared, 'utf-8')
+        cache.store(f'{BASE_URL}/ad/3', shared, 'utf-8')
+        cache.store(f'{BASE_URL}/ad/2', b'changed page ' * 50, 'utf-8')
+        check("shared body, one ad updated", cache)
+        entry = cache.get(f'{BASE_URL}/ad/3')
+        if entry is None or cache.read(entry) != shared:
+            failures.append("shared body lost")
+
+        for ad in range(4, 4 + args.updates):
+            cache.store(f'{BASE_URL}/ad/{ad}', f'ad {ad} '.encode() * 200, 'utf-8')
+        check(f"{args.updates} more ads, evicting", cache)
+
+        # An object left behind by a crash is removed when the cache is opened
+        orphan = cache.object_path('ff' * 32)
+        os.makedirs(os.path.dirname(orphan), exist_ok=True)
+        with open(orphan, 'wb') as file:
+            file.write(b'x' * 500)
+        cache.db.close()
+        check("reopened with an orphaned object", ListingCache(tmp, max_bytes=args.max_bytes))
+
+    # Against the fixture server, revalidating every time: a page evicted
+    # under a lookup is fetched again, one taken down raises and is dropped
+    import requests
+    server = start_fixture_server()
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = ListingCache(tmp, ttl=0)
+        url = f'{server.base_url}/ad/{server.ad_ids[0]}'
+        body, _, changed = cache.fetch(url)
+        _, _, revalidated = cache.fetch(url)
+        entry = cache.get(url)
+        # As another thread's store evicting the page between lookup and read
+        cache.forget(url)
+        evicted = cache.read(entry)
+        refetched, _, _ = cache.fetch(url)
+        if not changed or revalidated or evicted is not None or refetched != body:
+            failures.append("fetch, revalidate and refetch an evicted page")
+        gone = f'{server.base_url}/ad/1'
+        cache.store(gone, b'taken down since', 'utf-8')
+        try:
+            cache.fetch(gone)
+            failures.append("404 returned as a page")
+        except requests.HTTPError as e:
+            print(f"removed ad: {e}, cached entry {'kept' if cache.get(gone) else 'dropped'}")
+            if cache.get(gone) is not None:
+                failures.append("404 left in the cache")
+        check("after a 404", cache)
+    server.shutdown()
+
+    for name in failures:
+        print(f"FAIL: {name}")
+    return 1 if failures else 0
+
+
+def bench_images(args):
+    import resource
+    import pandas as pd
+    from images import ImageStore, fetch_images, image_urls
+
+    server = start_fixture_server(latency=args.latency)
+    listings = pd.read_csv(args.csv, usecols=['url', 'images']).head(args.limit).to_dict('records')
+    print(f"Photos of {len(listings)} listings, {args.latency * 1000:.0f} ms server latency")
+    # The last run repeats the first with the server's images already rendered, so its
+    # RSS growth is the stage's own: downloads stream to disk whatever their total size
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, path in [('first run', 'a'), ('rerun', 'a'), ('fresh store', 'b')]:
+            store = ImageStore(os.path.join(tmp, path))
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            stats, elapsed = timed(fetch_images, listings, store, args.workers, base_url=server.base_url,
+                                   limiter=unlimited())
+            store.close()
+            growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss
+            print(f"{name}: {stats['downloaded']} photos ({stats['bytes'] / 1e6:.1f} MB) in {elapsed:.2f}s "
+                  f"({stats['downloaded'] / elapsed:.0f}/s), {stats['thumbnails']} thumbnails, "
+                  f"{stats['skipped']} already stored, {stats['duplicate_content']} identical, "
+                  f"{stats['failed']} failed; peak RSS +{growth / 1024:.0f} MB")
+
+        # A photo taken down (404) is recorded and not asked for again; a forbidden one (403) is
+        from urllib.parse import urlsplit
+        gone, forbidden = image_urls(listings[0]['images'])[:2]
+        for url, status in ((gone, 404), (forbidden, 403)):
+            parts = urlsplit(url)
+            server.withheld[f'{parts.path}?{parts.query}' if parts.query else parts.path] = status
+        store = ImageStore(os.path.join(tmp, 'c'))
+        stats = fetch_images(listings[:1], store, args.workers, base_url=server.base_url, limiter=unlimited())
+        leftovers = os.listdir(os.path.join(store.path, 'tmp'))
+        print(f"404 and 403 photos: {stats['failed']} failed, 404 {'recorded' if store.known(gone) else 'not recorded'}, "
+              f"403 {'recorded' if store.known(forbidden) else 'left for the next run'}, {len(leftovers)} part files left")
+        failed = not store.known(gone) or store.known(forbidden) or leftovers
+        store.close()
+    server.shutdown()
+    if failed:
+        print("FAIL: photos that failed were recorded wrongly or left part files")
+        return 1
+    return 0
+
+
+def bench_cube(args):
+    import numpy as np
+    import pandas as pd
+    from cube import SKETCH_ACCURACY, Cube
+    from normalize import MKD_PER_EUR
+
+    corpus = pd.read_csv(args.csv)
+    df = pd.concat([corpus] * args.scale, ignore_index=True)
+    # Distinct ad IDs, or the cube would drop the copies as duplicates
+    df['url'] = [f'{BASE_URL}/ad/{i}' for i in range(len(df))]
+    rng = np.random.default_rng(0)
+    df['price_numeric'] = df['price_numeric'] * rng.uniform(0.8, 1.2, len(df))
+    new = df.tail(args.new)
+    df = df.head(len(df) - args.new)
+
+    cube = Cube()
+    _, build_time = timed(cube.add, df)
+    cells = sum(len(cells) for cells in cube.cuboids.values())
+    print(f"build: {len(df)} listings into {cells} cells in {build_time:.2f}s")
+    _, update_time = timed(cube.add, new)
+    print(f"update: {len(new)} new listings in {update_time * 1000:.0f} ms")
+    df = pd.concat([df, new])
+    # Relisted ads: a new price, some under another fuel type, replace what the cube had
+    changed = df.sample(args.changed, random_state=0)
+    changed['price_numeric'] = changed['price_numeric'] * rng.uniform(0.5, 1.5, len(changed))
+    changed.loc[changed.index[::2], 'fuel_type'] = 'Diesel'
+    _, change_time = timed(cube.add, changed)
+    print(f"update: {len(changed)} changed listings in {change_time * 1000:.0f} ms")
+    df.loc[changed.index] = changed
+    # The cube counts MKD prices in EUR
+    df['price_numeric'] = df['price_numeric'].where(df['currency'] != 'MKD', df['price_numeric'] / MKD_PER_EUR)
+
+    queries = [(['year'], {}), (['year', 'fuel_type'], {}), (['location'], {'fuel_type': 'Diesel'}),
+               (['mileage'], {'year': 2010, 'fuel_type': 'Diesel'}), ([], {'location': 'Skopje'})]
+    failures = 0
+    for by, where in queries:
+        result, cube_time = timed(cube.query, by, where, ['price_numeric'])
+
+        def scan():
+            rows = df
+            for dimension, value in where.items():
+                rows = rows[rows[dimension] == value]
+            return rows.groupby(by, dropna=False)['price_numeric'] if by else rows['price_numeric']
+        grouped, scan_time = timed(lambda: scan().agg(['count', 'sum', 'min', 'max']))
+        # Exact lower quantile vs the sketch: must be within the sketch's relative accuracy
+        exact = scan().quantile(0.5, interpolation='lower')
+        expected = grouped.to_frame().T if not by else grouped
+        estimate = result.set_index(by)['price_numeric_p50'] if by else result['price_numeric_p50']
+        exact_values = np.atleast_1d(exact.to_numpy() if by else exact)
+        mismatch = (len(expected) != len(result)
+                    or not np.allclose(expected['count'].to_numpy(), result['price_numeric_count'].to_numpy())
+                    # A cell whose min or max was a changed listing's keeps it to the sketch's accuracy
+                    or not np.allclose(expected['min'].to_numpy(), result['price_numeric_min'].to_numpy(),
+                                       rtol=SKETCH_ACCURACY)
+                    or not np.allclose(expected['max'].to_numpy(), result['price_numeric_max'].to_numpy(),
+                                       rtol=SKETCH_ACCURACY)
+                    or not np.allclose(expected['sum'].to_numpy() / expected['count'].to_numpy(),
+                                       result['price_numeric_mean'].to_numpy())
+                    or np.any(np.abs(estimate.to_numpy(dtype=float) - exact_values) > SKETCH_ACCURACY * exact_values + 1e-9))
+        failures += mismatch
+        label = ', '.join([*by, *(f'{key}={value}' for key, value in where.items())]) or 'all'
+        print(f"  by {label}: cube {cube_time * 1000:.2f} ms, pandas scan {scan_time * 1000:.1f} ms"
+              f"{'  MISMATCH' if mismatch else ''}")
+    return 1 if failures else 0
+
+
+def bench_records(args):
+    import gc
+    import pickle
+    import tracemalloc
+    import pandas as pd
+    from collections import Counter
+    from fixture_server import MACEDONIAN_TAG_LABELS, render_listing
+    from record import MACEDONIAN_LABELS, PARSERS, Listing, records_to_frame, records_to_table
+    from storage import to_table
+
+    server = FixtureServer(('127.0.0.1', 0))
+    server.server_close()
+    # Each page is parsed once; copies come back through pickle, so like
+    # parsed listings they share no strings
+    blobs = [pickle.dumps(pscraper.parse_listing(html, url)) for url, html in fixture_pages(server)] * args.repeat
+
+    def held(build):
+        # Memory still held by the listings once built, as a crawl holds them until they are written
+        gc.collect()
+        tracemalloc.start()
+        rows = build()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return rows, size
+
+    dicts, dict_size = held(lambda: [pickle.loads(blob) for blob in blobs])
+    records, record_size = held(lambda: [Listing.from_dict(pickle.loads(blob)) for blob in blobs])
+    print(f"{len(blobs)} listings held: dicts {dict_size / 1e6:.1f} MB, records {record_size / 1e6:.1f} MB "
+          f"({dict_size / len(blobs):.0f} vs {record_size / len(blobs):.0f} bytes each)")
+
+    _, convert_time = timed(lambda: [Listing.from_dict(row) for row in dicts])
+    print(f"from_dict: {len(dicts) / convert_time:.0f} listings/sec")
+    for name, build in [('DataFrame from dicts', lambda: pd.DataFrame(dicts)),
+                        ('DataFrame from records', lambda: records_to_frame(records)),
+                        ('Arrow table from dicts', lambda: to_table(dicts)),
+                        ('Arrow table from records', lambda: records_to_table(records))]:
+        result, elapsed = timed(build)
+        size = (result.memory_usage(deep=True).sum() if isinstance(result, pd.DataFrame) else result.nbytes)
+        print(f"{name}: {elapsed * 1000:.0f} ms, {size / 1e6:.1f} MB")
+
+    # Parity: both paths must store the same table
+    expected = to_table(dicts)
+    actual = records_to_table(records)
+    # mileage_start/end are only derived on the record side; the dicts leave them empty
+    mismatched = [name for name in expected.column_names
+                  if expected[name].null_count < len(expected) and not actual[name].equals(expected[name])]
+    print(f"parity: {len(expected.column_names) - len(mismatched)}/{len(expected.column_names)} columns identical"
+          f"{' (differ: ' + ', '.join(mismatched) + ')' if mismatched else ''}")
+
+    # Macedonian pages keep the raw tags next to the fields finish_listing
+    # derives from them; the record must hold the derived values
+    differing = Counter()
+    macedonian = [pscraper.parse_listing(render_listing(row, MACEDONIAN_TAG_LABELS), url)
+                  for url, row in ((f'{BASE_URL}/ad/{ad_id}', row) for ad_id, row in server.rows.items())]
+    for listing in macedonian:
+        wanted = {MACEDONIAN_LABELS[key]: value for key, value in listing.items() if key in MACEDONIAN_LABELS}
+        wanted.update({key: value for key, value in listing.items() if key in PARSERS and key != 'extra'})
+        record = Listing.from_dict(listing)
+        differing.update(field for field, value in wanted.items() if record[field] != PARSERS[field](value))
+    print(f"macedonian labels: {len(macedonian)} listings, "
+          f"{'all fields match parse_listing' if not differing else 'differ: ' + ', '.join(f'{field} ({count})' for field, count in differing.items())}")
+    return 1 if mismatched or differing else 0
+
+
+def bench_dedup(args):
+    import numpy as np
+    import pandas as pd
+    from dedup import find_reposts
+
+    rng = np.random.default_rng(0)
+    corpus = pd.read_csv(args.csv)
+
+    def synthetic(scale):
+        # Copies become distinct cars (own phone and photos); a fraction is
+        # then reposted under a new ad ID with a slightly edited text
+        df = pd.concat([corpus] * scale, ignore_index=True)
+        df['phone'] = [f'07{i:07d}' for i in range(len(df))]
+        df['images'] = [str([f'https://media.example/{i}/{n}.jpg' for n in range(3)]) for i in range(len(df))]
+        originals = rng.choice(len(df), int(len(df) * args.reposts), replace=False)
+        reposts = df.iloc[originals].copy()
+        words = reposts['description'].fillna('').str.split()
+        reposts['description'] = [' '.join(w[:max(len(w) - 2, 0)] + ['hitno', 'povolno']) for w in words]
+        # Half the reposts come with newly uploaded photos
+        fresh = rng.random(len(reposts)) < 0.5
+        reposts.loc[fresh, 'images'] = [str([f'https://media.example/new/{i}.jpg']) for i in range(fresh.sum())]
+        df = pd.concat([df, reposts], ignore_index=True)
+        df['url'] = [f'{BASE_URL}/ad/{i}' for i in range(len(df))]
+        return df, np.r_[np.arange(len(df) - len(reposts)), originals]
+
+    failures = 0
+    for scale in args.scale:
+        df, truth = synthetic(scale)
+        clusters, elapsed = timed(find_reposts, df)
+        clusters = clusters.to_numpy()
+        base = len(corpus) * scale
+        found = (clusters[base:] == clusters[truth[base:]]).mean()
+        # Distinct cars sharing a cluster
+        false_merges = base - len(np.unique(clusters[:base]))
+        failures += found < args.min_recall or false_merges > 0
+        print(f"{len(df)} listings ({len(df) - base} reposts): {elapsed:.2f}s, "
+              f"{len(df) / elapsed:.0f} listings/sec; reposts found {found:.1%}, {false_merges} false merges")
+    return 1 if failures else 0
+
+
+def bench_search(args):
+    import numpy as np
+    import pandas as pd
+    from normalize import MKD_PER_EUR, fold
+    from search_index import SearchIndex, tokenize
+
+    corpus = pd.read_csv(args.csv)
+    df = pd.concat([corpus] * args.scale, ignore_index=True)
+    df['url'] = [f'{BASE_URL}/ad/{i}' for i in range(len(df))]
+    new = df.tail(args.new)
+    df = df.head(len(df) - args.new)
+
+    index = SearchIndex()
+    _, build_time = timed(index.add, df)
+    print(f"build: {len(df)} listings, {len(index.postings)} terms in {build_time:.2f}s")
+    _, update_time = timed(index.add, new)
+    index.columns()
+    print(f"update: {len(new)} new listings in {update_time * 1000:.0f} ms")
+    df = pd.concat([df, new], ignore_index=True)
+
+    # Reference answers by scanning the DataFrame with the same folding rules
+    tokens = df['title'].map(tokenize) + df['description'].map(tokenize)
+    words = tokens.map(set)
+    folded = {column: df[column].map(lambda value: fold(value) if isinstance(value, str) else '')
+              for column in ['fuel_type', 'location']}
+    prices = df['price_numeric'].where(df['currency'] != 'MKD', df['price_numeric'] / MKD_PER_EUR)
+
+    def scan(text='', fuel_type=None, location=None, year=(None, None), price=(None, None)):
+        mask = pd.Series(True, index=df.index)
+        for term in text.split():
+            mask &= words.map(lambda found, term=fold(term): term in found)
+        if fuel_type:
+            mask &= folded['fuel_type'] == fold(fuel_type)
+        if location:
+            mask &= folded['location'].map(lambda value: fold(location) in [part.strip() for part in value.split(',')])
+        for column, (low, high) in (('year', year), ('price', price)):
+            values = df['year'] if column == 'year' else prices
+            if low is not None:
+                mask &= values >= low
+            if high is not None:
+                mask &= values <= high
+        return np.flatnonzero(mask)
+
+    queries = [{'text': 'zamena', 'fuel_type': 'Diesel', 'year': (2010, 2012), 'price': (None, 8000), 'location': 'Skopje'},
+               {'text': 'замена'}, {'text': 'golf tdi', 'year': (2009, 2009)}, {'location': 'Skopje', 'price': (5000, 7000)},
+               {'fuel_type': 'Gasoline'}]
+    failures = 0
+    for query in queries:
+        found, index_time = timed(index.match, **query)
+        expected, scan_time = timed(scan, **query)
+        mismatch = not np.array_equal(np.sort(found), expected)
+        failures += mismatch
+        label = ', '.join(f'{key}={value}' for key, value in query.items())
+        print(f"  {label}: {len(found)} matches, index {index_time * 1000:.2f} ms, pandas scan {scan_time * 1000:.0f} ms"
+              f"{'  MISMATCH' if mismatch else ''}")
+    return 1 if failures else 0
+
+
+def bench_distributed(args):
+    import pandas as pd
+    import signal
+    from distributed import run_coordinator
+
+    server = start_fixture_server(latency=args.latency, jitter=args.latency / 2, max_rate=args.server_rate)
+    cwd = os.getcwd()
+    failures = 0
+    for workers in args.workers:
+        server.statuses.clear()
+        killed = []
+
+        def kill_one(broker, processes):
+            # One worker dies mid-batch; its leased ads must be redelivered
+            if args.kill and not killed and broker.counts().get('done', 0) > 100:
+                os.kill(processes[0].pid, signal.SIGKILL)
+                killed.append(processes[0].pid)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                # stderr too: the killed worker's connections show up as server errors
+                with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                    counts, elapsed = timed(run_coordinator, 'listings.csv', base_url=server.base_url,
+                                            workers=workers, max_rate=args.max_rate, on_tick=kill_one,
+                                            threads=args.threads, lease_seconds=args.lease)
+                saved = pd.read_csv('listings.csv')
+            finally:
+                os.chdir(cwd)
+        requests = sum(server.statuses.values())
+        duplicates = saved['url'].duplicated().sum()
+        lost = counts.get('done', 0) - saved['url'].nunique()
+        failures += bool(duplicates or lost or counts.get('failed') or counts.get('pending') or counts.get('leased'))
+        print(f"{workers} workers{' (one killed)' if killed else ''}: {len(saved)} listings in {elapsed:.1f}s, "
+              f"{len(saved) / elapsed:.1f}/s; {requests / elapsed:.1f} requests/s against a budget of {args.max_rate}, "
+              f"{server.statuses.get(429, 0)} throttled; {duplicates} duplicates, {counts.get('failed', 0)} failed, "
+              f"{lost} done but not saved")
+    server.shutdown()
+    return 1 if failures else 0
+
+
+def bench_history(args):
+    import numpy as np
+    import pandas as pd
+    from history import price_drops, price_trajectory, record_crawl
+
+    corpus = pd.read_csv(args.csv, usecols=['url', 'price_numeric', 'currency', 'views'])
+    df = pd.concat([corpus] * args.scale, ignore_index=True)
+    df['url'] = [f'{BASE_URL}/ad/{i}' for i in range(len(df))]
+    df['ad_id'] = np.arange(len(df))
+    rng = np.random.default_rng(0)
+    next_id = len(df)
+    start_day = pd.Timestamp('2026-01-01 06:00')
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        history_dir = os.path.join(tmp, 'history')
+        snapshots = []
+        record_time = 0
+        for day in range(args.crawls):
+            crawled_at = start_day + pd.Timedelta(days=day)
+            if day:
+                # A day on the site: some prices move (mostly down), many ads get views, a few go and come
+                changed = rng.random(len(df)) < args.price_changes
+                df.loc[changed, 'price_numeric'] = (df.loc[changed, 'price_numeric']
+                                                    * rng.choice([0.9, 0.95, 1.05], changed.sum(), p=[0.5, 0.3, 0.2])).round()
+                viewed = rng.random(len(df)) < 0.3
+                df.loc[viewed, 'views'] = df.loc[viewed, 'views'] + rng.integers(1, 20, viewed.sum())
+                df = df[rng.random(len(df)) >= args.churn]
+                new = df.sample(int(len(df) * args.churn), random_state=day).copy()
+                new['ad_id'] = np.arange(next_id, next_id + len(new))
+                new['url'] = [f'{BASE_URL}/ad/{i}' for i in new['ad_id']]
+                next_id += len(new)
+                df = pd.concat([df, new], ignore_index=True)
+            path = os.path.join(tmp, f'snapshot-{day:03d}.parquet')
+            df.to_parquet(path, index=False)
+            snapshots.append((crawled_at, path))
+            _, elapsed = timed(record_crawl, df, crawled_at, True, history_dir)
+            record_time += elapsed
+
+        size = lambda paths: sum(os.path.getsize(path) for path in paths)
+        history_size = size(os.path.join(root, name) for root, _, names in os.walk(history_dir) for name in names)
+        snapshot_size = size(path for _, path in snapshots)
+        print(f"{args.crawls} crawls of ~{len(df)} ads: recorded in {record_time / args.crawls * 1000:.0f} ms per crawl; "
+              f"history {history_size / 1e6:.1f} MB vs snapshots {snapshot_size / 1e6:.1f} MB "
+              f"({snapshot_size / history_size:.0f}x)")
+
+        def scan_snapshots(filters=None):
+            return pd.concat([pd.read_parquet(path, columns=['ad_id', 'price_numeric'], filters=filters)
+                              .assign(crawled_at=crawled_at) for crawled_at, path in snapshots], ignore_index=True)
+
+        def scan_trajectory(ad_id):
+            rows = scan_snapshots([('ad_id', '==', ad_id)])
+            moved = rows['price_numeric'].ne(rows['price_numeric'].shift())
+            return rows.loc[moved & rows['price_numeric'].notna(), ['crawled_at', 'price_numeric']]
+
+        ad_ids = rng.choice(len(corpus) * args.scale, 5, replace=False)
+        for ad_id in ad_ids:
+            found, history_time = timed(price_trajectory, ad_id, history_dir)
+            expected, scan_time = timed(scan_trajectory, ad_id)
+            mismatch = (found['crawled_at'].tolist() != expected['crawled_at'].tolist()
+                        or not np.allclose(found['price'].to_numpy(), expected['price_numeric'].to_numpy()))
+            failures += mismatch
+            print(f"  trajectory of ad {ad_id}: {len(found)} prices, history {history_time * 1000:.1f} ms, "
+                  f"snapshot scan {scan_time * 1000:.0f} ms{'  MISMATCH' if mismatch else ''}")
+
+        since = snapshots[-1][0] - pd.Timedelta(days=args.days)
+
+        def scan_drops():
+            # Prices from the last crawl before the window on, per ad: first vs last
+            base = max((at for at, _ in snapshots if at < since), default=since)
+            rows = scan_snapshots()
+            rows = rows[(rows['crawled_at'] >= base) & rows['price_numeric'].notna()]
+            per_ad = rows.groupby('ad_id')['price_numeric'].agg(['first', 'last'])
+            return per_ad[per_ad['last'] < per_ad['first']]
+
+        found, history_time = timed(price_drops, since, history_dir)
+        expected, scan_time = timed(scan_drops)
+        found = found.set_index('ad_id').sort_index()
+        mismatch = (not np.array_equal(found.index.to_numpy(), expected.index.to_numpy())
+                    or not np.allclose(found['price_now'].to_numpy(), expected['last'].to_numpy())
+                    or not np.allclose(found['price_before'].to_numpy(), expected['first'].to_numpy()))
+        failures += mismatch
+        print(f"  price drops in the last {args.days} days: {len(found)} ads, history {history_time * 1000:.0f} ms, "
+              f"snapshot scan {scan_time * 1000:.0f} ms{'  MISMATCH' if mismatch else ''}")
+    return 1 if failures else 0
+
+
+def bench_shards(args):
+    import pandas as pd
+
+    server = start_fixture_server(latency=args.latency)
+    expected = len({ad_id for page in pscraper.parse_pages(args.pages)
+                    for ad_id in server.search_ads[(page - 1) * SEARCH_PAGE_SIZE:page * SEARCH_PAGE_SIZE]})
+    cwd = os.getcwd()
+    failures = 0
+    for shards in args.shards:
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                options = pscraper.parse_args(['--pages', args.pages, '--shards', str(shards), '--base-url', server.base_url,
+                                               '--output', 'listings.csv', '--report', '', '--max-rate', str(args.max_rate)])
+                with contextlib.redirect_stdout(io.StringIO()):
+                    _, elapsed = timed(pscraper.main, **options)
+                saved = pd.read_csv('listings.csv')
+            finally:
+                os.chdir(cwd)
+        duplicates = saved['url'].duplicated().sum()
+        failures += bool(duplicates or len(saved) != expected)
+        print(f"{shards} shard(s), pages {args.pages}: {len(saved)}/{expected} listings in {elapsed:.1f}s "
+              f"({len(saved) / elapsed:.1f}/s), {duplicates} duplicates")
+    server.shutdown()
+    return 1 if failures else 0
+
+
+def bench_normalize(args):
+    import glob
+    import random
+    import pandas as pd
+    import normalize
+    from normalize import engine_size, mileage_range, normalize_frame, registration_date, seller_type
+
+    # Mileage brackets and seller labels as crawled; the CSVs carry no raw
+    # engine or registration strings, so those are drawn from the site's formats
+    crawled = pd.concat([pd.read_csv(path, usecols=['mileage', 'seller_type'])
+                         for path in glob.glob(args.input)], ignore_index=True)
+    rng = random.Random(0)
+    draw = lambda values: [rng.choice(values) for _ in range(args.listings)]
+    df = pd.DataFrame({
+        'mileage': draw(crawled['mileage'].dropna().tolist() + [None]),
+        'engine_size': draw([f'{litres / 10:.1f}'.replace('.', rng.choice('.,')) + rng.choice(['', ' TDI', ' l'])
+                             for litres in range(9, 31)] + [None]),
+        'registration_date': draw([f'{month:02d}/{year}' for month in range(1, 13) for year in range(2024, 2028)]),
+        'seller_type': draw(crawled['seller_type'].dropna().tolist() + ['Физичко лице', 'Правно лице']),
+    })
+    fields = [('mileage', mileage_range), ('engine_size', engine_size),
+              ('registration_date', registration_date), ('seller_type', seller_type)]
+    rows = df.astype(object).where(df.notna(), None).to_dict('records')
+    print(f"{len(rows)} listings, {sum(df[column].nunique() for column, _ in fields)} distinct field values")
+
+    # Per listing, as pscraper.finish_listing converts them: parsing every string vs the LRU tables
+    for name, wrap in [('parsed', lambda convert: convert.__wrapped__), ('memoized', lambda convert: convert)]:
+        converters = [(column, wrap(convert)) for column, convert in fields]
+        _, elapsed = timed(lambda: [[convert(row[column]) for column, convert in converters] for row in rows])
+        print(f"{name}: {elapsed / len(rows) * 1e6:.2f} us/listing")
+    print(f"cache: {', '.join(f'{name} {info.hits} hits/{info.misses} misses' for name, info in normalize.cache_info().items())}")
+
+    # A frame at a time: a parse per row vs once per distinct value
+    def per_row():
+        frame = df.copy()
+        ranges = frame['mileage'].map(mileage_range.__wrapped__)
+        frame['mileage_start'] = pd.array([r.start if r else None for r in ranges], dtype='Int32')
+        frame['mileage_end'] = pd.array([r.end if r else None for r in ranges], dtype='Int32')
+        frame['engine_size'] = pd.array(frame['engine_size'].map(engine_size.__wrapped__).tolist(), dtype='Float64')
+        for column, convert in [('registration_date', registration_date), ('seller_type', seller_type)]:
+            frame[column] = frame[column].astype(object).map(convert.__wrapped__)
+        return frame
+
+    expected, row_time = timed(per_row)
+    actual, batch_time = timed(normalize_frame, df.copy())
+    columns = ['mileage_start', 'mileage_end', 'engine_size', 'registration_date', 'seller_type']
+    mismatched = [column for column in columns if not expected[column].equals(actual[column])]
+    print(f"frame: per row {row_time * 1000:.0f} ms, normalize_frame {batch_time * 1000:.0f} ms "
+          f"({row_time / batch_time:.1f}x)")
+    print(f"parity: {len(columns) - len(mismatched)}/{len(columns)} columns identical"
+          f"{' (differ: ' + ', '.join(mismatched) + ')' if mismatched else ''}")
+    return 1 if mismatched else 0
+
+
+def bench_geo(args):
+    import numpy as np
+    import pandas as pd
+    from geo import CELL_DEGREES, LEVEL_FACTOR, GeoIndex, haversine_km, locate
+    from normalize import MKD_PER_EUR
+
+    corpus = pd.read_csv(args.csv)
+    df = pd.concat([corpus] * args.scale, ignore_index=True)
+    df['url'] = [f'{BASE_URL}/ad/{i}' for i in range(len(df))]
+    # The saved crawls predate data-coords, so a share of the listings get
+    # coordinates scattered around their location's centroid
+    rng = np.random.default_rng(0)
+    centroids = df['location'].map(locate)
+    placed = centroids.notna().to_numpy() & (rng.random(len(df)) < args.exact)
+    spread = rng.normal(0, 0.03, (int(placed.sum()), 2))
+    df['coordinates'] = None
+    df.loc[placed, 'coordinates'] = [f'({lat + dlat:.5f}, {lon + dlon:.5f})'
+                                     for (lat, lon), (dlat, dlon) in zip(centroids[placed], spread)]
+
+    index = GeoIndex()
+    _, add_time = timed(index.add, df)
+    _, grid_time = timed(index.grid)
+    print(f"build: {len(index)} listings placed ({int(placed.sum())} by coordinates, {index.unlocated} unlocated), "
+          f"add {add_time:.2f}s, grid and cell stats {grid_time * 1000:.0f} ms")
+
+    # Reference answers by scanning every listing, as the maps did
+    def positions():
+        exact = df.loc[placed, 'coordinates'].str.strip('()').str.split(',', expand=True).astype(float)
+        fallback = pd.DataFrame(centroids.dropna().tolist(), index=centroids.dropna().index)
+        frame = fallback.reindex(df.index)
+        frame.loc[exact.index] = exact.to_numpy()
+        return frame[0].to_numpy(), frame[1].to_numpy()
+
+    (lats, lons), position_time = timed(positions)
+    prices = df['price_numeric'].where(df['currency'] != 'MKD', df['price_numeric'] / MKD_PER_EUR).to_numpy()
+    print(f"scan setup: positions of every listing in {position_time * 1000:.0f} ms")
+
+    urls = df['url'].to_numpy()
+    failures = 0
+    queries = [('radius Karposh 2 km', lambda: index.match_radius(42.006, 21.395, 2),
+                lambda: np.flatnonzero(haversine_km(42.006, 21.395, lats, lons) <= 2)),
+               ('radius Bitola 10 km', lambda: index.match_radius(41.031, 21.334, 10),
+                lambda: np.flatnonzero(haversine_km(41.031, 21.334, lats, lons) <= 10)),
+               ('radius Skopje 15 km', lambda: index.match_radius(41.9965, 21.4314, 15),
+                lambda: np.flatnonzero(haversine_km(41.9965, 21.4314, lats, lons) <= 15)),
+               ('bbox Ohrid-Struga', lambda: index.match_box(41.0, 20.6, 41.25, 20.9),
+                lambda: np.flatnonzero((lats >= 41.0) & (lats <= 41.25) & (lons >= 20.6) & (lons <= 20.9)))]
+    for label, query, scan in queries:
+        found, index_time = timed(query)
+        expected, scan_time = timed(scan)
+        mismatch = {index.stored[doc][0] for doc in found} != set(urls[expected])
+        failures += mismatch
+        print(f"  {label}: {len(found)} listings, index {index_time * 1000:.2f} ms, numpy scan {scan_time * 1000:.1f} ms"
+              f"{'  MISMATCH' if mismatch else ''}")
+    frame, frame_time = timed(index.radius, 41.031, 21.334, 10)
+    print(f"  radius Bitola 10 km as a DataFrame of listings: {frame_time * 1000:.1f} ms")
+    _, location_time = timed(lambda: df[df['location'].str.contains('Skopje', na=False)])
+    print(f"  location string filter (Skopje): {location_time * 1000:.1f} ms")
+
+    # Per-cell statistics: a lookup in the index vs a group-by over every listing
+    level = args.level
+    size = CELL_DEGREES * LEVEL_FACTOR ** level
+    cells, index_time = timed(index.cells, level)
+    expected, scan_time = timed(lambda: pd.DataFrame({'row': np.floor(lats / size), 'col': np.floor(lons / size),
+                                                      'price': prices}).dropna(subset=['row'])
+                                .groupby(['row', 'col'])['price'].agg(['size', 'median']))
+    mismatch = not (np.array_equal(cells['listings'].to_numpy(), expected['size'].to_numpy())
+                    and np.allclose(cells['median'].to_numpy(), expected['median'].to_numpy(), equal_nan=True))
+    failures += mismatch
+    print(f"  cell stats, level {level}: {len(cells)} cells, index {index_time * 1000:.2f} ms, "
+          f"group-by {scan_time * 1000:.0f} ms{'  MISMATCH' if mismatch else ''}")
+    tile, tile_time = timed(index.tile, 9, 286, 190)
+    print(f"  tile 9/286/190 (Skopje): {len(tile)} cells in {tile_time * 1000:.2f} ms")
+    return 1 if failures else 0
+
+
+def startup_probe(module, repeat):
+    """Best import time of module over fresh interpreters, with the first get_headers() and peak RSS"""
+    runs = []
+    for _ in range(repeat):
+        code = STARTUP_PROBE.format(module=module, heavy=HEAVY_MODULES)
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(output))
+    return min(runs, key=lambda run: run['import_ms'])
+
+
+def bench_startup(args):
+    failures = 0
+    for module, budget in STARTUP_BUDGETS_MS.items():
+        run = startup_probe(module, args.repeat)
+        over = run['import_ms'] > budget
+        failures += over or bool(run['heavy'])
+        print(f"{module}: import {run['import_ms']:.0f} ms (budget {budget} ms), first headers "
+              f"{run['headers_ms']:.1f} ms, peak RSS {run['rss_mb']:.0f} MB"
+              f"{'  OVER BUDGET' if over else ''}{'  LOADS ' + ', '.join(run['heavy']) if run['heavy'] else ''}")
+    return 1 if failures else 0
+
+
+def suite_startup(repeat):
+    return {f'startup.{module}_ms': startup_probe(module, repeat)['import_ms'] for module in STARTUP_BUDGETS_MS}
+
+
+def suite_parse(server, repeat):
+    pages = fixture_pages(server)
+    mismatches = sum(pscraper.parse_listing(html, url) != pscraper.parse_listing_soup(html, url)
+                     for url, html in pages)
+    best = min(timed(lambda: [pscraper.parse_listing(html, url) for url, html in pages])[1] for _ in range(repeat))
+    return {'parse.pages_per_sec': len(pages) / best, 'parse.mismatches': mismatches}
+
+
+def suite_crawl(server, concurrency, repeat):
+    """pscraper.main end to end (discovery, crawl, sink) in a scratch directory"""
+    results = {}
+    cwd = os.getcwd()
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    _, elapsed = timed(pscraper.main, output='listings.csv', base_url=server.base_url, report=None,
+                                       concurrency=concurrency, per_host=concurrency, limiter=unlimited())
+            finally:
+                os.chdir(cwd)
+        report = METRICS.report()
+        rate = report['counters'].get('listings', 0) / elapsed
+        if rate > results.get(f'crawl.c{concurrency}.listings_per_sec', 0):
+            fetch = report['stages']['fetch.total']
+            results.update({f'crawl.c{concurrency}.listings_per_sec': rate,
+                            f'crawl.c{concurrency}.fetch_p95_ms': fetch['p95'] * 1000,
+                            f'crawl.c{concurrency}.fetch_p99_ms': fetch['p99'] * 1000})
+    return results
+
+
+def suite_cleaner(pattern, repeat):
+    from data_cleaner import clean_files
+
+    with tempfile.TemporaryDirectory() as tmp:
+        runs = [timed(clean_files, pattern, os.path.join(tmp, 'cleaned.csv')) for _ in range(repeat)]
+    stats, best = min(runs, key=lambda run: run[1])
+    return {'cleaner.rows_per_sec': stats['rows'] / best}
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True,
+                               text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return f'{commit}-dirty' if dirty else commit
+
+
+def resolve_results(ref):
+    """Results file for a commit-ish (HEAD~1, a tag, a short hash) or a path"""
+    if os.path.exists(ref):
+        return ref
+    try:
+        ref = subprocess.run(['git', 'rev-parse', '--short', ref], capture_output=True, text=True,
+                             check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return os.path.join(RESULTS_DIR, f'{ref}.json')
+
+
+def compare_results(baseline, current, threshold=REGRESSION_THRESHOLD):
+    """Print metric changes; returns the names that regressed by more than threshold"""
+    regressions = []
+    for name, value in sorted(current.items()):
+        base = baseline.get(name)
+        if base is None:
+            print(f"  {name:<32} {value:12.1f}  (new)")
+            continue
+        change = (value - base) / base if base else 0.0
+        # Rates should go up, latencies and mismatch counts down
+        worse = -change if name.endswith('_per_sec') else change
+        if base == 0 and value > 0 and not name.endswith('_per_sec'):
+            worse = float('inf')
+        flag = '  REGRESSION' if worse > threshold else ''
+        if flag:
+            regressions.append(name)
+        print(f"  {name:<32} {base:12.1f} -> {value:12.1f}  {change:+7.1%}{flag}")
+    return regressions
+
+
+def bench_suite(args):
+    server = start_fixture_server(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    print(f"Suite over {len(server.ad_ids)} listings, {len(server.search_ads)} search results; "
+          f"{args.latency * 1000:.0f} ms latency + up to {args.jitter * 1000:.0f} ms jitter, "
+          f"{args.error_rate:.0%} errors, best of {args.repeat}")
+    results = suite_parse(server, args.repeat)
+    for concurrency in args.concurrency:
+        results.update(suite_crawl(server, concurrency, args.repeat))
+    results.update(suite_cleaner(args.cleaner_input, args.repeat))
+    results.update(suite_startup(args.repeat))
+    server.shutdown()
+
+    revision = git_revision()
+    for name, value in sorted(results.items()):
+        print(f"  {name:<32} {value:12.1f}")
+    if args.save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f'{revision}.json')
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({'revision': revision, 'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                       'python': platform.python_version(), 'cpus': os.cpu_count(), 'args': vars(args),
+                       'results': results}, file, indent=2, sort_keys=True, default=str)
+        print(f"Saved to {path}")
+
+    status = 1 if results['parse.mismatches'] else 0
+    if args.compare:
+        path = resolve_results(args.compare)
+        if not os.path.exists(path):
+            print(f"No results for {args.compare} ({path}); run `bench.py suite` on that commit first")
+            return 1
+        with open(path, encoding='utf-8') as file:
+            baseline = json.load(file)
+        print(f"Compared with {baseline['revision']} ({baseline['date']}):")
+        regressions = compare_results(baseline['results'], results, args.threshold)
+        if regressions:
+            print(f"FAIL: {len(regressions)} metrics regressed by more than {args.threshold:.0%}")
+            status = 1
+    return status
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline scraper benchmarks")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    crawl_cmd = commands.add_parser('crawl', help="end-to-end crawl against the fixture server")
+    crawl_cmd.add_argument('--latency', type=float, default=0.05, help="seconds the server waits per request")
+    crawl_cmd.add_argument('--limit', type=int, default=300)
+    crawl_cmd.add_argument('--concurrency', type=int, nargs='+', default=[5, 16, 32])
+    crawl_cmd.add_argument('--parse-workers', type=int, nargs='+', default=[0, 1, 2, 4],
+                           help="parse processes; 0 parses on the fetch threads")
+    crawl_cmd.set_defaults(func=bench_crawl)
+
+    parse_cmd = commands.add_parser('parse', help="listing parser parity check and pages/sec")
+    parse_cmd.add_argument('--limit', type=int, default=None)
+    parse_cmd.add_argument('--repeat', type=int, default=1)
+    parse_cmd.set_defaults(func=bench_parse)
+
+    storage_cmd = commands.add_parser('storage', help="CSV vs Parquet load time and memory")
+    storage_cmd.add_argument('--csv', default='sequential_car_listings_cleaned.csv')
+    storage_cmd.add_argument('--scale', type=int, default=20, help="copies of the CSV to load")
+    storage_cmd.set_defaults(func=bench_storage)
+
+    prices_cmd = commands.add_parser('prices', help="data_cleaner description price fill, apply vs vectorized")
+    prices_cmd.add_argument('--csv', default='sequential_car_listings.csv')
+    prices_cmd.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    prices_cmd.set_defaults(func=bench_prices)
+
+    throttle_cmd = commands.add_parser('throttle', help="crawl against a throttling, failing fixture server")
+    throttle_cmd.add_argument('--max-rate', type=float, default=15.0, help="requests/sec before the server sends 429")
+    throttle_cmd.add_argument('--error-rate', type=float, default=0.02, help="fraction of requests answered 503")
+    throttle_cmd.add_argument('--latency', type=float, default=0.02)
+    throttle_cmd.add_argument('--limit', type=int, default=300)
+    throttle_cmd.add_argument('--concurrency', type=int, default=16)
+    throttle_cmd.set_defaults(func=bench_throttle)
+
+    discover_cmd = commands.add_parser('discover', help="search page discovery into the frontier, full vs refresh")
+    discover_cmd.add_argument('--latency', type=float, default=0.05)
+    discover_cmd.add_argument('--new', type=int, default=70, help="ads added to the top of the results before the last run")
+    discover_cmd.set_defaults(func=bench_discover)
+
+    cache_cmd = commands.add_parser('cache', help="listing cache accounting: updates, shared bodies and eviction")
+    cache_cmd.add_argument('--updates', type=int, default=20)
+    cache_cmd.add_argument('--max-bytes', type=int, default=10000)
+    cache_cmd.set_defaults(func=bench_cache)
+
+    images_cmd = commands.add_parser('images', help="photo download and thumbnail stage, first run vs rerun")
+    images_cmd.add_argument('--csv', default='sequential_car_listings_cleaned.csv')
+    images_cmd.add_argument('--limit', type=int, default=100, help="listings whose photos are fetched")
+    images_cmd.add_argument('--latency', type=float, default=0.02)
+    images_cmd.add_argument('--workers', type=int, default=8)
+    images_cmd.set_defaults(func=bench_images)
+
+    cube_cmd = commands.add_parser('cube', help="aggregate cube build, update and queries vs pandas group-bys")
+    cube_cmd.add_argument('--csv', default='sequential_car_listings_cleaned.csv')
+    cube_cmd.add_argument('--scale', type=int, default=100, help="copies of the cleaned listings")
+    cube_cmd.add_argument('--new', type=int, default=100, help="listings added incrementally after the build")
+    cube_cmd.add_argument('--changed', type=int, default=100, help="listings added again with a new price")
+    cube_cmd.set_defaults(func=bench_cube)
+
+    records_cmd = commands.add_parser('records', help="listing dicts vs typed records: memory, DataFrame and Arrow builds")
+    records_cmd.add_argument('--repeat', type=int, default=20, help="copies of the fixture listings")
+    records_cmd.set_defaults(func=bench_records)
+
+    dedup_cmd = commands.add_parser('dedup', help="repost clustering on a synthetic corpus: time and recall")
+    dedup_cmd.add_argument('--csv', default='sequential_car_listings_cleaned.csv')
+    dedup_cmd.add_argument('--scale', type=int, nargs='+', default=[50, 100, 200], help="copies of the cleaned listings")
+    dedup_cmd.add_argument('--reposts', type=float, default=0.1, help="fraction of listings reposted")
+    dedup_cmd.add_argument('--min-recall', type=float, default=0.9)
+    dedup_cmd.set_defaults(func=bench_dedup)
+
+    search_cmd = commands.add_parser('search', help="search index build, update and queries vs scanning a DataFrame")
+    search_cmd.add_argument('--csv', default='sequential_car_listings_cleaned.csv')
+    search_cmd.add_argument('--scale', type=int, default=100, help="copies of the cleaned listings")
+    search_cmd.add_argument('--new', type=int, default=100, help="listings added incrementally after the build")
+    search_cmd.set_defaults(func=bench_search)
+
+    distributed_cmd = commands.add_parser('distributed', help="coordinator/worker crawl with local worker processes")
+    distributed_cmd.add_argument('--workers', type=int, nargs='+', default=[1, 4])
+    distributed_cmd.add_argument('--threads', type=int, default=4, help="fetch threads per worker")
+    distributed_cmd.add_argument('--latency', type=float, default=0.2)
+    distributed_cmd.add_argument('--max-rate', type=float, default=30.0, help="global requests/sec budget")
+    distributed_cmd.add_argument('--server-rate', type=float, default=40.0, help="fixture server starts throttling above this")
+    distributed_cmd.add_argument('--lease', type=float, default=3.0, help="lease seconds, short so redelivery is quick")
+    distributed_cmd.add_argument('--kill', action=argparse.BooleanOptionalAction, default=True,
+                                 help="kill one worker mid-crawl")
+    distributed_cmd.set_defaults(func=bench_distributed)
+
+    history_cmd = commands.add_parser('history', help="price history over simulated daily crawls vs keeping every snapshot")
+    history_cmd.add_argument('--csv', default='sequential_car_listings_cleaned.csv')
+    history_cmd.add_argument('--scale', type=int, default=100, help="copies of the cleaned listings")
+    history_cmd.add_argument('--crawls', type=int, default=30, help="daily crawls")
+    history_cmd.add_argument('--price-changes', type=float, default=0.02, help="fraction of ads repriced per day")
+    history_cmd.add_argument('--churn', type=float, default=0.01, help="fraction of ads removed, and added, per day")
+    history_cmd.add_argument('--days', type=int, default=7, help="window of the price drop query")
+    history_cmd.set_defaults(func=bench_history)
+
+    shards_cmd = commands.add_parser('shards', help="pscraper --pages split between shard processes, one merged output")
+    shards_cmd.add_argument('--pages', default='1-24', help="search page range; the fixture has 22 full pages")
+    shards_cmd.add_argument('--shards', type=int, nargs='+', default=[1, 4])
+    shards_cmd.add_argument('--latency', type=float, default=0.1)
+    shards_cmd.add_argument('--max-rate', type=float, default=80.0, help="requests/sec budget across all shards")
+    shards_cmd.set_defaults(func=bench_shards)
+
+    normalize_cmd = commands.add_parser('normalize', help="field conversions per listing and per frame, parsed vs memoized")
+    normalize_cmd.add_argument('--input', default='parallel_car_listings*.csv', help="CSVs to draw mileage and seller values from")
+    normalize_cmd.add_argument('--listings', type=int, default=200_000)
+    normalize_cmd.set_defaults(func=bench_normalize)
+
+    geo_cmd = commands.add_parser('geo', help="radius, bounding-box and per-cell price queries, grid index vs full scans")
+    geo_cmd.add_argument('--csv', default='sequential_car_listings_cleaned.csv')
+    geo_cmd.add_argument('--scale', type=int, default=200, help="copies of the cleaned listings")
+    geo_cmd.add_argument('--exact', type=float, default=0.5, help="fraction of listings given coordinates")
+    geo_cmd.add_argument('--level', type=int, default=2, help="grid level of the cell statistics")
+    geo_cmd.set_defaults(func=bench_geo)
+
+    startup_cmd = commands.add_parser('startup', help="entry point import time and memory against their budgets")
+    startup_cmd.add_argument('--repeat', type=int, default=5, help="fresh interpreters per entry point, best counts")
+    startup_cmd.set_defaults(func=bench_startup)
+
+    suite_cmd = commands.add_parser('suite', help="standard parse, crawl, cleaner and startup benchmarks, saved per commit")
+    suite_cmd.add_argument('--latency', type=float, default=0.02)
+    suite_cmd.add_argument('--jitter', type=float, default=0.01)
+    suite_cmd.add_argument('--error-rate', type=float, default=0.0)
+    suite_cmd.add_argument('--concurrency', type=int, nargs='+', default=[4, 16])
+    suite_cmd.add_argument('--repeat', type=int, default=3, help="runs per benchmark, the best one counts")
+    suite_cmd.add_argument('--cleaner-input', default='parallel_car_listings*.csv')
+    suite_cmd.add_argument('--save', action=argparse.BooleanOptionalAction, default=True,
+                           help=f"write the results to {RESULTS_DIR}/<commit>.json")
+    suite_cmd.add_argument('--compare', metavar='COMMIT', help="commit (or results file) to compare against")
+    suite_cmd.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    suite_cmd.set_defaults(func=bench_suite)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
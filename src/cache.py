@@ -0,0 +1,221 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import requests
+
+from fetch import fetch
+from ratelimit import GONE_STATUSES, check_status
+from urls import ad_id_from_url
+
+CACHE_DIR = 'cache'
+# Cached pages younger than this are used without asking the server
+TTL = 24 * 3600
+MAX_BYTES = 2 * 1024 ** 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    encoding TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL NOT NULL,
+    checked_at REAL NOT NULL
+)
+"""
+
+
+def cache_key(url):
+    return ad_id_from_url(url) or hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+
+class ListingCache:
+    """On-disk cache of raw listing pages keyed by ad ID.
+
+    Bodies are stored once per SHA-256 under objects/, and a SQLite index
+    maps each ad to its current body plus the ETag / Last-Modified needed to
+    revalidate it. Stale entries are revalidated with a conditional GET, and
+    the least recently checked ads are evicted once the bodies on disk
+    exceed max_bytes; a body no ad points at any more is deleted.
+    """
+
+    def __init__(self, path=CACHE_DIR, ttl=TTL, max_bytes=MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(path, 'objects'), exist_ok=True)
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(path, 'index.sqlite'), check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute(SCHEMA)
+        self.bytes = self._sweep()
+
+    def _sweep(self):
+        """Remove object files no entry points at (left by a crash); returns the bytes of those kept"""
+        digests = {row[0] for row in self.db.execute("SELECT DISTINCT digest FROM entries")}
+        total = 0
+        for directory, _, names in os.walk(os.path.join(self.path, 'objects')):
+            for name in names:
+                path = os.path.join(directory, name)
+                if name in digests:
+                    total += os.path.getsize(path)
+                else:
+                    os.remove(path)
+        return total
+
+    def _release(self, digest):
+        """Delete a body no entry uses any more and take its size off self.bytes"""
+        if self.db.execute("SELECT 1 FROM entries WHERE digest = ? LIMIT 1", (digest,)).fetchone():
+            return
+        path = self.object_path(digest)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        self.bytes -= size
+
+    def object_path(self, digest):
+        return os.path.join(self.path, 'objects', digest[:2], digest)
+
+    def get(self, url):
+        with self._lock:
+            return self.db.execute("SELECT * FROM entries WHERE key = ?", (cache_key(url),)).fetchone()
+
+    def read(self, entry):
+        """Body of entry, or None if another thread evicted it since entry was looked up"""
+        try:
+            with open(self.object_path(entry['digest']), 'rb') as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def entries(self):
+        with self._lock:
+            return self.db.execute("SELECT * FROM entries ORDER BY key").fetchall()
+
+    def store(self, url, body, encoding, etag=None, last_modified=None):
+        digest = hashlib.sha256(body).hexdigest()
+        path = self.object_path(digest)
+        now = time.time()
+        with self._lock:
+            previous = self.db.execute("SELECT digest FROM entries WHERE key = ?", (cache_key(url),)).fetchone()
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp = f'{path}.{threading.get_ident()}.tmp'
+                with open(tmp, 'wb') as file:
+                    file.write(body)
+                os.replace(tmp, path)
+                self.bytes += len(body)
+            self.db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (cache_key(url), url, digest, len(body), encoding, etag, last_modified, now, now))
+            # The ad's old body goes with it unless another ad has the same one
+            if previous and previous['digest'] != digest:
+                self._release(previous['digest'])
+            self.db.commit()
+            if self.bytes > self.max_bytes:
+                self._evict()
+        return digest
+
+    def forget(self, url):
+        with self._lock:
+            entry = self.db.execute("SELECT digest FROM entries WHERE key = ?", (cache_key(url),)).fetchone()
+            if entry:
+                self.db.execute("DELETE FROM entries WHERE key = ?", (cache_key(url),))
+                self._release(entry['digest'])
+                self.db.commit()
+
+    def touch(self, url):
+        with self._lock:
+            self.db.execute("UPDATE entries SET checked_at = ? WHERE key = ?", (time.time(), cache_key(url)))
+            self.db.commit()
+
+    def _evict(self):
+        rows = self.db.execute("SELECT key, digest FROM entries ORDER BY checked_at").fetchall()
+        for row in rows:
+            if self.bytes <= self.max_bytes:
+                break
+            self.db.execute("DELETE FROM entries WHERE key = ?", (row['key'],))
+            self._release(row['digest'])
+        self.db.commit()
+
+    def fresh(self, url):
+        """(body, encoding) of a cached page still within its TTL, else None"""
+        entry = self.get(url)
+        if entry and time.time() - entry['checked_at'] < self.ttl:
+            body = self.read(entry)
+            if body is not None:
+                return body, entry['encoding']
+        return None
+
+    def fetch(self, url, session=None):
+        """Return (body, encoding, changed) for url, going to the network only when needed.
+
+        429 and 5xx responses raise RetryableStatus and are never cached.
+        Any other status but 200 (or 304 for a cached page) raises
+        requests.HTTPError; a 404 or 410 also drops the ad from the cache.
+        """
+        entry = self.get(url)
+        body = self.read(entry) if entry else None
+        if body is None:
+            # Evicted meanwhile: fetched again as if it had never been cached
+            entry = None
+        if entry and time.time() - entry['checked_at'] < self.ttl:
+            return body, entry['encoding'], False
+
+        headers = {}
+        if entry and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        response = check_status(fetch(url, session, headers=headers))
+
+        if response.status_code == 304 and entry:
+            self.touch(url)
+            return body, entry['encoding'], False
+        if response.status_code in GONE_STATUSES:
+            self.forget(url)
+        if response.status_code != 200:
+            raise requests.HTTPError(f"HTTP {response.status_code}", response=response)
+        digest = self.store(url, response.content, response.encoding,
+                            response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        return response.content, response.encoding, entry is None or entry['digest'] != digest
+
+
+def _parse_entry(parse, path, encoding, url):
+    with open(path, 'rb') as file:
+        body = file.read()
+    try:
+        return parse(body.decode(encoding or 'utf-8', errors='replace'), url)
+    except Exception as e:
+        print(f"Error parsing cached {url}: {str(e)}")
+        return None
+
+
+def replay(cache, parse, workers=None):
+    """Re-parse every cached page without touching the network"""
+    entries = cache.entries()
+    with ProcessPoolExecutor(workers) as executor:
+        results = executor.map(_parse_entry, [parse] * len(entries),
+                               [cache.object_path(entry['digest']) for entry in entries],
+                               [entry['encoding'] for entry in entries],
+                               [entry['url'] for entry in entries],
+                               chunksize=32)
+        return [result for result in results if result]
+
+
+if __name__ == "__main__":
+    import pandas as pd
+    from pscraper import field_mapping, parse_listing
+
+    results = replay(ListingCache(), parse_listing)
+    df = pd.DataFrame(results).rename(columns=field_mapping)
+    df.to_csv('cached_car_listings.csv', index=False)
+    print(f"Re-parsed {len(df)} cached listings")
@@ -0,0 +1,169 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from tenacity import AsyncRetrying
+
+from fetch import fetch, make_session
+from metrics import METRICS
+from ratelimit import RETRY_POLICY, AdaptiveRateLimiter, CircuitBreaker, RetryableStatus, check_status
+from urls import rebase_url
+
+# Total listings being fetched, and how many of those may target a single host
+CONCURRENCY = 16
+PER_HOST = 8
+# Processes parsing fetched pages; 0 parses on the fetch threads instead
+PARSE_WORKERS = os.cpu_count() or 1
+
+
+def parse_page(parse, body, encoding, url):
+    """Return (listing or None, stage timings); the caller merges the timings,
+    as this usually runs in a parse worker process."""
+    with METRICS.capture() as samples:
+        start = time.perf_counter()
+        try:
+            result = parse(body.decode(encoding or 'utf-8', errors='replace'), url)
+        except Exception as e:
+            print(f"Error scraping {url}: {str(e)}")
+            result = None
+        METRICS.observe('parse.total', time.perf_counter() - start)
+    return result, samples
+
+
+class Crawler:
+    """Asyncio crawl engine with separate fetch and parse stages.
+
+    URLs are consumed as one continuous stream: fetch slots (threads sharing
+    one keep-alive pool) only download raw bytes, and a process pool turns
+    them into listing dicts with `parse(html, url)`. The queue between the
+    stages is bounded, so fetching pauses whenever parsing falls behind.
+
+    With a ListingCache, pages come from disk or a conditional GET; in
+    incremental mode ads whose page has not changed are not parsed again.
+
+    Every network request is paced by an AdaptiveRateLimiter, retried with
+    jittered backoff on 429/5xx and connection errors, and held back while
+    the CircuitBreaker is open.
+    """
+
+    def __init__(self, parse, concurrency=CONCURRENCY, per_host=PER_HOST, parse_workers=PARSE_WORKERS,
+                 session=None, base_url=None, cache=None, incremental=False, limiter=None, breaker=None):
+        self.parse = parse
+        self.concurrency = concurrency
+        self.per_host = min(per_host, concurrency)
+        self.parse_workers = parse_workers
+        self.session = session or make_session(concurrency)
+        self.base_url = base_url
+        self.cache = cache
+        self.incremental = incremental
+        self.limiter = limiter or AdaptiveRateLimiter()
+        self.breaker = breaker or CircuitBreaker()
+        self._host_limits = defaultdict(lambda: asyncio.Semaphore(self.per_host))
+
+    def _fetch(self, url):
+        if self.cache is not None:
+            return self.cache.fetch(url, self.session)
+        response = check_status(fetch(url, self.session))
+        return response.content, response.encoding, True
+
+    async def _fetch_with_retry(self, url, io_pool):
+        loop = asyncio.get_running_loop()
+        if self.cache is not None:
+            cached = self.cache.fresh(url)
+            if cached:
+                METRICS.count('cache.fresh')
+                return (*cached, False)
+        async for attempt in AsyncRetrying(**RETRY_POLICY):
+            with attempt:
+                start = time.perf_counter()
+                await self.breaker.acquire()
+                await self.limiter.acquire()
+                METRICS.observe('fetch.throttle', time.perf_counter() - start)
+                start = time.monotonic()
+                try:
+                    result = await loop.run_in_executor(io_pool, self._fetch, url)
+                except (RetryableStatus, requests.ConnectionError, requests.Timeout) as e:
+                    self.limiter.on_response_error(e)
+                    self.breaker.record_failure()
+                    raise
+                self.limiter.on_success(time.monotonic() - start)
+                self.breaker.record_success()
+                return result
+
+    async def _fetcher(self, urls, pages, io_pool):
+        while True:
+            url = await urls.get()
+            if url is None:
+                return
+            try:
+                async with self._host_limits[urlsplit(url).netloc]:
+                    body, encoding, changed = await self._fetch_with_retry(url, io_pool)
+            except Exception as e:
+                METRICS.count('failed')
+                print(f"Error scraping {url}: {e}")
+                continue
+            if self.incremental and not changed:
+                METRICS.count('unchanged')
+                continue
+            await pages.put((url, body, encoding))
+
+    async def _parser(self, pages, parse_pool, on_result):
+        loop = asyncio.get_running_loop()
+        while True:
+            page = await pages.get()
+            if page is None:
+                return
+            url, body, encoding = page
+            result, samples = await loop.run_in_executor(parse_pool, parse_page, self.parse, body, encoding, url)
+            METRICS.merge(samples)
+            if result:
+                METRICS.count('listings')
+                on_result(result)
+
+    async def _feed(self, urls, url_queue, fetchers):
+        for url in urls:
+            await url_queue.put(rebase_url(url, self.base_url))
+        for _ in range(fetchers):
+            await url_queue.put(None)
+
+    async def _close(self, fetchers, page_queue, consumers):
+        await asyncio.gather(*fetchers)
+        for _ in range(consumers):
+            await page_queue.put(None)
+
+    async def run(self, urls, on_result):
+        url_queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        parsers = max(self.parse_workers, 1) * 2
+        page_queue = asyncio.Queue(maxsize=parsers)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as io_pool:
+            # Forking once the fetch threads hold locks (the session's pool, the
+            # limiter) can deadlock a worker, so parse workers are spawned
+            parse_pool = (ProcessPoolExecutor(self.parse_workers, mp_context=multiprocessing.get_context('spawn'))
+                          if self.parse_workers else io_pool)
+            fetchers = [asyncio.create_task(self._fetcher(url_queue, page_queue, io_pool))
+                        for _ in range(self.concurrency)]
+            consumers = [asyncio.create_task(self._parser(page_queue, parse_pool, on_result))
+                         for _ in range(parsers)]
+            tasks = [asyncio.create_task(self._feed(urls, url_queue, len(fetchers))),
+                     asyncio.create_task(self._close(fetchers, page_queue, len(consumers))),
+                     *fetchers, *consumers]
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                # A failing stage (e.g. on_result raising) must not leave the others blocked on a queue
+                for task in tasks:
+                    task.cancel()
+                if parse_pool is not io_pool:
+                    parse_pool.shutdown(cancel_futures=True)
+
+
+def crawl(urls, parse, on_result=None, **kwargs):
+    """Crawl urls, passing each listing to on_result or returning them all"""
+    results = []
+    asyncio.run(Crawler(parse, **kwargs).run(urls, on_result or results.append))
+    return results
@@ -0,0 +1,336 @@
+import argparse
+import itertools
+import math
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+
+from normalize import MKD_PER_EUR
+from urls import ad_id_from_url
+
+# Precomputed aggregates over the cleaned listings for the dashboards: every
+# combination of DIMENSIONS (a full cube) keeps count, sum, min, max and a
+# quantile sketch of each measure, so slices and drill-downs are lookups.
+DIMENSIONS = ['manufacturer', 'model', 'year', 'fuel_type', 'location', 'mileage']
+# Prices are in EUR, MKD ones converted at the peg
+MEASURES = ['price_numeric', 'views']
+CUBE_PATH = 'listings_cube.pkl'
+CLEANED_CSV = 'sequential_car_listings_cleaned.csv'
+CHUNK_SIZE = 50_000
+# Up to this many new listings are folded in row by row: cheaper than 64
+# cuboids' worth of group-bys for a typical incremental update
+ROW_WISE_MAX = 5000
+# Quantiles are within this relative error of the exact value
+SKETCH_ACCURACY = 0.01
+SKETCH_GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+_LOG_GAMMA = math.log(SKETCH_GAMMA)
+# Bucket for zero and negative values, which have no logarithm
+ZERO_BUCKET = -(2 ** 31)
+
+
+def sketch_buckets(values):
+    """Sketch bucket of each value: values in bucket i lie in (gamma^(i-1), gamma^i]"""
+    values = np.asarray(values, dtype=float)
+    buckets = np.full(len(values), ZERO_BUCKET, dtype=np.int64)
+    positive = values > 0
+    buckets[positive] = np.ceil(np.log(values[positive]) / _LOG_GAMMA)
+    return buckets
+
+
+def bucket_value(bucket):
+    if bucket == ZERO_BUCKET:
+        return 0.0
+    return 2 * SKETCH_GAMMA ** bucket / (SKETCH_GAMMA + 1)
+
+
+class Stats:
+    """count/sum/min/max of one measure in one cell, plus a mergeable quantile sketch"""
+
+    __slots__ = ('count', 'sum', 'min', 'max', 'sketch')
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.sketch = {}
+
+    def update(self, count, total, low, high):
+        self.count += count
+        self.sum += total
+        self.min = min(self.min, low)
+        self.max = max(self.max, high)
+
+    def remove(self, value, bucket):
+        """Take one value back out; a min or max it held is then only known from the sketch"""
+        self.count -= 1
+        self.sum -= value
+        left = self.sketch[bucket] - 1
+        if left:
+            self.sketch[bucket] = left
+        else:
+            del self.sketch[bucket]
+        if not self.count:
+            self.sum = 0.0
+            self.min = math.inf
+            self.max = -math.inf
+            return
+        if value <= self.min:
+            self.min = min(bucket_value(min(self.sketch)), self.max)
+        if value >= self.max:
+            self.max = max(bucket_value(max(self.sketch)), self.min)
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for bucket in sorted(self.sketch):
+            seen += self.sketch[bucket]
+            if seen > rank:
+                return min(max(bucket_value(bucket), self.min), self.max)
+        return self.max
+
+
+class Cube:
+    """Full data cube over DIMENSIONS, built and extended from DataFrames.
+
+    add() folds new listings into every cuboid with a handful of group-bys
+    per cuboid. Listings already in the cube (by ad ID) are skipped when
+    unchanged, so the same CSV can be added twice; a listing whose price or
+    dimensions changed is taken out of its old cells and added again. A
+    cell that lost its min or max keeps it within SKETCH_ACCURACY.
+    """
+
+    def __init__(self, dimensions=DIMENSIONS, measures=MEASURES):
+        self.dimensions = list(dimensions)
+        self.measures = list(measures)
+        self.cuboids = {cuboid: {} for size in range(len(self.dimensions) + 1)
+                        for cuboid in itertools.combinations(self.dimensions, size)}
+        # Ad ID (as an int) -> the dimensions and measures it was added with
+        self.listings = {}
+        self.rows = 0
+
+    def _prepare(self, frame):
+        frame = frame.reindex(columns=['url', 'currency', *self.dimensions, *self.measures]).copy()
+        for dimension in self.dimensions:
+            column = frame[dimension]
+            if dimension == 'year':
+                column = pd.to_numeric(column, errors='coerce').astype('Int64')
+            frame[dimension] = column.astype(object).where(column.notna(), None)
+        for measure in self.measures:
+            frame[measure] = pd.to_numeric(frame[measure], errors='coerce')
+        if 'price_numeric' in self.measures:
+            in_mkd = (frame['currency'] == 'MKD').to_numpy(dtype=bool, na_value=False)
+            frame.loc[in_mkd, 'price_numeric'] = frame.loc[in_mkd, 'price_numeric'] / MKD_PER_EUR
+
+        # The last row of an ad wins; checked one by one, as isin() would copy the whole dict
+        ad_ids = [int(ad_id) if ad_id else None
+                  for ad_id in (ad_id_from_url(url) if isinstance(url, str) else None for url in frame['url'])]
+        rows = [tuple(None if isinstance(value, float) and math.isnan(value) else value for value in row)
+                for row in frame[[*self.dimensions, *self.measures]].itertuples(index=False, name=None)]
+        keep = np.zeros(len(frame), dtype=bool)
+        latest = {}
+        for position, ad_id in enumerate(ad_ids):
+            if ad_id is None:
+                keep[position] = True
+            else:
+                latest[ad_id] = position
+        for ad_id, position in latest.items():
+            known = self.listings.get(ad_id)
+            if known == rows[position]:
+                continue
+            if known is not None:
+                self._retract(known)
+            self.listings[ad_id] = rows[position]
+            keep[position] = True
+        frame = frame[keep]
+        for measure in self.measures:
+            frame[f'_{measure}_bucket'] = sketch_buckets(frame[measure].fillna(0))
+        frame['_all'] = 0
+        return frame
+
+    def _retract(self, row):
+        """Take a listing added earlier (its dimensions and measures) back out of every cuboid"""
+        dimensions = row[:len(self.dimensions)]
+        present = [(measure, value, int(sketch_buckets([value])[0]))
+                   for measure, value in zip(self.measures, row[len(self.dimensions):]) if value is not None]
+        for cuboid, cells in self.cuboids.items():
+            key = tuple(dimensions[self.dimensions.index(dimension)] for dimension in cuboid)
+            cell = cells[key]
+            cell['count'] -= 1
+            if not cell['count']:
+                del cells[key]
+                continue
+            for measure, value, bucket in present:
+                cell[measure].remove(value, bucket)
+        self.rows -= 1
+
+    def _cell(self, cells, key):
+        cell = cells.get(key)
+        if cell is None:
+            cell = cells[key] = {'count': 0, **{measure: Stats() for measure in self.measures}}
+        return cell
+
+    def _add_rows(self, frame):
+        layout = [(cells, [self.dimensions.index(dimension) for dimension in cuboid])
+                  for cuboid, cells in self.cuboids.items()]
+        values = frame[self.measures].to_numpy(dtype=float)
+        buckets = frame[[f'_{measure}_bucket' for measure in self.measures]].to_numpy()
+        for dimensions, row_values, row_buckets in zip(frame[self.dimensions].itertuples(index=False, name=None),
+                                                       values, buckets):
+            present = [(measure, float(value), int(bucket)) for measure, value, bucket
+                       in zip(self.measures, row_values, row_buckets) if not math.isnan(value)]
+            for cells, positions in layout:
+                cell = self._cell(cells, tuple(dimensions[position] for position in positions))
+                cell['count'] += 1
+                for measure, value, bucket in present:
+                    stats = cell[measure]
+                    stats.update(1, value, value, value)
+                    stats.sketch[bucket] = stats.sketch.get(bucket, 0) + 1
+
+    def add(self, frame):
+        """Fold a DataFrame of cleaned listings into the cube; returns the rows added"""
+        frame = self._prepare(frame)
+        if frame.empty:
+            return 0
+        if len(frame) <= ROW_WISE_MAX:
+            self._add_rows(frame)
+            self.rows += len(frame)
+            return len(frame)
+        for cuboid, cells in self.cuboids.items():
+            # The apex cuboid groups everything under one constant key
+            keys = list(cuboid) or ['_all']
+            key_of = _key if cuboid else (lambda key: ())
+            for key, size in frame.groupby(keys, dropna=False, sort=False).size().items():
+                self._cell(cells, key_of(key))['count'] += int(size)
+            for measure in self.measures:
+                valid = frame[frame[measure].notna()]
+                if valid.empty:
+                    continue
+                aggregates = valid.groupby(keys, dropna=False, sort=False)[measure].agg(['count', 'sum', 'min', 'max'])
+                for key, row in zip(aggregates.index, aggregates.itertuples(index=False)):
+                    cells[key_of(key)][measure].update(int(row.count), row.sum, row.min, row.max)
+                buckets = valid.groupby([*keys, f'_{measure}_bucket'], dropna=False, sort=False).size()
+                for key, size in buckets.items():
+                    sketch = cells[key_of(key[:-1] if len(keys) > 1 else key[0])][measure].sketch
+                    sketch[key[-1]] = sketch.get(key[-1], 0) + int(size)
+        self.rows += len(frame)
+        return len(frame)
+
+    def query(self, by=(), where=None, measures=None, quantiles=(0.5, 0.9)):
+        """Aggregates grouped by `by`, restricted to `where` ({dimension: value or list of values}).
+
+        Answered from the smallest cuboid covering both, without touching
+        the listings; returns a DataFrame with one row per group.
+        """
+        where = where or {}
+        by = list(by)
+        cuboid = tuple(dimension for dimension in self.dimensions if dimension in by or dimension in where)
+        cells = self.cuboids[cuboid]
+        filters = [(cuboid.index(dimension), set(value) if isinstance(value, (list, tuple, set)) else {value})
+                   for dimension, value in where.items()]
+        positions = [cuboid.index(dimension) for dimension in by]
+        groups = {}
+        for key, cell in cells.items():
+            if all(key[position] in values for position, values in filters):
+                groups.setdefault(tuple(key[position] for position in positions), []).append(cell)
+
+        rows = []
+        for group, members in groups.items():
+            row = dict(zip(by, group))
+            row['count'] = sum(cell['count'] for cell in members)
+            for measure in measures or self.measures:
+                stats = merge_stats([cell[measure] for cell in members])
+                row[f'{measure}_count'] = stats.count
+                row[f'{measure}_mean'] = stats.sum / stats.count if stats.count else None
+                row[f'{measure}_min'] = stats.min if stats.count else None
+                row[f'{measure}_max'] = stats.max if stats.count else None
+                for q in quantiles:
+                    row[f'{measure}_p{round(q * 100)}'] = stats.quantile(q)
+            rows.append(row)
+        result = pd.DataFrame(rows, columns=None if rows else [*by, 'count'])
+        if 'year' in by:
+            result['year'] = result['year'].astype('Int64')
+        return result.sort_values(by).reset_index(drop=True) if by and rows else result
+
+    def save(self, path=CUBE_PATH):
+        with open(path, 'wb') as file:
+            pickle.dump(self, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path=CUBE_PATH):
+        with open(path, 'rb') as file:
+            return pickle.load(file)
+
+
+def merge_stats(members):
+    if len(members) == 1:
+        return members[0]
+    merged = Stats()
+    for stats in members:
+        if not stats.count:
+            continue
+        merged.update(stats.count, stats.sum, stats.min, stats.max)
+        for bucket, count in stats.sketch.items():
+            merged.sketch[bucket] = merged.sketch.get(bucket, 0) + count
+    return merged
+
+
+def add_files(cube, paths, chunk_size=CHUNK_SIZE):
+    """Add cleaned CSVs (or Parquet files/datasets) to cube, chunk by chunk for CSVs"""
+    added = 0
+    for path in paths:
+        if path.endswith('.csv'):
+            for chunk in pd.read_csv(path, chunksize=chunk_size):
+                added += cube.add(chunk)
+        else:
+            from storage import load_listings
+            added += cube.add(load_listings(path, columns=['url', *cube.dimensions, *cube.measures]))
+    return added
+
+
+def _key(key):
+    """Group-by index entry as a cell key, with None for missing values"""
+    key = key if isinstance(key, tuple) else (key,)
+    return tuple(None if isinstance(value, float) and math.isnan(value) else value for value in key)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precomputed aggregates over the cleaned listings")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="build the cube, or add new listings to it with --update")
+    build.add_argument('csv', nargs='*', default=[CLEANED_CSV])
+    build.add_argument('--update', action='store_true', help=f"add to the existing {CUBE_PATH}")
+    query = commands.add_parser('query', help="e.g. query --by year fuel_type --where manufacturer=VW")
+    query.add_argument('--by', nargs='*', default=[], choices=DIMENSIONS)
+    query.add_argument('--where', nargs='*', default=[], metavar='DIMENSION=VALUE')
+    query.add_argument('--measure', nargs='*', default=MEASURES, choices=MEASURES)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        start = time.perf_counter()
+        cube = Cube.load() if args.update else Cube()
+        added = add_files(cube, args.csv)
+        cube.save()
+        cells = sum(len(cells) for cells in cube.cuboids.values())
+        print(f"Added {added} listings ({cube.rows} total) into {len(cube.cuboids)} cuboids, "
+              f"{cells} cells, in {time.perf_counter() - start:.2f}s")
+        return
+
+    cube = Cube.load()
+    where = {}
+    for condition in args.where:
+        dimension, value = condition.split('=', 1)
+        where[dimension] = int(value) if dimension == 'year' else value
+    start = time.perf_counter()
+    result = cube.query(args.by, where, args.measure)
+    elapsed = time.perf_counter() - start
+    print(result.to_string(index=False))
+    print(f"{len(result)} rows in {elapsed * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
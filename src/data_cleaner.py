@@ -1,19 +1,36 @@
 import pandas as pd
 import numpy as np
 import re
+import argparse
+import glob
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import pyarrow.parquet as pq
+from storage import save_listings, to_table
+from dedup import collapse_reposts
+from normalize import normalize_frame
+
+# Rows per chunk when cleaning many files out of core
+CHUNK_SIZE = 50_000
+
+# Common price patterns in Macedonian listings, matched against lowercased text
+PRICE_PATTERNS = [
+    re.compile(r'(?:цена|cena|CENA)[:\s]*?(\d+(?:,\d+)?(?:\.\d+)?)'),  # Price after цена/cena
+    re.compile(r'(\d+(?:,\d+)?(?:\.\d+)?)\s*(?:€|eur|EUR)'),  # Number before € symbol
+]
 
 def extract_price(text):
     """Extract price from text using various patterns"""
     if pd.isna(text):
         return 0
-    
+
     # Common price patterns in Macedonian listings
     patterns = [
         r'(?:цена|cena|CENA)[:\s]*?(\d+(?:,\d+)?(?:\.\d+)?)',  # Price after цена/cena
         r'(\d+(?:,\d+)?(?:\.\d+)?)\s*(?:€|eur|EUR)',  # Number before € symbol
         r'(?:цена|cena|CENA)[:\s]*?(\d+)(?:\s*(?:€|eur|EUR))?',  # Just the number after price indicator
     ]
-    
+
     for pattern in patterns:
         matches = re.findall(pattern, text.lower())
         if matches:
@@ -24,45 +41,190 @@ def extract_price(text):
                 continue
     return 0
 
-# Load both CSV files
-try:
-    df1 = pd.read_csv('sequential_car_listings.csv')
-    df2 = pd.read_csv('sequential_car_listings2.csv')
-    print(f"Loaded data shapes: df1={df1.shape}, df2={df2.shape}")
-    
-    # Concatenate the dataframes
-    df = pd.concat([df1, df2], ignore_index=True)
-    print(f"Combined shape: {df.shape}")
-    
-except Exception as e:
-    print(f"Error loading CSV files: {e}")
-    exit(1)
-
-# Remove duplicates based on URL
-df = df.drop_duplicates(subset='url', keep='first')
-print(f"Shape after removing duplicates: {df.shape}")
-
-# Only fill missing or zero prices
-df['price_numeric'] = df.apply(
-    lambda row: extract_price(row['description']) if (pd.isna(row['price_numeric']) or row['price_numeric'] == 0) else row['price_numeric'],
-    axis=1
-)
-
-# Basic cleaning
-df['year'] = pd.to_numeric(df['year'], errors='coerce')
-df['views'] = pd.to_numeric(df['views'], errors='coerce')
-
-# Standardize currency to EUR if possible
-df['currency'] = df['currency'].fillna('EUR')
-df['currency'] = df['currency'].str.upper()
-
-# Save the cleaned data
-df.to_csv('sequential_car_listings_cleaned.csv', index=False)
-print("Data cleaning complete. Cleaned data saved to 'sequential_car_listings_cleaned.csv'")
-
-# Print some statistics
-print("\nBasic statistics:")
-print(f"Total listings: {len(df)}")
-print(f"Unique years: {df['year'].nunique()}")
-print(f"Average price: {df['price_numeric'].mean():.2f}")
-print(f"Missing prices: {df['price_numeric'].isna().sum()}")
\ No newline at end of file
+def extract_prices(descriptions):
+    """Vectorized extract_price over a Series of descriptions.
+
+    Each pattern only runs on the rows the previous ones left unmatched, so
+    a price after цена/cena still wins over an earlier "... €". The third
+    pattern of extract_price can only match where the first already did,
+    so it is not needed here.
+    """
+    text = descriptions.astype(object).str.lower()
+    prices = pd.Series(np.nan, index=descriptions.index, dtype=object)
+    for pattern in PRICE_PATTERNS:
+        missing = prices.isna() & text.notna()
+        if not missing.any():
+            break
+        prices[missing] = text[missing].str.extract(pattern, expand=False)
+    result = pd.Series(0.0, index=descriptions.index)
+    found = prices.notna()
+    result[found] = prices[found].str.replace(',', '', regex=False).map(float)
+    return result
+
+def fill_missing_prices(df):
+    # Only fill missing or zero prices
+    missing = df['price_numeric'].isna() | (df['price_numeric'] == 0)
+    df['price_numeric'] = df['price_numeric'].astype(float)
+    df.loc[missing, 'price_numeric'] = extract_prices(df.loc[missing, 'description'])
+    return df
+
+def clean_chunk(df):
+    df = fill_missing_prices(df)
+
+    # Basic cleaning
+    df['year'] = pd.to_numeric(df['year'], errors='coerce').astype(float)
+    df['views'] = pd.to_numeric(df['views'], errors='coerce').astype(float)
+
+    # Standardize currency to EUR if possible
+    df['currency'] = df['currency'].fillna('EUR')
+    df['currency'] = df['currency'].str.upper()
+
+    # Mileage brackets, engine sizes, registration dates and seller labels, once per distinct value
+    return normalize_frame(df)
+
+def read_columns(paths):
+    """Union of the CSV headers, in first-seen order, without reading the data"""
+    columns = []
+    for path in paths:
+        for column in pd.read_csv(path, nrows=0).columns:
+            if column not in columns:
+                columns.append(column)
+    for column in ['description', 'price_numeric', 'year', 'views', 'currency']:
+        if column not in columns:
+            columns.append(column)
+    return columns
+
+def dedup_chunk(df, seen):
+    """Drop listings already seen in this or an earlier chunk.
+
+    Listings are keyed by their numeric ad ID, so `seen` holds one int per
+    ad instead of a URL string; URLs without an ID fall back to the URL.
+    """
+    urls = df['url'].astype(object)
+    ids = urls.str.extract(r'/ad/(\d+)', expand=False)
+    keys = pd.Series([int(ad_id) if isinstance(ad_id, str) else url for ad_id, url in zip(ids, urls)],
+                     index=df.index, dtype=object)
+    keep = ~keys.duplicated() & ~keys.isin(seen)
+    seen.update(keys[keep])
+    return df[keep]
+
+def clean_files(pattern, output, chunk_size=CHUNK_SIZE, workers=0, parquet=None):
+    """Clean every CSV matching pattern into output, chunk_size rows at a time.
+
+    Memory is bounded by the chunk size (times workers + 1 chunks in
+    flight), not by the corpus: only the set of seen ad IDs grows with it.
+    With workers > 0 chunks are cleaned in parallel processes but written
+    in input order, so the first copy of a listing is still the one kept.
+    """
+    paths = sorted(glob.glob(pattern))
+    if not paths:
+        print(f"No files match {pattern}")
+        return None
+    columns = read_columns(paths)
+    seen = set()
+    stats = {'rows': 0, 'kept': 0, 'price_sum': 0.0, 'price_missing': 0, 'years': set()}
+    writer = None
+
+    def chunks():
+        for path in paths:
+            for chunk in pd.read_csv(path, chunksize=chunk_size):
+                stats['rows'] += len(chunk)
+                chunk = dedup_chunk(chunk, seen)
+                if len(chunk):
+                    yield chunk.reindex(columns=columns)
+
+    def write(chunk, first):
+        nonlocal writer
+        chunk.to_csv(output, mode='w' if first else 'a', header=first, index=False)
+        if parquet:
+            table = to_table(chunk)
+            writer = writer or pq.ParquetWriter(parquet, table.schema)
+            writer.write_table(table)
+        stats['kept'] += len(chunk)
+        stats['price_sum'] += chunk['price_numeric'].sum()
+        stats['price_missing'] += chunk['price_numeric'].isna().sum()
+        stats['years'].update(chunk['year'].dropna().unique())
+
+    first = True
+    if workers:
+        with ProcessPoolExecutor(workers) as executor:
+            pending = deque()
+            for chunk in chunks():
+                pending.append(executor.submit(clean_chunk, chunk))
+                if len(pending) > workers:
+                    write(pending.popleft().result(), first)
+                    first = False
+            while pending:
+                write(pending.popleft().result(), first)
+                first = False
+    else:
+        for chunk in chunks():
+            write(clean_chunk(chunk), first)
+            first = False
+    if writer:
+        writer.close()
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Clean scraped car listings")
+    parser.add_argument('--input', help="glob of scraper CSVs to clean in chunks, e.g. 'parallel_car_listings*.csv'")
+    parser.add_argument('--output', default='sequential_car_listings_cleaned.csv')
+    parser.add_argument('--parquet', default='sequential_car_listings_cleaned.parquet',
+                        help="typed Parquet copy of the output; empty to skip")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--workers', type=int, default=0, help="processes cleaning chunks in parallel")
+    parser.add_argument('--reposts', action='store_true',
+                        help="keep one listing per repost cluster (same car under new ad IDs), see dedup.py")
+    args = parser.parse_args()
+    if args.input and args.reposts:
+        parser.error("--reposts needs the whole corpus at once; run dedup.py on the cleaned --input output instead")
+    if args.input:
+        stats = clean_files(args.input, args.output, args.chunk_size, args.workers, args.parquet or None)
+        if stats:
+            print(f"Cleaned {stats['rows']} rows into {stats['kept']} listings in '{args.output}'")
+            print(f"Unique years: {len(stats['years'])}")
+            print(f"Average price: {stats['price_sum'] / max(stats['kept'] - stats['price_missing'], 1):.2f}")
+            print(f"Missing prices: {stats['price_missing']}")
+        return
+
+    # Load both CSV files
+    try:
+        df1 = pd.read_csv('sequential_car_listings.csv')
+        df2 = pd.read_csv('sequential_car_listings2.csv')
+        print(f"Loaded data shapes: df1={df1.shape}, df2={df2.shape}")
+
+        # Concatenate the dataframes
+        df = pd.concat([df1, df2], ignore_index=True)
+        print(f"Combined shape: {df.shape}")
+
+    except Exception as e:
+        print(f"Error loading CSV files: {e}")
+        exit(1)
+
+    # Remove duplicates based on URL
+    df = df.drop_duplicates(subset='url', keep='first')
+    print(f"Shape after removing duplicates: {df.shape}")
+
+    # Reposts of the same car under new ad IDs would count it several times
+    if args.reposts:
+        df = collapse_reposts(df)
+        print(f"Shape after collapsing reposts: {df.shape}")
+
+    df = clean_chunk(df)
+
+    # Save the cleaned data
+    df.to_csv(args.output, index=False)
+    # Typed columnar copy: lists, coordinates and categoricals load without re-parsing
+    if args.parquet:
+        save_listings(df, args.parquet)
+    print(f"Data cleaning complete. Cleaned data saved to '{args.output}'")
+
+    # Print some statistics
+    print("\nBasic statistics:")
+    print(f"Total listings: {len(df)}")
+    print(f"Unique years: {df['year'].nunique()}")
+    print(f"Average price: {df['price_numeric'].mean():.2f}")
+    print(f"Missing prices: {df['price_numeric'].isna().sum()}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+import argparse
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+from normalize import MKD_PER_EUR
+
+
+# Reposts: the same car put up again under a new ad ID. Listings are
+# clustered when their title+description are near-duplicates (MinHash over
+# character shingles, with LSH banding so only listings that share a band
+# are ever compared) and their specs agree, when they share a photo URL, or
+# when phone, title and year are identical. Everything is bucketed, never
+# compared pairwise.
+SHINGLE_SIZE = 5
+# Signature length; a power of two, as shingles are binned by their low bits
+NUM_PERM = 128
+# BANDS * ROWS == NUM_PERM. With 16 bands of 8 rows, pairs at 0.8 Jaccard
+# become candidates ~95% of the time, pairs at 0.5 less than 7%
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+# Estimated Jaccard similarity a candidate pair needs to be a repost
+THRESHOLD = 0.8
+# Listings shingled at once; bounds the memory of the shingle arrays
+BATCH_SIZE = 20_000
+# A dealer's boilerplate makes all their ads near-duplicates, so a text match
+# also needs the same fuel, engine power within POWER_TOLERANCE and prices
+# within PRICE_BAND of each other (a repost is often a little cheaper)
+POWER_TOLERANCE = 0.05
+PRICE_BAND = 0.25
+
+PHOTO_URL = re.compile(r"https?://[^'\"\s,\]]+")
+# '110ks', '140 hp', '77kW' in a title
+POWER = re.compile(r'(\d{2,3})\s*(ks|кс|hp|ps|kw)\b', re.IGNORECASE)
+
+EMPTY = np.uint32(0xFFFFFFFF)
+_BAND_MULTIPLIERS = np.random.default_rng(17).integers(1, 2 ** 63, size=(BANDS, ROWS), dtype=np.uint64) | np.uint64(1)
+_DENSIFY_STEP = 0x9E3779B1
+
+
+def normalize_text(title, description):
+    text = f'{title if isinstance(title, str) else ""} {description if isinstance(description, str) else ""}'
+    return ' '.join(text.lower().split())
+
+
+def normalize_phone(phone):
+    if isinstance(phone, float) and phone.is_integer():
+        phone = str(int(phone))
+    digits = re.sub(r'\D', '', phone) if isinstance(phone, str) else ''
+    # 070123456 and +38970123456 are the same number
+    return digits[-8:] if len(digits) >= 8 else None
+
+
+def engine_power(title):
+    """Horsepower named in a title, kW converted; NaN if there is none"""
+    match = POWER.search(title) if isinstance(title, str) else None
+    if not match:
+        return np.nan
+    power = float(match.group(1))
+    return round(power * 1.36) if match.group(2).lower() == 'kw' else power
+
+
+def photo_urls(value):
+    """The images column of a listing: a list, or its repr as stored in the CSVs.
+
+    Same result as images.image_urls for photo URLs, without evaluating the repr.
+    """
+    if isinstance(value, str):
+        return PHOTO_URL.findall(value)
+    try:
+        return [url for url in value if isinstance(url, str) and url]
+    except TypeError:
+        return []
+
+
+def _mix(values):
+    """splitmix64 finalizer: spreads shingle hashes over all 64 bits"""
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xBF58476D1CE4E5B9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def _signatures(texts):
+    """MinHash signatures of a batch of texts, one row of NUM_PERM uint32s each.
+
+    One-permutation hashing: every shingle is hashed once and lands in one
+    of NUM_PERM bins by its low bits, each bin keeping its minimum; empty
+    bins borrow from the next non-empty bin (rotation densification), so a
+    signature costs one hash per shingle instead of NUM_PERM.
+    """
+    signatures = np.full((len(texts), NUM_PERM), EMPTY, dtype=np.uint32)
+    lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+    if not lengths.sum():
+        return signatures
+    chars = np.frombuffer(''.join(texts).encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    doc = np.repeat(np.arange(len(texts)), lengths)
+    count = len(chars) - SHINGLE_SIZE + 1
+    if count <= 0:
+        return signatures
+    # Polynomial hash of every SHINGLE_SIZE-char window, dropping windows spanning two texts
+    hashes = np.zeros(count, dtype=np.uint64)
+    for offset in range(SHINGLE_SIZE):
+        hashes = hashes * np.uint64(1_000_003) + chars[offset:offset + count]
+    valid = doc[:count] == doc[SHINGLE_SIZE - 1:]
+    hashes = _mix(hashes[valid])
+    rows = doc[:count][valid]
+    bins = (hashes & np.uint64(NUM_PERM - 1)).astype(np.intp)
+    np.minimum.at(signatures, (rows, bins), (hashes >> np.uint64(32)).astype(np.uint32))
+
+    shingled = (signatures != EMPTY).any(axis=1)
+    for step in range(1, NUM_PERM):
+        empty = (signatures == EMPTY) & shingled[:, None]
+        if not empty.any():
+            break
+        borrowed = np.roll(signatures, -step, axis=1)
+        fill = empty & (borrowed != EMPTY)
+        signatures[fill] = borrowed[fill] + np.uint32(_DENSIFY_STEP * step & 0xFFFFFFFF)
+    return signatures
+
+
+def minhash_signatures(texts, batch_size=BATCH_SIZE):
+    return np.vstack([_signatures(texts[start:start + batch_size]) for start in range(0, len(texts), batch_size)]
+                     or [np.empty((0, NUM_PERM), dtype=np.uint32)])
+
+
+def _star_edges(keys, valid):
+    """(first, other) pairs linking every row to the first row with the same key"""
+    rows = np.flatnonzero(valid)
+    if not len(rows):
+        return np.empty((2, 0), dtype=np.intp)
+    order = rows[np.argsort(keys[rows], kind='stable')]
+    sorted_keys = keys[order]
+    starts = np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]
+    first = order[np.maximum.accumulate(np.where(starts, np.arange(len(order)), 0))]
+    linked = ~starts
+    return np.vstack([first[linked], order[linked]])
+
+
+def candidate_pairs(signatures):
+    """Pairs of rows sharing at least one LSH band, as a star per band bucket"""
+    shingled = (signatures != EMPTY).any(axis=1)
+    edges = []
+    for band in range(BANDS):
+        rows = signatures[:, band * ROWS:(band + 1) * ROWS].astype(np.uint64)
+        keys = _mix((rows * _BAND_MULTIPLIERS[band]).sum(axis=1, dtype=np.uint64))
+        edges.append(_star_edges(keys, shingled))
+    # Listings sharing several bands would be compared once per band
+    count = np.int64(len(signatures))
+    keys = np.unique((np.hstack(edges).astype(np.int64) * np.array([[count], [1]])).sum(axis=0))
+    return np.vstack([keys // count, keys % count])
+
+
+def similar_pairs(signatures, pairs, threshold=THRESHOLD, batch_size=1_000_000):
+    """The candidate pairs whose signatures agree on at least `threshold` of the bins"""
+    keep = np.zeros(pairs.shape[1], dtype=bool)
+    for start in range(0, pairs.shape[1], batch_size):
+        left, right = pairs[:, start:start + batch_size]
+        keep[start:start + batch_size] = (signatures[left] == signatures[right]).mean(axis=1) >= threshold
+    return pairs[:, keep]
+
+
+def _compatible(values, pairs):
+    """Pairs where the two values agree, or either is missing"""
+    left, right = values[pairs[0]], values[pairs[1]]
+    return pd.isna(left) | pd.isna(right) | (left == right)
+
+
+def _within(values, pairs, tolerance):
+    """Pairs whose values differ by at most tolerance of the larger one, or where either is missing"""
+    left, right = values[pairs[0]], values[pairs[1]]
+    return np.isnan(left) | np.isnan(right) | (np.abs(left - right) <= tolerance * np.maximum(left, right))
+
+
+def _hash_keys(values):
+    values = pd.Series(values, dtype=object)
+    return pd.util.hash_array(values.fillna('').to_numpy()), values.notna().to_numpy()
+
+
+def connected_components(count, pairs):
+    """Component label (the smallest member row) of each of count rows"""
+    labels = np.arange(count)
+    if not pairs.size:
+        return labels
+    left, right = pairs
+    while True:
+        previous = labels.copy()
+        np.minimum.at(labels, left, labels[right])
+        np.minimum.at(labels, right, labels[left])
+        labels = labels[labels]
+        if np.array_equal(labels, previous):
+            return labels
+
+
+def find_reposts(df, threshold=THRESHOLD):
+    """Cluster ID of every listing in df, numbered 0.. in order of first appearance.
+
+    Listings in one cluster are reposts of the same car. Text matches only
+    count between listings whose phone, year, fuel, engine power and price
+    band agree (or where one is missing): a dealer's boilerplate makes
+    their ads near-duplicates whatever the car, so the text alone would
+    merge them.
+    """
+    count = len(df)
+    column = lambda name: df[name].to_numpy(dtype=object) if name in df else np.full(count, None, dtype=object)
+    titles, descriptions = column('title'), column('description')
+    texts = [normalize_text(title, description) for title, description in zip(titles, descriptions)]
+    phones = np.array([normalize_phone(phone) for phone in column('phone')], dtype=object)
+    years = pd.to_numeric(pd.Series(column('year')), errors='coerce').to_numpy()
+    fuels = np.array([fuel.strip().lower() if isinstance(fuel, str) else None for fuel in column('fuel_type')],
+                     dtype=object)
+    powers = np.array([engine_power(title) for title in titles], dtype=float)
+    prices = pd.to_numeric(pd.Series(column('price_numeric')), errors='coerce')
+    prices = prices.where(pd.Series(column('currency')) != 'MKD', prices / MKD_PER_EUR).where(prices > 0).to_numpy()
+
+    signatures = minhash_signatures(texts)
+    pairs = similar_pairs(signatures, candidate_pairs(signatures), threshold)
+    pairs = pairs[:, _compatible(phones, pairs) & _compatible(years, pairs) & _compatible(fuels, pairs)
+                  & _within(powers, pairs, POWER_TOLERANCE) & _within(prices, pairs, PRICE_BAND)]
+    edges = [pairs]
+
+    # A shared photo URL means the same ad's photos
+    images = pd.Series([photo_urls(value) for value in column('images')], dtype=object).explode()
+    keys, valid = _hash_keys(images.to_numpy())
+    photo_edges = _star_edges(keys, valid)
+    rows = images.index.to_numpy()
+    edges.append(rows[photo_edges])
+
+    # Same phone, title and year: a repost with a rewritten description
+    exact = [f'{phone}|{normalize_text(title, None)}|{year}' if phone and isinstance(title, str) else None
+             for phone, title, year in zip(phones, titles, years)]
+    edges.append(_star_edges(*_hash_keys(exact)))
+
+    labels = connected_components(count, np.hstack(edges))
+    _, clusters = np.unique(labels, return_inverse=True)
+    return pd.Series(clusters, index=df.index, name='cluster_id')
+
+
+def collapse_reposts(df, clusters=None):
+    """Keep the first listing of every repost cluster, with its cluster_id and repost count"""
+    clusters = find_reposts(df) if clusters is None else clusters
+    df = df.assign(cluster_id=clusters.to_numpy())
+    df['reposts'] = df.groupby('cluster_id')['cluster_id'].transform('size') - 1
+    return df.drop_duplicates(subset='cluster_id', keep='first')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cluster reposted listings (near-duplicate ads)")
+    parser.add_argument('listings', nargs='?', default='sequential_car_listings_cleaned.csv',
+                        help="scraper CSV, Parquet file or dataset")
+    parser.add_argument('--output', default='listing_clusters.csv', help="url and cluster_id of every listing")
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    args = parser.parse_args()
+
+    from storage import load_listings
+    df = load_listings(args.listings, columns=['url', 'title', 'description', 'phone', 'year', 'images', 'fuel_type',
+                                               'price_numeric', 'currency'])
+    start = time.perf_counter()
+    clusters = find_reposts(df, args.threshold)
+    elapsed = time.perf_counter() - start
+    df[['url']].assign(cluster_id=clusters).to_csv(args.output, index=False)
+    sizes = clusters.value_counts()
+    print(f"{len(df)} listings in {len(sizes)} clusters ({len(df) - len(sizes)} reposts, "
+          f"largest cluster {sizes.max() if len(sizes) else 0}) in {elapsed:.2f}s; saved to '{args.output}'")
+
+
+if __name__ == "__main__":
+    main()
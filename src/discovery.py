@@ -0,0 +1,141 @@
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from extract import ExtractionPlan, parse_html
+from fetch import get_session
+from ratelimit import AdaptiveRateLimiter, CircuitBreaker, fetch_with_retry
+from urls import BASE_URL, ad_id_from_url, ad_url, search_url
+
+FRONTIER_DB = 'frontier.sqlite'
+# Search pages fetched at once; the first wave is a single page and each
+# following wave doubles, so a refresh that hits known ads early stays cheap
+DISCOVERY_WORKERS = 8
+MAX_PAGES = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS frontier (
+    ad_id TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    page INTEGER,
+    discovered_at REAL NOT NULL,
+    done_at REAL
+)
+"""
+
+# Promoted ads in .top-positioned repeat on every page (code.md excludes
+# them too); they would make every page look like it had known ads
+SEARCH_PLAN = ExtractionPlan({
+    'ads': ('a[href*="/ad/"]', 'all'),
+    'promoted': ('.top-positioned a[href*="/ad/"]', 'all'),
+})
+
+
+class Frontier:
+    """Persistent, deduplicating queue of listing URLs keyed by ad ID.
+
+    Discovery adds ads as 'pending'; the listing crawl consumes pending ads
+    and marks them 'done' once saved. An ad is only ever added once, so
+    re-discovering it on a later search page is a no-op.
+    """
+
+    def __init__(self, path=FRONTIER_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(SCHEMA)
+
+    def add(self, urls, page=None):
+        """Add listing URLs, returning how many ads were new"""
+        now = time.time()
+        rows = [(ad_id, ad_url(ad_id), page, now) for ad_id in map(ad_id_from_url, urls) if ad_id]
+        with self._lock:
+            before = self.db.total_changes
+            self.db.executemany(
+                "INSERT OR IGNORE INTO frontier (ad_id, url, page, discovered_at) VALUES (?, ?, ?, ?)", rows)
+            self.db.commit()
+            return self.db.total_changes - before
+
+    def pending(self):
+        """URLs still to be scraped, oldest discovery first"""
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT url FROM frontier WHERE state = 'pending' ORDER BY discovered_at, page").fetchall()
+        return [row[0] for row in rows]
+
+    def mark_done(self, urls):
+        now = time.time()
+        with self._lock:
+            self.db.executemany("UPDATE frontier SET state = 'done', done_at = ? WHERE ad_id = ?",
+                                [(now, ad_id) for ad_id in map(ad_id_from_url, urls) if ad_id])
+            self.db.commit()
+
+    def counts(self):
+        with self._lock:
+            return dict(self.db.execute("SELECT state, COUNT(*) FROM frontier GROUP BY state").fetchall())
+
+    def close(self):
+        self.db.close()
+
+
+def extract_ad_urls(html):
+    """Listing URLs on a search results page, in page order and without repeats"""
+    found = SEARCH_PLAN.apply(parse_html(html))
+    promoted = {ad_id_from_url(link.get('href')) for link in found['promoted']}
+    ad_ids = []
+    for link in found['ads']:
+        ad_id = ad_id_from_url(link.get('href'))
+        if ad_id and ad_id not in promoted and ad_id not in ad_ids:
+            ad_ids.append(ad_id)
+    return [ad_url(ad_id) for ad_id in ad_ids]
+
+
+def fetch_search_page(page, base_url=BASE_URL, session=None, limiter=None, breaker=None):
+    try:
+        response = fetch_with_retry(search_url(page, base_url), session, limiter, breaker)
+        if response.status_code != 200:
+            return []
+        return extract_ad_urls(response.text)
+    except Exception as e:
+        print(f"Error fetching search page {page}: {str(e)}")
+        return None
+
+
+def discover(frontier, base_url=BASE_URL, max_pages=MAX_PAGES, workers=DISCOVERY_WORKERS,
+             session=None, limiter=None, full=False, breaker=None):
+    """Walk the search results into the frontier until they reach known ads.
+
+    Pages are fetched concurrently in waves but handled in page order:
+    discovery stops at the first page that has no ads (the end of the
+    results) or, unless `full`, no ads the frontier has not seen already.
+    Returns {'pages': fetched, 'new': ads added}.
+    """
+    session = session or get_session()
+    limiter = limiter or AdaptiveRateLimiter()
+    breaker = breaker or CircuitBreaker()
+    stats = {'pages': 0, 'new': 0}
+    page, wave = 1, 1
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while page <= max_pages:
+            pages = range(page, min(page + wave, max_pages + 1))
+            results = executor.map(lambda number: fetch_search_page(number, base_url, session, limiter, breaker), pages)
+            for number, urls in zip(pages, results):
+                stats['pages'] += 1
+                if urls is None:
+                    # A page that kept failing is skipped, not taken as the end
+                    continue
+                new = frontier.add(urls, number)
+                stats['new'] += new
+                if not urls or (not new and not full):
+                    return stats
+            page += wave
+            wave = min(wave * 2, workers)
+    return stats
+
+
+if __name__ == "__main__":
+    frontier = Frontier()
+    stats = discover(frontier)
+    print(f"Discovered {stats['new']} new ads on {stats['pages']} search pages; frontier: {frontier.counts()}")
@@ -0,0 +1,426 @@
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from discovery import Frontier, discover
+from fetch import make_session
+from pscraper import scrape_listing
+from ratelimit import MAX_ERROR_RATE, MAX_RATE, MIN_RATE, RATE, TARGET_LATENCY, CircuitBreaker
+from record import Listing
+from sink import open_sink
+from urls import BASE_URL, ad_id_from_url, ad_url, rebase_url
+
+# Coordinator/worker crawl: the coordinator discovers ads into a shared work
+# queue, workers on any number of machines lease batches of ads, scrape them
+# and hand back the listings with the acknowledgement. A SQLite file stands
+# in for the broker, which is enough for processes on one box.
+BROKER_DB = 'crawl_broker.sqlite'
+# Ads are spread over shards by ad ID; a worker drains its own shard first
+SHARDS = 16
+# A lease not renewed for this long is handed to another worker
+LEASE_SECONDS = 60.0
+BATCH_SIZE = 20
+# Attempts (leases) per ad before it is given up on
+MAX_ATTEMPTS = 3
+WORKER_THREADS = 4
+# How often the coordinator collects results and adjusts the request rate
+TICK = 1.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    ad_id TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    shard INTEGER NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, shard);
+CREATE TABLE IF NOT EXISTS results (
+    ad_id TEXT PRIMARY KEY,
+    worker TEXT,
+    listing TEXT NOT NULL,
+    received_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS control (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    rate REAL NOT NULL,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    requests INTEGER NOT NULL DEFAULT 0,
+    throttles INTEGER NOT NULL DEFAULT 0,
+    errors INTEGER NOT NULL DEFAULT 0,
+    closed INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+class Broker:
+    """Work queue, result inbox and shared request budget in one SQLite file.
+
+    Every state change is one IMMEDIATE transaction, so any number of
+    processes can lease, acknowledge and take tokens concurrently. Leases
+    expire instead of being released by a dying worker: an ad whose lease
+    ran out goes to the next worker that asks, up to MAX_ATTEMPTS times.
+    """
+
+    def __init__(self, path=BROKER_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        self.db.execute("INSERT OR IGNORE INTO control (id, rate, tokens, updated_at) VALUES (1, ?, 0, ?)",
+                        (RATE, time.time()))
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self._lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.db
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            self.db.execute("COMMIT")
+
+    def enqueue(self, urls, shards=SHARDS):
+        """Queue listing URLs by ad ID, returning how many were new"""
+        rows = [(ad_id, ad_url(ad_id), int(ad_id) % shards) for ad_id in map(ad_id_from_url, urls) if ad_id]
+        with self.transaction() as db:
+            before = db.total_changes
+            # Ads that failed, or were done but whose listing never reached the sink, are queued again
+            db.executemany("INSERT INTO tasks (ad_id, url, shard) VALUES (?, ?, ?) ON CONFLICT (ad_id) DO UPDATE "
+                           "SET state = 'pending', attempts = 0, worker = NULL, lease_until = NULL "
+                           "WHERE state = 'failed' OR (state = 'done' AND ad_id NOT IN (SELECT ad_id FROM results))",
+                           rows)
+            return db.total_changes - before
+
+    def close_queue(self, closed=True):
+        """No more ads will be queued; workers exit once the queue is drained"""
+        with self.transaction() as db:
+            db.execute("UPDATE control SET closed = ?", (int(closed),))
+
+    def lease(self, worker, count=BATCH_SIZE, shard=None, lease_seconds=LEASE_SECONDS):
+        """Up to count (ad_id, url) pending or expired tasks, from shard first"""
+        now = time.time()
+        available = ("(state = 'pending' OR (state = 'leased' AND lease_until < ?)) AND attempts < ?")
+        with self.transaction() as db:
+            db.execute("UPDATE tasks SET state = 'failed' WHERE state = 'leased' AND lease_until < ? AND attempts >= ?",
+                       (now, MAX_ATTEMPTS))
+            rows = []
+            if shard is not None:
+                rows = db.execute(f"SELECT ad_id, url FROM tasks WHERE {available} AND shard = ? LIMIT ?",
+                                  (now, MAX_ATTEMPTS, shard, count)).fetchall()
+            if not rows:
+                rows = db.execute(f"SELECT ad_id, url FROM tasks WHERE {available} LIMIT ?",
+                                  (now, MAX_ATTEMPTS, count)).fetchall()
+            db.executemany("UPDATE tasks SET state = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1 "
+                           "WHERE ad_id = ?", [(worker, now + lease_seconds, ad_id) for ad_id, _ in rows])
+        return rows
+
+    def renew(self, worker, ad_ids, lease_seconds=LEASE_SECONDS):
+        with self.transaction() as db:
+            db.executemany("UPDATE tasks SET lease_until = ? WHERE ad_id = ? AND worker = ? AND state = 'leased'",
+                           [(time.time() + lease_seconds, ad_id, worker) for ad_id in ad_ids])
+
+    def complete(self, worker, results):
+        """Store a batch of (ad_id, listing) and acknowledge those ads in one go.
+
+        A worker whose lease already expired still completes the ad: the
+        listing is the same whoever fetched it, and a later copy replaces it.
+        """
+        now = time.time()
+        with self.transaction() as db:
+            db.executemany("INSERT OR REPLACE INTO results (ad_id, worker, listing, received_at) VALUES (?, ?, ?, ?)",
+                           [(ad_id, worker, json.dumps(listing, ensure_ascii=False, default=str), now)
+                            for ad_id, listing in results])
+            db.executemany("UPDATE tasks SET state = 'done', worker = ?, lease_until = NULL "
+                           "WHERE ad_id = ? AND state != 'done'", [(worker, ad_id) for ad_id, _ in results])
+
+    def release(self, worker, ad_ids):
+        """Hand back ads that failed; they are retried until MAX_ATTEMPTS"""
+        with self.transaction() as db:
+            db.executemany("UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                           "lease_until = NULL WHERE ad_id = ? AND worker = ? AND state = 'leased'",
+                           [(MAX_ATTEMPTS, ad_id, worker) for ad_id in ad_ids])
+
+    def take_results(self, limit=1000):
+        """Remove and return up to limit (ad_id, listing) results"""
+        with self.transaction() as db:
+            rows = db.execute("SELECT ad_id, listing FROM results ORDER BY received_at LIMIT ?", (limit,)).fetchall()
+            db.executemany("DELETE FROM results WHERE ad_id = ?", [(ad_id,) for ad_id, _ in rows])
+        return [(ad_id, json.loads(listing)) for ad_id, listing in rows]
+
+    def has_results(self):
+        with self._lock:
+            return self.db.execute("SELECT 1 FROM results LIMIT 1").fetchone() is not None
+
+    def counts(self):
+        with self._lock:
+            return dict(self.db.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall())
+
+    def finished(self):
+        """Queue closed and nothing left pending or leased"""
+        with self._lock:
+            closed = self.db.execute("SELECT closed FROM control").fetchone()[0]
+            busy = self.db.execute("SELECT 1 FROM tasks WHERE state IN ('pending', 'leased') LIMIT 1").fetchone()
+        return bool(closed) and busy is None
+
+    def reserve(self):
+        """Take a token from the shared budget; returns how long to wait before using it"""
+        with self.transaction() as db:
+            rate, tokens, updated_at = db.execute("SELECT rate, tokens, updated_at FROM control").fetchone()
+            now = time.time()
+            tokens = min(max(1.0, rate), tokens + (now - updated_at) * rate) - 1
+            db.execute("UPDATE control SET tokens = ?, updated_at = ?, requests = requests + 1", (tokens, now))
+        return 0.0 if tokens >= 0 else -tokens / rate
+
+    def report(self, throttles=0, errors=0, pause=None):
+        """Record throttled and failed requests; pause empties the budget for that many seconds"""
+        with self.transaction() as db:
+            db.execute("UPDATE control SET throttles = throttles + ?, errors = errors + ?", (throttles, errors))
+            if pause:
+                db.execute("UPDATE control SET tokens = MIN(tokens, -? * rate)", (pause,))
+
+    def control(self):
+        with self._lock:
+            row = self.db.execute("SELECT rate, requests, throttles, errors FROM control").fetchone()
+        return dict(zip(('rate', 'requests', 'throttles', 'errors'), row))
+
+    def set_rate(self, rate):
+        with self.transaction() as db:
+            db.execute("UPDATE control SET rate = ?", (rate,))
+
+    def close(self):
+        self.db.close()
+
+
+class SharedRateLimiter:
+    """Limiter for fetch_with_retry that takes its tokens from the broker's budget.
+
+    Workers only report 429s, slow responses and errors; the coordinator
+    turns them into the one rate every worker shares (see govern()).
+    """
+
+    def __init__(self, broker, target_latency=TARGET_LATENCY):
+        self.broker = broker
+        self.target_latency = target_latency
+
+    def wait(self):
+        delay = self.broker.reserve()
+        if delay:
+            time.sleep(delay)
+
+    def on_success(self, latency):
+        if latency > self.target_latency:
+            self.on_throttle()
+
+    def on_throttle(self, retry_after=None):
+        self.broker.report(throttles=1, pause=retry_after)
+
+    def on_error(self):
+        self.broker.report(errors=1)
+
+    def on_response_error(self, error):
+        if getattr(error, 'status', None) == 429:
+            self.on_throttle(error.retry_after)
+        else:
+            self.on_error()
+
+
+class Governor:
+    """AIMD on the shared rate, from the counters the workers report.
+
+    Like AdaptiveRateLimiter, but once per tick for the whole crawl: any
+    throttle, or an error rate above MAX_ERROR_RATE, halves the rate;
+    otherwise it doubles every tick until the first throttle and grows
+    by `increase` after, never above the politeness budget max_rate.
+    """
+
+    def __init__(self, broker, max_rate=MAX_RATE, min_rate=MIN_RATE, increase=0.5):
+        self.broker = broker
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.increase = increase
+        self.slow_start = True
+        self.last = broker.control()
+        self.rate = min(self.last['rate'], max_rate)
+        broker.set_rate(self.rate)
+
+    def tick(self):
+        now = self.broker.control()
+        requests, throttles, errors = (now[key] - self.last[key] for key in ('requests', 'throttles', 'errors'))
+        self.last = now
+        if throttles or (requests and errors / requests > MAX_ERROR_RATE):
+            self.slow_start = False
+            self.rate = max(self.min_rate, self.rate / 2)
+        elif requests:
+            self.rate = min(self.max_rate, self.rate * 2 if self.slow_start else self.rate + self.increase)
+        self.broker.set_rate(self.rate)
+        return requests
+
+
+def run_worker(broker_path=BROKER_DB, worker=None, shard=None, threads=WORKER_THREADS, batch_size=BATCH_SIZE,
+               base_url=None, lease_seconds=LEASE_SECONDS):
+    """Lease, scrape and acknowledge batches of ads until the coordinator's queue is drained"""
+    worker = worker or f'{socket.gethostname()}:{os.getpid()}'
+    broker = Broker(broker_path)
+    limiter = SharedRateLimiter(broker)
+    breaker = CircuitBreaker()
+    session = make_session(threads)
+    held = []
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(lease_seconds / 3):
+            if held:
+                broker.renew(worker, list(held), lease_seconds)
+
+    def scrape(task):
+        ad_id, url = task
+        return ad_id, scrape_listing(rebase_url(url, base_url) if base_url else url, session, limiter, breaker)
+
+    renewer = threading.Thread(target=heartbeat, daemon=True)
+    renewer.start()
+    scraped = 0
+    try:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            while True:
+                tasks = broker.lease(worker, batch_size, shard, lease_seconds)
+                if not tasks:
+                    if broker.finished():
+                        break
+                    time.sleep(1.0)
+                    continue
+                held[:] = [ad_id for ad_id, _ in tasks]
+                results = list(pool.map(scrape, tasks))
+                broker.complete(worker, [(ad_id, listing) for ad_id, listing in results if listing])
+                broker.release(worker, [ad_id for ad_id, listing in results if not listing])
+                held[:] = []
+                scraped += sum(1 for _, listing in results if listing)
+    finally:
+        stop.set()
+        broker.close()
+    return scraped
+
+
+def start_local_workers(count, broker_path=BROKER_DB, **options):
+    """Worker processes on this machine, one shard each to start with"""
+    context = multiprocessing.get_context('spawn')
+    workers = []
+    for number in range(count):
+        process = context.Process(target=run_worker, args=(os.path.abspath(broker_path),),
+                                  kwargs={'worker': f'{socket.gethostname()}:local{number}',
+                                          'shard': number % SHARDS, **options}, daemon=True)
+        process.start()
+        workers.append(process)
+    return workers
+
+
+def _govern(governor, stop):
+    while not stop.wait(TICK):
+        governor.tick()
+
+
+def run_coordinator(output='distributed_car_listings.csv', broker_path=BROKER_DB, base_url=BASE_URL, full=False,
+                    workers=0, max_rate=MAX_RATE, on_tick=None, **worker_options):
+    """Discover ads into the broker, collect the workers' listings into output.
+
+    With workers > 0 that many local worker processes are started (and
+    restarted if they die while ads remain); remote workers can join at
+    any time with `python distributed.py worker --broker PATH`. Returns
+    the final task counts.
+    """
+    broker = Broker(broker_path)
+    broker.close_queue(False)
+    frontier = Frontier()
+    governor = Governor(broker, max_rate)
+    # Search pages draw on the same budget as the workers' listing pages,
+    # so discovery is governed too
+    stop = threading.Event()
+    ticker = threading.Thread(target=_govern, args=(governor, stop), daemon=True)
+    ticker.start()
+    try:
+        stats = discover(frontier, base_url, full=full, limiter=SharedRateLimiter(broker))
+    finally:
+        stop.set()
+        ticker.join()
+    print(f"Discovered {stats['new']} new ads on {stats['pages']} search pages")
+
+    saved = []
+    with open_sink(output) as sink:
+        completed = sink.completed()
+        queued = broker.enqueue(url for url in frontier.pending() if ad_id_from_url(url) not in completed)
+        broker.close_queue()
+        print(f"Queued {queued} ads; {len(completed)} already saved")
+        worker_options['base_url'] = None if base_url == BASE_URL else base_url
+        processes = start_local_workers(workers, broker_path, **worker_options)
+        start = time.monotonic()
+        while True:
+            time.sleep(TICK)
+            requests = governor.tick()
+            for _, listing in broker.take_results():
+                record = Listing.from_dict(listing)
+                sink.write(record)
+                saved.append(record['url'])
+            finished = broker.finished()
+            for number, process in enumerate(processes):
+                if not process.is_alive() and not finished:
+                    # Its leased ads are redelivered once the leases expire
+                    print(f"\nWorker {number} exited with {process.exitcode}; starting another")
+                    processes[number] = start_local_workers(1, broker_path, **worker_options)[0]
+            counts = broker.counts()
+            print(f"\r[{time.monotonic() - start:6.1f}s] {len(saved)} saved, {counts.get('pending', 0)} pending, "
+                  f"{counts.get('leased', 0)} leased, {counts.get('failed', 0)} failed; "
+                  f"rate {governor.rate:.1f}/s ({requests} requests)", end='', flush=True)
+            if on_tick:
+                on_tick(broker, processes)
+            if finished and not broker.has_results():
+                break
+    print()
+    for process in processes:
+        process.join(timeout=10)
+    frontier.mark_done(saved)
+    counts = broker.counts()
+    broker.close()
+    frontier.close()
+    print(f"Saved {sink.written} listings; queue: {counts}")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Coordinator/worker crawl over a shared SQLite work queue")
+    commands = parser.add_subparsers(dest='command', required=True)
+    coordinator = commands.add_parser('coordinator', help="discover ads, queue them and collect the listings")
+    coordinator.add_argument('--output', default='distributed_car_listings.csv')
+    coordinator.add_argument('--workers', type=int, default=0, help="local worker processes to start")
+    coordinator.add_argument('--max-rate', type=float, default=MAX_RATE,
+                             help="politeness budget: requests/sec across all workers")
+    coordinator.add_argument('--full', action='store_true', help="walk every search page, not just the new ones")
+    worker = commands.add_parser('worker', help="scrape ads from the queue until it is drained")
+    worker.add_argument('--shard', type=int, default=None)
+    worker.add_argument('--threads', type=int, default=WORKER_THREADS)
+    for command in (coordinator, worker):
+        command.add_argument('--broker', default=BROKER_DB)
+        command.add_argument('--base-url', default=BASE_URL)
+    args = parser.parse_args()
+
+    if args.command == 'coordinator':
+        run_coordinator(args.output, args.broker, args.base_url, args.full, args.workers, args.max_rate)
+    else:
+        scraped = run_worker(args.broker, shard=args.shard, threads=args.threads,
+                             base_url=None if args.base_url == BASE_URL else args.base_url)
+        print(f"Scraped {scraped} listings")
+
+
+if __name__ == "__main__":
+    main()
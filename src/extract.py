@@ -0,0 +1,171 @@
+import re
+
+import lxml.html
+
+# A small compiled subset of CSS, enough for the listing-page selectors:
+# tag, .class, #id, [attr], [attr=v], [attr^=v], [attr$=v], [attr*=v],
+# :not(<simple selector>) and the descendant / child combinators.
+TOKEN = re.compile(r'''
+    (?P<combinator>\s*>\s*|\s+)
+  | (?P<tag>[a-zA-Z][\w-]*|\*)
+  | \.(?P<cls>[\w-]+)
+  | \#(?P<id>[\w-]+)
+  | \[(?P<attr>[\w-]+)(?:(?P<op>[\^$*]?=)["']?(?P<value>[^"'\]]*)["']?)?\]
+  | :not\((?P<neg>[^)]*)\)
+''', re.VERBOSE)
+
+ATTR_TESTS = {
+    None: lambda actual, value: True,
+    '=': lambda actual, value: actual == value,
+    '^=': lambda actual, value: bool(value) and actual.startswith(value),
+    '$=': lambda actual, value: bool(value) and actual.endswith(value),
+    '*=': lambda actual, value: bool(value) and value in actual,
+}
+
+# Text under these tags is not part of BeautifulSoup's get_text()
+SKIP_TEXT = {'script', 'style', 'template'}
+
+
+class Compound:
+    """One simple selector sequence, e.g. span.format-money-int[value]"""
+
+    def __init__(self):
+        self.tag = None
+        self.classes = []
+        self.attrs = []
+        self.negations = []
+
+    def matches(self, el):
+        if self.tag and el.tag != self.tag:
+            return False
+        if self.classes:
+            classes = el.get('class', '').split()
+            if not all(cls in classes for cls in self.classes):
+                return False
+        for name, test, value in self.attrs:
+            actual = el.get(name)
+            if actual is None or not test(actual, value):
+                return False
+        return not any(neg.matches(el) for neg in self.negations)
+
+
+class Selector:
+    """CSS selector compiled once into compounds matched right to left"""
+
+    def __init__(self, css):
+        self.css = css
+        self.compounds = [Compound()]
+        self.combinators = [None]
+        pos = 0
+        css = css.strip()
+        while pos < len(css):
+            match = TOKEN.match(css, pos)
+            if not match:
+                raise ValueError(f"Unsupported selector: {css!r}")
+            pos = match.end()
+            compound = self.compounds[-1]
+            if match.group('combinator') is not None:
+                self.combinators.append('>' if '>' in match.group('combinator') else ' ')
+                self.compounds.append(Compound())
+            elif match.group('tag'):
+                compound.tag = None if match.group('tag') == '*' else match.group('tag').lower()
+            elif match.group('cls'):
+                compound.classes.append(match.group('cls'))
+            elif match.group('id'):
+                compound.attrs.append(('id', ATTR_TESTS['='], match.group('id')))
+            elif match.group('attr'):
+                compound.attrs.append((match.group('attr'), ATTR_TESTS[match.group('op')], match.group('value')))
+            else:
+                negation = Selector(match.group('neg'))
+                if len(negation.compounds) != 1:
+                    raise ValueError(f"Unsupported selector: {css!r}")
+                compound.negations.append(negation.compounds[0])
+        self.tag = self.compounds[-1].tag
+
+    def matches(self, el, index=None):
+        index = len(self.compounds) - 1 if index is None else index
+        if not self.compounds[index].matches(el):
+            return False
+        if index == 0:
+            return True
+        if self.combinators[index] == '>':
+            parent = el.getparent()
+            return parent is not None and self.matches(parent, index - 1)
+        return any(self.matches(ancestor, index - 1) for ancestor in el.iterancestors())
+
+
+class ExtractionPlan:
+    """Named selectors resolved together in a single walk of the tree.
+
+    `rules` maps a name to a selector, or to (selector, 'all') to collect
+    every match. apply() returns the first matching element (or None) per
+    name, and a list for 'all' rules, all in document order - the same
+    elements soup.select_one / soup.select would return.
+    """
+
+    def __init__(self, rules):
+        self.first = []
+        self.many = []
+        self.by_tag = {}
+        self.any_tag = []
+        for name, rule in rules.items():
+            css, mode = rule if isinstance(rule, tuple) else (rule, 'first')
+            entry = (name, Selector(css), mode == 'all')
+            (self.many if mode == 'all' else self.first).append(name)
+            if entry[1].tag:
+                self.by_tag.setdefault(entry[1].tag, []).append(entry)
+            else:
+                self.any_tag.append(entry)
+
+    def apply(self, root, include_root=False):
+        found = {name: None for name in self.first}
+        found.update({name: [] for name in self.many})
+        remaining = len(self.first)
+        elements = root.iter() if include_root else root.iterdescendants()
+        for el in elements:
+            tag = el.tag
+            if not isinstance(tag, str):
+                continue
+            for entries in (self.by_tag.get(tag, ()), self.any_tag):
+                for name, selector, many in entries:
+                    if many:
+                        if selector.matches(el):
+                            found[name].append(el)
+                    elif found[name] is None and selector.matches(el):
+                        found[name] = el
+                        remaining -= 1
+            if not remaining and not self.many:
+                break
+        return found
+
+
+def parse_html(html):
+    if isinstance(html, str):
+        try:
+            return lxml.html.document_fromstring(html)
+        except ValueError:
+            # str input with an XML encoding declaration
+            html = html.encode('utf-8')
+    return lxml.html.document_fromstring(html)
+
+
+def get_text(el):
+    """Equivalent of BeautifulSoup's element.get_text(strip=True)"""
+    if el is None:
+        return None
+    parts = []
+    _collect_text(el, parts)
+    return ''.join(parts)
+
+
+def _collect_text(el, parts):
+    if isinstance(el.tag, str) and el.tag not in SKIP_TEXT and el.text:
+        text = el.text.strip()
+        if text:
+            parts.append(text)
+    for child in el:
+        _collect_text(child, parts)
+        if child.tail:
+            text = child.tail.strip()
+            if text:
+                parts.append(text)
@@ -0,0 +1,261 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from metrics import METRICS
+
+# Connections kept alive per host; match this to the crawl concurrency
+POOL_SIZE = 16
+UA_POOL_SIZE = 50
+# The rotated User-Agents, drawn from fake_useragent once and kept with the
+# code: loading its data and drawing a pool costs ~0.5s in every process.
+# `python fetch.py` draws a fresh set.
+USER_AGENTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'user_agents.json')
+TIMEOUT = 15
+# Bytes read per chunk when streaming a body to disk
+DOWNLOAD_CHUNK = 64 * 1024
+
+_lock = threading.Lock()
+_session = None
+_user_agents = None
+
+
+class TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        with METRICS.timer('fetch.connect'):
+            super().connect()
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        # DNS, TCP and the TLS handshake of each new keep-alive connection
+        with METRICS.timer('fetch.connect'):
+            super().connect()
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose pools time every new connection into METRICS"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': TimedHTTPConnectionPool,
+                                                   'https': TimedHTTPSConnectionPool}
+
+
+def make_session(pool_size=POOL_SIZE):
+    """requests.Session backed by a keep-alive pool shared by all threads.
+
+    Retries only cover connection-level failures (a reset on a stale
+    keep-alive socket, a refused connect); HTTP status codes are returned
+    to the caller untouched.
+    """
+    retries = Retry(total=3, connect=3, read=2, status=0, backoff_factor=0.2,
+                    allowed_methods=frozenset(['GET', 'HEAD']), respect_retry_after_header=False)
+    adapter = TimedHTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=True, max_retries=retries)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session(pool_size=POOL_SIZE):
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = make_session(pool_size)
+    return _session
+
+
+def draw_user_agents(size=UA_POOL_SIZE):
+    from fake_useragent import UserAgent
+    ua = UserAgent()
+    return list(dict.fromkeys(ua.random for _ in range(size)))
+
+
+def load_user_agents(path=USER_AGENTS_PATH):
+    """The saved User-Agents, or a fresh draw if the file is missing or unreadable"""
+    try:
+        with open(path, encoding='utf-8') as file:
+            agents = json.load(file)
+    except (OSError, ValueError):
+        agents = None
+    return agents or draw_user_agents()
+
+
+class UserAgentPool:
+    """User-Agent strings loaded once, then rotated"""
+
+    def __init__(self, agents=None):
+        self.agents = agents or load_user_agents()
+        self._cycle = itertools.cycle(self.agents)
+        self._lock = threading.Lock()
+
+    def next(self):
+        with self._lock:
+            return next(self._cycle)
+
+
+def user_agents():
+    global _user_agents
+    if _user_agents is None:
+        with _lock:
+            if _user_agents is None:
+                _user_agents = UserAgentPool()
+    return _user_agents
+
+
+def get_headers():
+    return {
+        'User-Agent': user_agents().next(),
+        'Accept-Language': 'mk-MK,en-US;q=0.7',
+        'X-Requested-With': 'XMLHttpRequest'
+    }
+
+
+class FetchStats:
+    """Per-request timing counters, split into server wait and body download"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.errors = 0
+            self.bytes = 0
+            self.total_time = 0.0
+            self.wait_time = 0.0
+            self.download_time = 0.0
+
+    def record(self, total, wait, nbytes):
+        with self._lock:
+            self.requests += 1
+            self.bytes += nbytes
+            self.total_time += total
+            self.wait_time += wait
+            self.download_time += total - wait
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def report(self, session=None):
+        with self._lock:
+            report = {
+                'requests': self.requests,
+                'errors': self.errors,
+                'bytes': self.bytes,
+                'total_time': self.total_time,
+                'wait_time': self.wait_time,
+                'download_time': self.download_time,
+                'avg_ms': 1000 * self.total_time / self.requests if self.requests else 0.0,
+            }
+        # Connection reuse: how many sockets the pools had to open for those requests
+        session = session or _session
+        if session is not None:
+            adapters = {id(adapter): adapter for adapter in session.adapters.values()}
+            pools = [adapter.poolmanager.pools for adapter in adapters.values()]
+            report['connections'] = sum(container[key].num_connections
+                                        for container in pools for key in container.keys())
+        return report
+
+
+STATS = FetchStats()
+
+
+def fetch(url, session=None, timeout=TIMEOUT, headers=None):
+    session = session or get_session()
+    request_headers = get_headers()
+    if headers:
+        request_headers.update(headers)
+    start = time.perf_counter()
+    try:
+        with METRICS.track('fetch.inflight'):
+            response = session.get(url, headers=request_headers, timeout=timeout, stream=True)
+            wait = time.perf_counter() - start
+            body = response.content
+    except requests.RequestException as e:
+        STATS.record_error()
+        METRICS.count(f'errors.{type(e).__name__}')
+        raise
+    total = time.perf_counter() - start
+    STATS.record(total, wait, len(body))
+    METRICS.observe('fetch.wait', wait)
+    METRICS.observe('fetch.download', total - wait)
+    METRICS.observe('fetch.total', total)
+    METRICS.count('requests')
+    METRICS.count('bytes', len(body))
+    METRICS.count(f'status.{response.status_code}')
+    return response
+
+
+def download(url, file, session=None, timeout=TIMEOUT, chunk_size=DOWNLOAD_CHUNK):
+    """Stream a 200 response body into file, hashing it on the way.
+
+    Returns (response, sha256 hex digest, bytes written); for any other
+    status nothing is written and the digest is None. Only one chunk is
+    held in memory at a time.
+    """
+    session = session or get_session()
+    start = time.perf_counter()
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with METRICS.track('fetch.inflight'):
+            with session.get(url, headers=get_headers(), timeout=timeout, stream=True) as response:
+                wait = time.perf_counter() - start
+                if response.status_code != 200:
+                    METRICS.count(f'status.{response.status_code}')
+                    return response, None, 0
+                for chunk in response.iter_content(chunk_size):
+                    file.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+    except requests.RequestException as e:
+        STATS.record_error()
+        METRICS.count(f'errors.{type(e).__name__}')
+        raise
+    total = time.perf_counter() - start
+    STATS.record(total, wait, size)
+    METRICS.observe('fetch.wait', wait)
+    METRICS.observe('fetch.download', total - wait)
+    METRICS.count('requests')
+    METRICS.count('bytes', size)
+    METRICS.count('status.200')
+    return response, digest.hexdigest(), size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Draw a new set of User-Agents for the crawler to rotate through")
+    parser.add_argument('--size', type=int, default=UA_POOL_SIZE)
+    parser.add_argument('--output', default=USER_AGENTS_PATH)
+    args = parser.parse_args()
+    agents = draw_user_agents(args.size)
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(agents, file, indent=1)
+        file.write('\n')
+    print(f"Saved {len(agents)} User-Agents to '{args.output}'")
+
+
+if __name__ == "__main__":
+    main()
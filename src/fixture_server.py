@@ -0,0 +1,434 @@
+import argparse
+import ast
+import csv
+import glob
+import hashlib
+import html
+import os
+import random
+import re
+import threading
+from collections import Counter
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from urls import SEARCH_PATH, ad_id_from_url
+
+# Local stand-in for pazar3.mk used by the benchmarks. Pages recorded into
+# FIXTURE_DIR (`python fixture_server.py record`) are served as-is; any other
+# ad found in the scraped CSVs is rendered with the same markup the live
+# listing pages use.
+FIXTURE_DIR = 'fixtures'
+FIXTURE_CSV = 'sequential_car_listings_cleaned.csv'
+# Saved search results, one listing URL per line; served newest first as
+# SEARCH_PATH?Page=N, SEARCH_PAGE_SIZE ads per page
+SEARCH_CSV = 'search_results_page_{}.csv'
+SEARCH_PAGE_SIZE = 50
+
+AD_PATH = re.compile(r'^/ad/(\d+)')
+# Listing photos (media.pazar3.mk/Image/...) are served as one of
+# IMAGE_VARIANTS generated 1280x960 JPEGs, picked by a hash of the path
+IMAGE_PATH = re.compile(r'^/Image/')
+IMAGE_VARIANTS = 200
+SEARCH_PAGE = re.compile(r'^' + re.escape(SEARCH_PATH) + r'/?\?(?:.*&)?Page=(\d+)')
+
+# English tag labels as they appear in the tags-area of a listing page
+TAG_LABELS = [
+    ('condition', 'Condition'),
+    ('year', 'Year'),
+    ('transmission', 'Gear Box'),
+    ('mileage', 'Mileage'),
+    ('fuel_type', 'Fuel'),
+    ('registration', 'Registration'),
+    ('listing_type', 'Ad type'),
+    ('seller_type', 'Advertised by'),
+    ('location', 'Location'),
+    ('color', 'Color'),
+    ('manufacturer', 'Manufacturer'),
+    ('model', 'Model'),
+]
+# The same tags on the Macedonian pages, with the values that differ there
+MACEDONIAN_TAG_LABELS = [
+    ('condition', 'Состојба'),
+    ('year', 'Година'),
+    ('transmission', 'Менувач'),
+    ('mileage', 'Километража'),
+    ('fuel_type', 'Гориво'),
+    ('registration', 'Регистрација'),
+    ('listing_type', 'Вид на оглас'),
+    ('seller_type', 'Огласено од'),
+    ('location', 'Локација'),
+    ('color', 'Боја'),
+    ('manufacturer', 'Производител'),
+    ('model', 'Модел'),
+]
+MACEDONIAN_VALUES = {'seller_type': {'Private': 'Физичко лице', 'Store': 'Правно лице'}}
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>{title} - Pazar3</title>
+<link rel="stylesheet" href="/Content/site.min.css">
+<script>window.dataLayer = window.dataLayer || []; dataLayer.push({{"adId": "{ad_id}"}});</script>
+</head>
+<body>
+<header class="ci-header"><nav class="ci-nav">{nav}</nav></header>
+<main class="ci-container">
+<div class="ci-row">
+<div class="ci-col gallery">{images}</div>
+<div class="ci-col details">
+<h1 class="ci-text-base ci-margin-b-10">{title}</h1>
+<h4 class="ci-text-success"><bdi class="new-price"><span class="format-money-int" value="{price_value}">{price_display}</span> <span>{currency}</span></bdi></h4>
+<div class="published"><span class="published-date">{publish_date}</span> <span class="published-time">{publish_time}</span></div>
+<div class="views-number"><i class="icon-eye"></i><span>{views}</span></div>
+<div class="tags-area">{tags}</div>
+{address}{map_link}
+<div class="description-area"><div class="longDescription">{description}</div></div>
+<div class="contact"><a class="ci-btn" href="tel:{phone}">{phone}</a>
+<button class="ci-btn" data-toggle="modal" data-target="#contactModal">Send message</button></div>
+</div>
+</div>
+</main>
+<footer class="ci-footer">{footer}</footer>
+</body>
+</html>
+"""
+
+SEARCH_TEMPLATE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>Cars - Page {page} - Pazar3</title>
+</head>
+<body>
+<main class="ci-container">
+<div class="ci-search-results">{items}</div>
+<div class="ci-pagination">{pagination}</div>
+</main>
+</body>
+</html>
+"""
+
+
+def _value(row, key):
+    value = row.get(key)
+    if value is None or value == '' or value == 'nan':
+        return None
+    return value
+
+
+def render_listing(row, labels=TAG_LABELS):
+    title = html.escape(_value(row, 'title') or '')
+    images = []
+    try:
+        images = ast.literal_eval(row.get('images') or '[]')
+    except (ValueError, SyntaxError):
+        pass
+    tags = []
+    for field, label in labels:
+        value = _value(row, field)
+        if value is None:
+            continue
+        if field == 'year':
+            value = str(int(float(value)))
+        if labels is MACEDONIAN_TAG_LABELS:
+            value = MACEDONIAN_VALUES.get(field, {}).get(value, value)
+        tags.append(f'<a class="tag-item" href="/ads?{field}"><span>{label}:</span> <bdi>{html.escape(value)}</bdi></a>')
+
+    price = _value(row, 'price_numeric')
+    price_value = int(float(price)) if price else 0
+    views = _value(row, 'views')
+    address = _value(row, 'address')
+    coords = _value(row, 'coordinates')
+    return PAGE_TEMPLATE.format(
+        ad_id=ad_id_from_url(row.get('url')),
+        title=title,
+        nav=''.join(f'<a href="/ads/category-{i}">Category {i}</a>' for i in range(40)),
+        images=''.join(f'<img class="lazyload" data-src="{html.escape(src)}" alt="{title}">' for src in images),
+        price_value=price_value,
+        price_display=f'{price_value:,}'.replace(',', ' '),
+        currency=html.escape(_value(row, 'currency') or 'EUR'),
+        publish_date=html.escape(_value(row, 'publish_date') or ''),
+        publish_time=html.escape(_value(row, 'publish_time') or ''),
+        views=str(int(float(views))) if views else '0',
+        tags=''.join(tags),
+        address=f'<div class="display-ad-address">{html.escape(address)}</div>' if address else '',
+        map_link=f'<a class="map" data-target="location" data-coords="{html.escape(coords.strip("()"))}">Map</a>' if coords else '',
+        description=html.escape(_value(row, 'description') or ''),
+        phone=html.escape(_value(row, 'phone') or ''),
+        footer=''.join(f'<p>Footer link {i}</p>' for i in range(60)),
+    )
+
+
+def render_image(variant, size=(1280, 960)):
+    """A photo-sized JPEG (needs Pillow), distinct per variant"""
+    import io
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(variant)
+    image = Image.linear_gradient('L').resize(size).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        draw.ellipse((x, y, x + rng.randrange(20, 300), y + rng.randrange(20, 300)),
+                     fill=tuple(rng.randrange(256) for _ in range(3)))
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def render_search_page(page, ad_ids, pages):
+    items = ''.join(f'<div class="ci-search-item"><a class="Link_vis" href="/ad/{ad_id}">'
+                    f'<img class="lazyload" data-src="/img/{ad_id}.jpg"></a>'
+                    f'<h2><a class="Link_vis" href="/ad/{ad_id}">Ad {ad_id}</a></h2></div>'
+                    for ad_id in ad_ids)
+    pagination = ''.join(f'<a href="{SEARCH_PATH}?Page={number}">{number}</a>' for number in range(1, pages + 1))
+    return SEARCH_TEMPLATE.format(page=page, items=items, pagination=pagination)
+
+
+def load_search_ads(pattern=SEARCH_CSV):
+    """Ad IDs of the saved search results, in page order"""
+    ad_ids = []
+    page = 1
+    while os.path.exists(pattern.format(page)):
+        with open(pattern.format(page), encoding='utf-8') as file:
+            ad_ids.extend(ad_id for ad_id in map(ad_id_from_url, file) if ad_id)
+        page += 1
+    return ad_ids
+
+
+def load_rows(path=FIXTURE_CSV):
+    rows = {}
+    with open(path, newline='', encoding='utf-8-sig') as file:
+        for row in csv.DictReader(file):
+            ad_id = ad_id_from_url(row.get('url'))
+            if ad_id:
+                rows[ad_id] = row
+    return rows
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; with Nagle on, the body
+    # waits for the client's delayed ACK and every response gains ~40 ms
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        match = AD_PATH.match(self.path)
+        search = SEARCH_PAGE.match(self.path)
+        content_type = 'text/html; charset=utf-8'
+        if match:
+            body = self.server.page(match.group(1))
+        elif IMAGE_PATH.match(self.path):
+            body = self.server.image(self.path)
+            content_type = 'image/jpeg'
+        elif search:
+            body = self.server.search_page(int(search.group(1)))
+        else:
+            body = None
+        delay = self.server.delay()
+        if delay:
+            time.sleep(delay)
+        fault = self.server.fault()
+        if fault:
+            self.send_fault(fault)
+            return
+        status = 404 if body is None else self.server.withheld.get(self.path)
+        if status:
+            self.server.count(status)
+            self.send_error(status)
+            return
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.server.count(304)
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.server.count(200)
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_fault(self, status):
+        self.server.count(status)
+        body = b'Too Many Requests' if status == 429 else b'Service Unavailable'
+        self.send_response(status)
+        if status == 429:
+            self.send_header('Retry-After', '1')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FixtureServer(ThreadingHTTPServer):
+    """Fixture HTTP server with optional fault injection.
+
+    `error_rate` answers that fraction of requests with a 503, and
+    `max_rate` answers 429 + Retry-After once clients exceed that many
+    requests per second, like a throttling front end. Each response waits
+    `latency` plus up to `jitter` seconds. `search_ads` is the
+    newest-first result list behind the search pages; insert at the front
+    to simulate new ads. `withheld` maps request paths to the error status
+    they get instead, e.g. a photo that is gone (404) or forbidden (403).
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, fixture_dir=FIXTURE_DIR, csv_path=FIXTURE_CSV, latency=0.0,
+                 error_rate=0.0, max_rate=None, jitter=0.0):
+        super().__init__(address, FixtureHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.max_rate = max_rate
+        self.statuses = Counter()
+        self.withheld = {}
+        self._lock = threading.Lock()
+        self._tokens = max_rate or 0
+        self._updated = time.monotonic()
+        self.fixture_dir = fixture_dir
+        self.rows = load_rows(csv_path) if os.path.exists(csv_path) else {}
+        self.search_ads = load_search_ads()
+        recorded = glob.glob(os.path.join(fixture_dir, '*.html'))
+        # Every ad with a page: recorded ones first, then the rendered CSV rows
+        self.ad_ids = list(dict.fromkeys([*sorted(os.path.basename(path)[:-5] for path in recorded), *self.rows]))
+        self._pages = {}
+        self._images = {}
+
+    def delay(self):
+        return self.latency + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def count(self, status):
+        with self._lock:
+            self.statuses[status] += 1
+
+    def fault(self):
+        if self.error_rate and random.random() < self.error_rate:
+            return 503
+        if self.max_rate:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.max_rate, self._tokens + (now - self._updated) * self.max_rate)
+                self._updated = now
+                if self._tokens < 1:
+                    return 429
+                self._tokens -= 1
+        return None
+
+    def page(self, ad_id):
+        if ad_id not in self._pages:
+            saved = os.path.join(self.fixture_dir, f'{ad_id}.html')
+            if os.path.exists(saved):
+                with open(saved, 'rb') as file:
+                    self._pages[ad_id] = file.read()
+            elif ad_id in self.rows:
+                self._pages[ad_id] = render_listing(self.rows[ad_id]).encode('utf-8')
+            else:
+                return None
+        return self._pages[ad_id]
+
+    def image(self, path):
+        variant = int(hashlib.md5(path.encode('utf-8')).hexdigest()[:8], 16) % IMAGE_VARIANTS
+        if variant not in self._images:
+            self._images[variant] = render_image(variant)
+        return self._images[variant]
+
+    def search_page(self, page):
+        saved = os.path.join(self.fixture_dir, 'search', f'{page}.html')
+        if os.path.exists(saved):
+            with open(saved, 'rb') as file:
+                return file.read()
+        pages = max(1, -(-len(self.search_ads) // SEARCH_PAGE_SIZE))
+        start = (page - 1) * SEARCH_PAGE_SIZE
+        ad_ids = self.search_ads[start:start + SEARCH_PAGE_SIZE] if page >= 1 else []
+        return render_search_page(page, ad_ids, pages).encode('utf-8')
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+
+def start_fixture_server(port=0, **kwargs):
+    server = FixtureServer(('127.0.0.1', port), **kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def record_corpus(pages, fixture_dir=FIXTURE_DIR, base_url=None, rate=1.0):
+    """Save search pages 1..pages and every listing on them from the live site.
+
+    Pages already in fixture_dir are not fetched again, so an interrupted
+    recording can simply be rerun. Requests are paced at about `rate` per
+    second; this is the only part of the benchmarks that touches the site.
+    """
+    from discovery import extract_ad_urls
+    from ratelimit import AdaptiveRateLimiter, fetch_with_retry
+    from urls import BASE_URL, search_url
+
+    base_url = base_url or BASE_URL
+    limiter = AdaptiveRateLimiter(rate=rate, max_rate=rate)
+    os.makedirs(os.path.join(fixture_dir, 'search'), exist_ok=True)
+
+    def save(url, path):
+        if os.path.exists(path):
+            with open(path, 'rb') as file:
+                return file.read()
+        try:
+            body = fetch_with_retry(url, limiter=limiter).content
+        except Exception as e:
+            print(f"Error recording {url}: {str(e)}")
+            return None
+        with open(path, 'wb') as file:
+            file.write(body)
+        return body
+
+    recorded = 0
+    for page in range(1, pages + 1):
+        body = save(search_url(page, base_url), os.path.join(fixture_dir, 'search', f'{page}.html'))
+        if body is None:
+            continue
+        for url in extract_ad_urls(body.decode('utf-8', errors='replace')):
+            ad_id = ad_id_from_url(url)
+            if save(f'{base_url}/ad/{ad_id}', os.path.join(fixture_dir, f'{ad_id}.html')) is not None:
+                recorded += 1
+        print(f"Search page {page}: {recorded} listings recorded so far")
+    return recorded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local pazar3.mk stand-in for the benchmarks")
+    commands = parser.add_subparsers(dest='command')
+    serve = commands.add_parser('serve', help="serve the fixtures (the default)")
+    serve.add_argument('--port', type=int, default=8003)
+    serve.add_argument('--latency', type=float, default=0.0)
+    serve.add_argument('--jitter', type=float, default=0.0)
+    serve.add_argument('--error-rate', type=float, default=0.0)
+    serve.add_argument('--max-rate', type=float, default=None)
+    record = commands.add_parser('record', help="record search and listing pages from the live site once")
+    record.add_argument('--pages', type=int, default=3)
+    record.add_argument('--rate', type=float, default=1.0, help="requests/sec against the live site")
+    parser.set_defaults(command='serve', port=8003, latency=0.0, jitter=0.0, error_rate=0.0, max_rate=None)
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        print(f"Recorded {record_corpus(args.pages, rate=args.rate)} listings into {FIXTURE_DIR}/")
+        return
+    server = FixtureServer(('127.0.0.1', args.port), latency=args.latency, jitter=args.jitter,
+                           error_rate=args.error_rate, max_rate=args.max_rate)
+    print(f"Serving {len(server.ad_ids)} listings and {len(server.search_ads)} search results on {server.base_url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
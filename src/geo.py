@@ -0,0 +1,343 @@
+import argparse
+import math
+import pickle
+import time
+from array import array
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from normalize import MKD_PER_EUR, fold
+from urls import ad_id_from_url
+
+# Spatial index over listings for the regional price maps: every listing is
+# placed by its data-coords, or failing that by the centroid of its location,
+# and bucketed into a grid of CELL_DEGREES cells kept sorted by cell. A radius
+# or bounding-box query reads the cells it overlaps instead of the whole
+# dataset, and price statistics per cell are aggregated once per batch at
+# LEVELS zooms (each LEVEL_FACTOR times coarser), so a map tile is a slice of
+# a small table.
+GEO_INDEX_PATH = 'listings_geo.pkl'
+CELL_DEGREES = 0.01
+LEVEL_FACTOR = 4
+LEVELS = 5
+# A tile is drawn from the finest level with at most this many cells across
+TILE_CELLS = 16
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+# Cell keys sort by row, then column: row * KEY_STRIDE + column + COLUMN_OFFSET
+KEY_STRIDE = 1 << 16
+COLUMN_OFFSET = 1 << 15
+RESULT_FIELDS = ['url', 'location', 'lat', 'lon', 'exact', 'price']
+# The listing fields add() reads
+FIELDS = ['url', 'coordinates', 'location', 'price_numeric', 'currency']
+
+# Centroids (lat, lon) of the towns and Skopje municipalities in the scraped
+# `location` strings, e.g. 'Aerodrom, Skopje'; names match in either script
+LOCATION_CENTROIDS = {
+    'Skopje': (41.9965, 21.4314), 'Aerodrom': (41.9850, 21.4680), 'Aračinovo': (42.0270, 21.5620),
+    'Butel': (42.0300, 21.4450), 'Centar': (41.9960, 21.4270), 'Chair': (42.0140, 21.4400),
+    'Čučer-Sandevo': (42.0980, 21.3900), 'Gazi Baba': (42.0160, 21.4700), 'Gjorce Petrov': (42.0100, 21.3550),
+    'Ilinden': (41.9950, 21.5800), 'Karposh': (42.0060, 21.3950), 'Kisela Voda': (41.9670, 21.4400),
+    'Petrovec': (41.9380, 21.6150), 'Saraj': (42.0000, 21.3300), 'Shuto Orizari': (42.0400, 21.4250),
+    'Sopište': (41.9480, 21.3520), 'Studeničani': (41.9170, 21.5300), 'Zelenikovo': (41.8850, 21.5850),
+    'Berovo': (41.7070, 22.8570), 'Bitola': (41.0310, 21.3340), 'Bogdanci': (41.2030, 22.5750),
+    'Bogovinje': (41.9230, 20.9130), 'Brvenica': (41.9670, 20.9800), 'Debar': (41.5250, 20.5240),
+    'Debarca': (41.2000, 20.8600), 'Delčevo': (41.9670, 22.7750), 'Demir Hisar': (41.2210, 21.2030),
+    'Demir Kapija': (41.4060, 22.2460), 'Dojran': (41.1800, 22.7200), 'Dolneni': (41.4260, 21.4520),
+    'Gevgelija': (41.1410, 22.5030), 'Gostivar': (41.7960, 20.9080), 'Gradsko': (41.5770, 21.9440),
+    'Jegunovce': (42.0730, 21.1230), 'Kavadarci': (41.4330, 22.0120), 'Kičevo': (41.5120, 20.9570),
+    'Kočani': (41.9160, 22.4080), 'Kratovo': (42.0780, 22.1810), 'Kriva Palanka': (42.2020, 22.3320),
+    'Krivogaštani': (41.3350, 21.3330), 'Kruševo': (41.3700, 21.2490), 'Kumanovo': (42.1320, 21.7140),
+    'Lipkovo': (42.1560, 21.5850), 'Makedonska Kamenica': (42.0210, 22.5880), 'Makedonski Brod': (41.5140, 21.2150),
+    'Negotino': (41.4840, 22.0890), 'Ohrid': (41.1170, 20.8020), 'Pehčevo': (41.7620, 22.8870),
+    'Prilep': (41.3460, 21.5540), 'Probištip': (42.0030, 22.1790), 'Radoviš': (41.6380, 22.4650),
+    'Resen': (41.0890, 21.0120), 'Struga': (41.1780, 20.6780), 'Strumica': (41.4370, 22.6430),
+    'Sveti Nikole': (41.8650, 21.9430), 'Štip': (41.7460, 22.1960), 'Tearce': (42.0770, 21.0530),
+    'Tetovo': (42.0100, 20.9710), 'Valandovo': (41.3170, 22.5600), 'Vasilevo': (41.4750, 22.6420),
+    'Veles': (41.7160, 21.7750), 'Vevčani': (41.2400, 20.5930), 'Vinica': (41.8830, 22.5090),
+    'Vrapčište': (41.8340, 20.8840), 'Želino': (41.9800, 21.0620),
+}
+_CENTROIDS = {fold(name): centroid for name, centroid in LOCATION_CENTROIDS.items()}
+
+
+@lru_cache(maxsize=4096)
+def locate(location):
+    """Centroid of a location string: the whole string, else its first known comma-separated part; None if unknown"""
+    if not isinstance(location, str):
+        return None
+    for name in [location, *location.split(',')]:
+        centroid = _CENTROIDS.get(fold(name.strip()))
+        if centroid:
+            return centroid
+    return None
+
+
+def _coordinates(value):
+    """(lat, lon) from a (lat, lon) pair, a '(lat, lon)' string or a {'lat', 'lon'} struct"""
+    if isinstance(value, dict):
+        value = value.get('lat'), value.get('lon')
+    elif isinstance(value, str):
+        value = value.strip('()[] ').split(',')
+    try:
+        lat, lon = (float(part) for part in value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(lat) or math.isnan(lon) else (lat, lon)
+
+
+def _price(listing):
+    try:
+        price = float(str(listing.get('price_numeric')).replace(' ', ''))
+    except (TypeError, ValueError):
+        return np.nan
+    return price / MKD_PER_EUR if listing.get('currency') == 'MKD' else price
+
+
+def cell_of(lat, lon, level=0):
+    """Grid row and column of points at a level (arrays or scalars)"""
+    size = CELL_DEGREES * LEVEL_FACTOR ** level
+    return np.floor(np.divide(lat, size)).astype(np.int64), np.floor(np.divide(lon, size)).astype(np.int64)
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Great-circle distance from one point to each of lats/lons"""
+    lat, lon, lats, lons = map(np.radians, (lat, lon, lats, lons))
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def tile_bounds(z, x, y):
+    """(south, west, north, east) of a web map tile"""
+    n = 2 ** z
+    lat = lambda row: math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+    return lat(y + 1), x / n * 360 - 180, lat(y), (x + 1) / n * 360 - 180
+
+
+class GeoIndex:
+    """Grid index of listing positions with per-cell price statistics.
+
+    add() places listings as they come (dicts, records or DataFrame rows);
+    a listing whose ad ID is already indexed replaces the older copy, and
+    one with neither coordinates nor a known location is only counted in
+    unlocated. The sorted grid and the cell statistics are rebuilt after
+    each batch, on first use.
+    """
+
+    def __init__(self):
+        self.lats = array('d')
+        self.lons = array('d')
+        self.prices = array('d')
+        self.exact = array('b')
+        self.live = array('b')
+        self.stored = []
+        self.docs = {}
+        self.unlocated = 0
+        self._grid = None
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, listings):
+        """Place listings (an iterable of mappings, or a DataFrame); returns how many were located"""
+        if isinstance(listings, pd.DataFrame):
+            listings = listings[[field for field in FIELDS if field in listings]].to_dict('records')
+        added = 0
+        for listing in listings:
+            key = ad_id_from_url(listing.get('url')) or listing.get('url')
+            previous = self.docs.pop(key, None)
+            if previous is not None:
+                self.live[previous] = 0
+            position = _coordinates(listing.get('coordinates'))
+            exact = position is not None
+            position = position or locate(listing.get('location'))
+            if position is None:
+                self.unlocated += 1
+                continue
+            self.docs[key] = len(self.stored)
+            self.lats.append(position[0])
+            self.lons.append(position[1])
+            self.prices.append(_price(listing))
+            self.exact.append(exact)
+            self.live.append(1)
+            location = listing.get('location')
+            self.stored.append((listing.get('url'), location if isinstance(location, str) else None))
+            added += 1
+        self._grid = None
+        return added
+
+    def grid(self):
+        """Live points sorted by cell key as arrays, and the cell statistics of every level"""
+        if self._grid is None:
+            docs = np.flatnonzero(np.array(self.live, dtype=bool))
+            lats = np.array(self.lats, dtype=np.float64)[docs]
+            lons = np.array(self.lons, dtype=np.float64)[docs]
+            rows, columns = cell_of(lats, lons)
+            keys = rows * KEY_STRIDE + columns + COLUMN_OFFSET
+            order = np.argsort(keys, kind='stable')
+            docs = docs[order]
+            points = {
+                'doc': docs, 'key': keys[order], 'row': rows[order], 'col': columns[order],
+                'lat': lats[order], 'lon': lons[order],
+                'exact': np.array(self.exact, dtype=bool)[docs],
+                'price': np.array(self.prices, dtype=np.float64)[docs],
+            }
+            self._grid = points, [self._aggregate(points, level) for level in range(LEVELS)]
+        return self._grid
+
+    @staticmethod
+    def _aggregate(points, level):
+        """Listings, exactly placed listings and price statistics (EUR) per cell of one level"""
+        factor = LEVEL_FACTOR ** level
+        cells = pd.DataFrame({'row': points['row'] // factor, 'col': points['col'] // factor,
+                              **{field: points[field] for field in ['lat', 'lon', 'exact', 'price']}})
+        stats = cells.groupby(['row', 'col'], sort=True).agg(
+            listings=('price', 'size'), exact=('exact', 'sum'), priced=('price', 'count'),
+            lat=('lat', 'mean'), lon=('lon', 'mean'),
+            mean=('price', 'mean'), median=('price', 'median'), min=('price', 'min'), max=('price', 'max'))
+        return stats.reset_index()
+
+    def _in_box(self, south, west, north, east):
+        """Positions (into the sorted points) of the points inside the box"""
+        points = self.grid()[0]
+        (south_row, north_row), (west_col, east_col) = cell_of([south, north], [west, east])
+        base = np.arange(south_row, north_row + 1, dtype=np.int64) * KEY_STRIDE + COLUMN_OFFSET
+        # One contiguous run of keys per grid row the box spans
+        starts = np.searchsorted(points['key'], base + west_col, 'left')
+        ends = np.searchsorted(points['key'], base + east_col, 'right')
+        positions = np.concatenate([np.arange(start, end) for start, end in zip(starts, ends)] or [np.empty(0, int)])
+        lats = points['lat'][positions]
+        lons = points['lon'][positions]
+        # Cells on the edge of the box are only partly inside it
+        return positions[(lats >= south) & (lats <= north) & (lons >= west) & (lons <= east)]
+
+    def _near(self, lat, lon, km):
+        """Positions of the points within km of a point, nearest first, and their distances"""
+        dlat = km / KM_PER_DEGREE
+        dlon = km / (KM_PER_DEGREE * max(math.cos(math.radians(min(abs(lat) + dlat, 90))), 1e-9))
+        positions = self._in_box(lat - dlat, lon - dlon, lat + dlat, lon + dlon)
+        points = self.grid()[0]
+        distances = haversine_km(lat, lon, points['lat'][positions], points['lon'][positions])
+        inside = distances <= km
+        nearest = np.argsort(distances[inside], kind='stable')
+        return positions[inside][nearest], distances[inside][nearest]
+
+    def match_box(self, south, west, north, east):
+        """Doc IDs of the listings inside a bounding box"""
+        return self.grid()[0]['doc'][self._in_box(south, west, north, east)]
+
+    def match_radius(self, lat, lon, km):
+        """Doc IDs of the listings within km of a point, nearest first"""
+        return self.grid()[0]['doc'][self._near(lat, lon, km)[0]]
+
+    def _results(self, positions):
+        points = self.grid()[0]
+        stored = [self.stored[doc] for doc in points['doc'][positions]]
+        return pd.DataFrame({
+            'url': [url for url, _ in stored], 'location': [location for _, location in stored],
+            **{field: points[field][positions] for field in ['lat', 'lon', 'exact', 'price']},
+        }, columns=RESULT_FIELDS)
+
+    def bbox(self, south, west, north, east):
+        """Listings inside a bounding box, as a DataFrame of RESULT_FIELDS (price in EUR)"""
+        return self._results(self._in_box(south, west, north, east))
+
+    def radius(self, lat, lon, km):
+        """Listings within km of a point, nearest first, with their distance_km"""
+        positions, distances = self._near(lat, lon, km)
+        return self._results(positions).assign(distance_km=distances)
+
+    def cells(self, level=0, bounds=None):
+        """Price statistics per cell of a level, optionally only the cells overlapping (south, west, north, east)"""
+        if not 0 <= level < LEVELS:
+            raise ValueError(f"level must be between 0 and {LEVELS - 1}")
+        stats = self.grid()[1][level]
+        if bounds is None:
+            return stats
+        south, west, north, east = bounds
+        (south_row, north_row), (west_col, east_col) = cell_of([south, north], [west, east], level)
+        return stats[stats['row'].between(south_row, north_row) & stats['col'].between(west_col, east_col)]
+
+    def tile(self, z, x, y):
+        """Cell statistics for one web map tile, at the finest level giving at most TILE_CELLS cells across it"""
+        bounds = tile_bounds(z, x, y)
+        width = bounds[3] - bounds[1]
+        level = next((level for level in range(LEVELS)
+                      if width / (CELL_DEGREES * LEVEL_FACTOR ** level) <= TILE_CELLS), LEVELS - 1)
+        return self.cells(level, bounds)
+
+    def save(self, path=GEO_INDEX_PATH):
+        self._grid = None
+        with open(path, 'wb') as file:
+            pickle.dump(self, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path=GEO_INDEX_PATH):
+        with open(path, 'rb') as file:
+            return pickle.load(file)
+
+
+def _place(text):
+    """(lat, lon) of 'lat,lon' or of a known location name"""
+    position = _coordinates(text) if any(char.isdigit() for char in text) else locate(text)
+    if position is None:
+        raise argparse.ArgumentTypeError(f"unknown place {text!r}: give 'lat,lon' or a town such as Skopje")
+    return position
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Radius, bounding-box and per-cell price queries over listing positions")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="index listings, or add new ones to the index with --update")
+    build.add_argument('listings', nargs='*', default=['sequential_car_listings_cleaned.csv'],
+                       help="scraper CSVs, Parquet files or datasets")
+    build.add_argument('--update', action='store_true', help=f"add to the existing {GEO_INDEX_PATH}")
+    near = commands.add_parser('near', help="listings within --km of a place, e.g. near Skopje --km 5")
+    near.add_argument('place', type=_place, help="'lat,lon' or a town or Skopje municipality")
+    near.add_argument('--km', type=float, default=10.0)
+    near.add_argument('--limit', type=int, default=20)
+    box = commands.add_parser('box', help="listings inside a bounding box")
+    for bound in ['south', 'west', 'north', 'east']:
+        box.add_argument(bound, type=float)
+    box.add_argument('--limit', type=int, default=20)
+    cells = commands.add_parser('cells', help="price statistics per grid cell, for a map")
+    cells.add_argument('--level', type=int, default=2, help=f"0 ({CELL_DEGREES} degree cells) to {LEVELS - 1}")
+    cells.add_argument('--bbox', type=float, nargs=4, metavar=('SOUTH', 'WEST', 'NORTH', 'EAST'))
+    cells.add_argument('--tile', type=int, nargs=3, metavar=('Z', 'X', 'Y'), help="the cells of one web map tile instead")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        from storage import load_listings
+        start = time.perf_counter()
+        index = GeoIndex.load() if args.update else GeoIndex()
+        added = sum(index.add(load_listings(path)) for path in args.listings)
+        points, levels = index.grid()
+        index.save()
+        print(f"Placed {added} listings ({len(index)} total, {int(points['exact'].sum())} by coordinates, "
+              f"{index.unlocated} unlocated, {len(levels[0])} cells) in {time.perf_counter() - start:.2f}s")
+        return
+
+    index = GeoIndex.load()
+    index.grid()
+    start = time.perf_counter()
+    if args.command == 'near':
+        result = index.radius(*args.place, args.km)
+    elif args.command == 'box':
+        result = index.bbox(args.south, args.west, args.north, args.east)
+    elif args.tile:
+        result = index.tile(*args.tile)
+    else:
+        result = index.cells(args.level, args.bbox)
+    elapsed = time.perf_counter() - start
+    if args.command == 'cells':
+        print(result.round({'lat': 4, 'lon': 4, 'mean': 0, 'median': 0, 'min': 0, 'max': 0}).to_string(index=False))
+        print(f"{len(result)} cells")
+    else:
+        print(result.head(args.limit).to_string(index=False))
+        print(f"{len(result)} listings")
+    print(f"in {elapsed * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import argparse
+import datetime
+import glob
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from storage import load_listings, partition_path
+from urls import ad_id_from_url
+
+# Change history of every ad across crawls. Each crawl appends one Parquet
+# part file of deltas (<root>/crawl_date=YYYY-MM-DD/part-*.parquet), sorted
+# by ad ID so a lookup of one ad reads a single row group per file. The last
+# known price and views of every ad live in _state.parquet (the underscore
+# keeps it out of dataset scans), so a new crawl is diffed against that
+# instead of against the older snapshots.
+HISTORY_DIR = 'history'
+# Small row groups: a lookup by ad ID decodes one group per part file, not the whole crawl
+ROW_GROUP = 8192
+
+# new: first seen; changed: price and/or views moved (the other is null);
+# removed: missing from a complete crawl; reappeared: back after removed
+EVENT = pa.dictionary(pa.int8(), pa.string())
+EVENT_SCHEMA = pa.schema([
+    ('ad_id', pa.int64()),
+    ('crawled_at', pa.timestamp('s')),
+    ('event', EVENT),
+    ('price', pa.float64()),
+    ('previous_price', pa.float64()),
+    ('currency', EVENT),
+    ('views', pa.int32()),
+])
+STATE_COLUMNS = ['price', 'currency', 'views', 'present', 'first_seen', 'last_seen']
+
+
+def snapshot_frame(listings):
+    """ad_id, price, currency and views of one crawl, one row per ad (the last wins)"""
+    if not isinstance(listings, pd.DataFrame):
+        listings = pd.DataFrame(list(listings))
+    ad_ids = pd.to_numeric(listings['url'].map(ad_id_from_url), errors='coerce')
+    frame = pd.DataFrame({
+        'ad_id': ad_ids,
+        'price': pd.to_numeric(listings.get('price_numeric'), errors='coerce'),
+        'currency': listings.get('currency'),
+        'views': pd.to_numeric(listings.get('views'), errors='coerce'),
+    }).dropna(subset=['ad_id'])
+    frame['ad_id'] = frame['ad_id'].astype('int64')
+    return frame.drop_duplicates('ad_id', keep='last').set_index('ad_id')
+
+
+def state_path(root):
+    return os.path.join(root, '_state.parquet')
+
+
+def load_state(root=HISTORY_DIR):
+    if not os.path.exists(state_path(root)):
+        return pd.DataFrame(columns=STATE_COLUMNS, index=pd.Index([], dtype='int64', name='ad_id'))
+    return pd.read_parquet(state_path(root))
+
+
+def _changed(new, old):
+    """Where two float columns differ, counting a value appearing or vanishing as a change"""
+    return ~((new == old) | (new.isna() & old.isna()))
+
+
+def diff_crawl(snapshot, state, crawled_at, complete=False):
+    """Delta rows between the known state and a crawl snapshot, and the updated state"""
+    known = snapshot.index.isin(state.index)
+    previous = state.reindex(snapshot.index)
+    was_present = previous['present'].fillna(False).astype(bool).to_numpy()
+    price_changed = _changed(snapshot['price'], previous['price'].astype(float))
+    views_changed = _changed(snapshot['views'], previous['views'].astype(float))
+
+    event = np.select([~known, ~was_present, price_changed | views_changed], ['new', 'reappeared', 'changed'], '')
+    show_price = (event != 'changed') | price_changed.to_numpy()
+    show_views = (event != 'changed') | views_changed.to_numpy()
+    rows = pd.DataFrame({
+        'ad_id': snapshot.index,
+        'event': event,
+        'price': snapshot['price'].where(show_price).to_numpy(),
+        'previous_price': previous['price'].astype(float).where(known & show_price).to_numpy(),
+        'currency': snapshot['currency'].where(show_price).to_numpy(),
+        'views': snapshot['views'].where(show_views).to_numpy(),
+    })
+    rows = rows[rows['event'] != '']
+
+    gone = pd.Index([], dtype='int64')
+    if complete:
+        present = state[state['present'].fillna(False).astype(bool)]
+        gone = present.index.difference(snapshot.index)
+        rows = pd.concat([rows, pd.DataFrame({'ad_id': gone, 'event': 'removed'})], ignore_index=True)
+    rows['crawled_at'] = pd.Timestamp(crawled_at)
+
+    updated = snapshot.assign(present=True, last_seen=pd.Timestamp(crawled_at),
+                              first_seen=state['first_seen'].reindex(snapshot.index).fillna(pd.Timestamp(crawled_at)))
+    state = pd.concat([state[~state.index.isin(snapshot.index)], updated[STATE_COLUMNS]])
+    state.loc[gone, 'present'] = False
+    return rows.sort_values('ad_id', kind='stable'), state.sort_index()
+
+
+def record_crawl(listings, crawled_at=None, complete=False, root=HISTORY_DIR):
+    """Append the changes one crawl shows to the history; returns the number of delta rows.
+
+    `listings` are the crawl's dicts, records or DataFrame. Only with
+    complete (every ad on the site was crawled) are ads missing from it
+    recorded as removed; an incremental crawl says nothing about them.
+    """
+    crawled_at = pd.Timestamp(crawled_at or datetime.datetime.now()).floor('s')
+    rows, state = diff_crawl(snapshot_frame(listings), load_state(root), crawled_at, complete)
+    table = pa.Table.from_pandas(rows[EVENT_SCHEMA.names], schema=EVENT_SCHEMA, preserve_index=False)
+    directory = partition_path(root, crawled_at.date())
+    os.makedirs(directory, exist_ok=True)
+    name = f'part-{time.time_ns()}.parquet'
+    # The part file first: a crash before the state is saved repeats these deltas rather than losing them
+    tmp = os.path.join(directory, f'.{name}')
+    pq.write_table(table, tmp, row_group_size=ROW_GROUP)
+    os.replace(tmp, os.path.join(directory, name))
+    tmp = state_path(root) + '.tmp'
+    state.to_parquet(tmp)
+    os.replace(tmp, state_path(root))
+    return len(rows)
+
+
+def read_history(root=HISTORY_DIR, filter=None, columns=None):
+    if not glob.glob(os.path.join(root, 'crawl_date=*')):
+        return pd.DataFrame(columns=columns or EVENT_SCHEMA.names)
+    dataset = ds.dataset(root, format='parquet', partitioning='hive', exclude_invalid_files=True,
+                         schema=EVENT_SCHEMA.append(pa.field('crawl_date', pa.string())))
+    table = dataset.to_table(columns=columns, filter=filter)
+    return table.to_pandas(types_mapper={pa.int32(): pd.Int32Dtype()}.get)
+
+
+def ad_history(ad_id, root=HISTORY_DIR):
+    """Every recorded change of one ad (an ID or its URL), oldest first"""
+    ad_id = int(ad_id_from_url(ad_id) if isinstance(ad_id, str) and not ad_id.isdigit() else ad_id)
+    frame = read_history(root, ds.field('ad_id') == ad_id, columns=EVENT_SCHEMA.names)
+    return frame.sort_values('crawled_at').reset_index(drop=True)
+
+
+def price_trajectory(ad_id, root=HISTORY_DIR):
+    """crawled_at and price of one ad at every crawl where its price was set or changed"""
+    history = ad_history(ad_id, root)
+    return history.loc[history['price'].notna(), ['crawled_at', 'price', 'currency']].reset_index(drop=True)
+
+
+def price_drops(since, root=HISTORY_DIR):
+    """Ads whose price went down since `since`: price before, price now, and the drop, biggest first"""
+    since = pd.Timestamp(since)
+    # Partitions before `since` are skipped without being opened
+    expression = ((ds.field('crawl_date') >= since.date().isoformat()) & (ds.field('crawled_at') >= since)
+                  & (ds.field('event') == 'changed') & ds.field('price').is_valid())
+    changes = read_history(root, expression, ['ad_id', 'crawled_at', 'price', 'previous_price'])
+    if changes.empty:
+        return pd.DataFrame(columns=['ad_id', 'price_before', 'price_now', 'drop', 'drop_pct'])
+    changes = changes.sort_values(['ad_id', 'crawled_at'])
+    per_ad = changes.groupby('ad_id').agg(price_before=('previous_price', 'first'), price_now=('price', 'last'))
+    per_ad['drop'] = per_ad['price_before'] - per_ad['price_now']
+    per_ad['drop_pct'] = per_ad['drop'] / per_ad['price_before'] * 100
+    drops = per_ad[per_ad['drop'] > 0].sort_values('drop', ascending=False)
+    return drops.reset_index()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Price and views history of ads across crawls")
+    parser.add_argument('--root', default=HISTORY_DIR)
+    commands = parser.add_subparsers(dest='command', required=True)
+    record = commands.add_parser('record', help="append the changes in one crawl's output (CSVs or Parquet)")
+    record.add_argument('listings', nargs='+', help="files of one crawl, e.g. 'parallel_car_listings*.csv'")
+    record.add_argument('--at', help="crawl time (ISO); defaults to the newest file's modification time")
+    record.add_argument('--complete', action='store_true', help="the crawl covered every ad: record missing ones as removed")
+    ad = commands.add_parser('ad', help="change history of one ad")
+    ad.add_argument('ad', help="ad ID or URL")
+    drops = commands.add_parser('drops', help="ads whose price dropped recently")
+    drops.add_argument('--days', type=float, default=7)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == 'record':
+        paths = sorted(path for pattern in args.listings for path in glob.glob(pattern))
+        if not paths:
+            parser.error(f"no listings matched {' '.join(args.listings)}")
+        crawled_at = args.at or datetime.datetime.fromtimestamp(max(os.path.getmtime(path) for path in paths))
+        listings = pd.concat([load_listings(path, columns=['url', 'price_numeric', 'currency', 'views'])
+                              for path in paths], ignore_index=True)
+        rows = record_crawl(listings, crawled_at, args.complete, args.root)
+        print(f"Recorded {rows} changes from {len(listings)} listings at {pd.Timestamp(crawled_at):%Y-%m-%d %H:%M}")
+    elif args.command == 'ad':
+        print(ad_history(args.ad, args.root).to_string(index=False))
+    else:
+        since = pd.Timestamp.now() - pd.Timedelta(days=args.days)
+        result = price_drops(since, args.root)
+        print(result.to_string(index=False))
+        print(f"{len(result)} ads dropped their price since {since:%Y-%m-%d %H:%M}")
+    print(f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+import argparse
+import ast
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import requests
+from tenacity import retry
+
+from fetch import download, make_session
+from metrics import METRICS
+from ratelimit import GONE_STATUSES, RETRY_POLICY, AdaptiveRateLimiter, RetryableStatus, check_status
+from sink import ROW_GROUP
+from urls import ad_id_from_url, rebase_url
+
+# Listing photos, stored once per SHA-256 under objects/ with a small JPEG
+# thumbnail per photo under thumbs/, for the dashboards
+IMAGES_DIR = 'images'
+THUMB_SIZE = (320, 240)
+# Downloads in flight, and processes making thumbnails
+IMAGE_WORKERS = 8
+THUMB_WORKERS = os.cpu_count() or 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    url TEXT PRIMARY KEY,
+    ad_id TEXT,
+    digest TEXT,
+    size INTEGER,
+    width INTEGER,
+    height INTEGER,
+    fetched_at REAL NOT NULL
+)
+"""
+
+
+class ImageStore:
+    """Content-addressed photo store with a SQLite index of image URLs.
+
+    A URL is recorded only once its body is safely on disk, so an
+    interrupted run can be repeated and only fetches what is missing.
+    Photos that come back byte-identical under another URL share one
+    object and one thumbnail.
+    """
+
+    def __init__(self, path=IMAGES_DIR):
+        self.path = path
+        for directory in ('objects', 'thumbs', 'tmp'):
+            os.makedirs(os.path.join(path, directory), exist_ok=True)
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(path, 'index.sqlite'), check_same_thread=False)
+        self.db.execute(SCHEMA)
+
+    def object_path(self, digest):
+        return os.path.join(self.path, 'objects', digest[:2], digest)
+
+    def thumb_path(self, digest):
+        return os.path.join(self.path, 'thumbs', digest[:2], f'{digest}.jpg')
+
+    def tmp_path(self):
+        return os.path.join(self.path, 'tmp', f'{threading.get_ident()}.part')
+
+    def known(self, url):
+        with self._lock:
+            return self.db.execute("SELECT 1 FROM images WHERE url = ?", (url,)).fetchone() is not None
+
+    def add(self, url, ad_id, digest, size):
+        with self._lock:
+            self.db.execute("INSERT OR REPLACE INTO images (url, ad_id, digest, size, fetched_at) VALUES (?, ?, ?, ?, ?)",
+                            (url, ad_id, digest, size, time.time()))
+            self.db.commit()
+
+    def set_dimensions(self, digest, width, height):
+        with self._lock:
+            self.db.execute("UPDATE images SET width = ?, height = ? WHERE digest = ?", (width, height, digest))
+            self.db.commit()
+
+    def missing_thumbnails(self):
+        """Stored photos whose thumbnail was never made, e.g. after a crash"""
+        with self._lock:
+            digests = [row[0] for row in self.db.execute("SELECT DISTINCT digest FROM images WHERE digest IS NOT NULL")]
+        return [digest for digest in digests if not os.path.exists(self.thumb_path(digest))]
+
+    def commit_object(self, tmp, digest):
+        """Move a finished download into objects/; False if that content was already stored"""
+        path = self.object_path(digest)
+        with self._lock:
+            if os.path.exists(path):
+                os.remove(tmp)
+                return False
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp, path)
+            return True
+
+    def close(self):
+        self.db.close()
+
+
+def image_urls(value):
+    """The images column of a listing: a list, or its repr as stored in the CSVs"""
+    if isinstance(value, str):
+        try:
+            value = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            return [value]
+    try:
+        return [url for url in value if isinstance(url, str) and url]
+    except TypeError:
+        return []
+
+
+def make_thumbnail(source, dest, size=THUMB_SIZE):
+    """Write a JPEG thumbnail of source; returns the original width, height and the seconds taken"""
+    from PIL import Image
+
+    start = time.perf_counter()
+    with Image.open(source) as image:
+        width, height = image.size
+        # JPEG decoders can scale by 1/2..1/8 while decoding, far cheaper than a full decode
+        image.draft('RGB', size)
+        image = image.convert('RGB')
+        image.thumbnail(size)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp = f'{dest}.{os.getpid()}.tmp'
+        image.save(tmp, 'JPEG', quality=80, optimize=True)
+    os.replace(tmp, dest)
+    return width, height, time.perf_counter() - start
+
+
+@retry(**RETRY_POLICY)
+def download_image(url, tmp, session=None, limiter=None):
+    """Stream url into tmp with the shared retry policy; (digest, size), or None if it is gone (404/410).
+
+    Other errors raise, so the photo is asked for again on a later run.
+    """
+    if limiter:
+        limiter.wait()
+    start = time.monotonic()
+    try:
+        with open(tmp, 'wb') as file:
+            response, digest, size = download(url, file, session)
+        check_status(response)
+    except (RetryableStatus, requests.ConnectionError, requests.Timeout) as e:
+        if limiter:
+            limiter.on_response_error(e)
+        raise
+    if limiter:
+        limiter.on_success(time.monotonic() - start)
+    if digest:
+        return digest, size
+    if response.status_code in GONE_STATUSES:
+        return None
+    raise requests.HTTPError(f"HTTP {response.status_code}", response=response)
+
+
+def fetch_images(listings, store, workers=IMAGE_WORKERS, thumb_workers=THUMB_WORKERS, session=None,
+                 limiter=None, base_url=None):
+    """Download the photos of listings into store and thumbnail new ones.
+
+    `listings` is any iterable of dicts with 'url' and 'images'. At most
+    `workers` downloads are in flight; URLs already in the store or seen
+    earlier in this run are skipped. With base_url, photos are fetched
+    from that host instead (the fixture server) but indexed under their
+    original URLs. Returns a dict of counts.
+    """
+    session = session or make_session(workers)
+    limiter = limiter or AdaptiveRateLimiter()
+    stats = {'downloaded': 0, 'bytes': 0, 'skipped': 0, 'duplicate_urls': 0, 'duplicate_content': 0,
+             'thumbnails': 0, 'failed': 0}
+    seen = set()
+
+    def queued():
+        for listing in listings:
+            ad_id = ad_id_from_url(listing.get('url'))
+            for url in image_urls(listing.get('images')):
+                if url in seen:
+                    stats['duplicate_urls'] += 1
+                    continue
+                seen.add(url)
+                if store.known(url):
+                    stats['skipped'] += 1
+                    continue
+                yield ad_id, url
+
+    def fetch_one(url):
+        # Runs on a download thread; the part file is per thread, so it is committed or removed here
+        tmp = store.tmp_path()
+        try:
+            with METRICS.timer('image.fetch'):
+                result = download_image(rebase_url(url, base_url) if base_url else url, tmp, session, limiter)
+            if result is None:
+                return None
+            digest, size = result
+            return digest, size, store.commit_object(tmp, digest)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def thumbnail_done(future, digest):
+        try:
+            width, height, elapsed = future.result()
+        except Exception as e:
+            print(f"Error making thumbnail for {digest}: {str(e)}")
+            return
+        METRICS.observe('image.thumbnail', elapsed)
+        store.set_dimensions(digest, width, height)
+        stats['thumbnails'] += 1
+
+    def drain(thumbnails, limit):
+        """Record finished thumbnails, waiting on the oldest while more than limit are queued"""
+        while len(thumbnails) > limit:
+            thumbnail_done(*thumbnails.pop(0))
+        remaining = []
+        for future, digest in thumbnails:
+            if future.done():
+                thumbnail_done(future, digest)
+            else:
+                remaining.append((future, digest))
+        return remaining
+
+    with ThreadPoolExecutor(max_workers=workers) as io_pool, ProcessPoolExecutor(thumb_workers) as thumb_pool:
+        thumbnails = [(thumb_pool.submit(make_thumbnail, store.object_path(digest), store.thumb_path(digest)), digest)
+                      for digest in store.missing_thumbnails()]
+        pending = {}
+        images = queued()
+        while True:
+            for ad_id, url in images:
+                pending[io_pool.submit(fetch_one, url)] = (ad_id, url)
+                if len(pending) >= workers * 2:
+                    break
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                ad_id, url = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    stats['failed'] += 1
+                    print(f"Error downloading {url}: {str(e)}")
+                    continue
+                if result is None:
+                    # Gone from the site; recorded so later runs do not ask again
+                    store.add(url, ad_id, None, 0)
+                    continue
+                digest, size, new = result
+                stats['downloaded'] += 1
+                stats['bytes'] += size
+                if new:
+                    thumbnails.append((thumb_pool.submit(make_thumbnail, store.object_path(digest),
+                                                         store.thumb_path(digest)), digest))
+                else:
+                    stats['duplicate_content'] += 1
+                store.add(url, ad_id, digest, size)
+            # Thumbnails lagging far behind the downloads hold back new downloads
+            thumbnails = drain(thumbnails, thumb_workers * 4)
+        drain(thumbnails, 0)
+    return stats
+
+
+def read_listings_images(path):
+    """url and images of every listing in a scraper CSV or Parquet dataset"""
+    from storage import load_listings
+    return load_listings(path, columns=['url', 'images']).to_dict('records')
+
+
+def iter_listings_images(paths, chunk_size=ROW_GROUP):
+    """url and images of the listings in scraper CSVs or Parquet files, read a chunk at a time"""
+    import pandas as pd
+    import pyarrow.parquet as pq
+
+    for path in paths:
+        if path.endswith('.csv'):
+            for chunk in pd.read_csv(path, usecols=['url', 'images'], chunksize=chunk_size):
+                yield from chunk.to_dict('records')
+        else:
+            for batch in pq.ParquetFile(path).iter_batches(chunk_size, columns=['url', 'images']):
+                yield from batch.to_pylist()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download listing photos and make thumbnails")
+    parser.add_argument('listings', nargs='?', default='sequential_car_listings_cleaned.csv',
+                        help="scraper CSV, Parquet file or dataset with url and images columns")
+    parser.add_argument('--store', default=IMAGES_DIR)
+    parser.add_argument('--limit', type=int, default=None, help="only the first N listings")
+    parser.add_argument('--workers', type=int, default=IMAGE_WORKERS)
+    parser.add_argument('--thumb-workers', type=int, default=THUMB_WORKERS)
+    args = parser.parse_args()
+
+    listings = read_listings_images(args.listings)[:args.limit]
+    store = ImageStore(args.store)
+    stats = fetch_images(listings, store, args.workers, args.thumb_workers)
+    store.close()
+    print(f"Downloaded {stats['downloaded']} photos ({stats['bytes'] / 1e6:.1f} MB), "
+          f"{stats['thumbnails']} thumbnails; skipped {stats['skipped']} stored, "
+          f"{stats['duplicate_urls']} repeated URLs, {stats['duplicate_content']} identical photos; "
+          f"{stats['failed']} failed")
+
+
+if __name__ == "__main__":
+    main()
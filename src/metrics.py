@@ -0,0 +1,225 @@
+import json
+import math
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Histogram buckets grow by 10% from 1 µs, so percentiles are within 10%
+BUCKET_BASE = 1e-6
+BUCKET_GROWTH = 1.1
+_LOG_GROWTH = math.log(BUCKET_GROWTH)
+PROGRESS_INTERVAL = 2.0
+
+
+class Histogram:
+    """Log-bucketed latency histogram: constant memory, O(1) record"""
+
+    def __init__(self):
+        self.buckets = Counter()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        index = int(math.log(seconds / BUCKET_BASE) / _LOG_GROWTH) + 1 if seconds > BUCKET_BASE else 0
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def merge(self, other):
+        self.buckets.update(other.buckets)
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q-th quantile"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self.max, BUCKET_BASE * BUCKET_GROWTH ** index)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(0.50),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+            'max': self.max,
+        }
+
+
+class Gauge:
+    """Current value plus its peak and time-weighted mean"""
+
+    def __init__(self):
+        self.value = 0
+        self.peak = 0
+        self.area = 0.0
+        self.started = self._updated = time.monotonic()
+
+    def add(self, delta):
+        now = time.monotonic()
+        self.area += self.value * (now - self._updated)
+        self._updated = now
+        self.value += delta
+        self.peak = max(self.peak, self.value)
+
+    def summary(self):
+        now = time.monotonic()
+        area = self.area + self.value * (now - self._updated)
+        return {'current': self.value, 'peak': self.peak, 'mean': area / max(now - self.started, 1e-9)}
+
+
+class Metrics:
+    """Stage timers, counters and gauges for one crawl.
+
+    Stages are named `<area>.<step>`, e.g. fetch.connect, fetch.wait,
+    fetch.download, parse.tree, parse.fields. Work done in another process
+    is recorded inside capture() on that side and merged into the parent
+    with merge(). With enabled=False every call is a no-op.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.monotonic()
+            self.stages = {}
+            self.counters = Counter()
+            self.gauges = {}
+
+    def observe(self, stage, seconds):
+        if not self.enabled:
+            return
+        captured = getattr(self._local, 'captured', None)
+        if captured is not None:
+            captured.append((stage, seconds))
+            return
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.record(seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def count(self, name, value=1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] += value
+
+    @contextmanager
+    def track(self, name):
+        """Count the calls currently inside the block in gauge `name`"""
+        if not self.enabled:
+            yield
+            return
+        with self._lock:
+            gauge = self.gauges.get(name)
+            if gauge is None:
+                gauge = self.gauges[name] = Gauge()
+            gauge.add(1)
+        try:
+            yield
+        finally:
+            with self._lock:
+                gauge.add(-1)
+
+    @contextmanager
+    def capture(self):
+        """Collect this thread's observations in a list instead of recording them"""
+        self._local.captured = samples = []
+        try:
+            yield samples
+        finally:
+            self._local.captured = None
+
+    def merge(self, samples):
+        for stage, seconds in samples:
+            self.observe(stage, seconds)
+
+    def report(self):
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            return {
+                'elapsed': elapsed,
+                'counters': dict(self.counters),
+                'rates': {name: value / elapsed for name, value in self.counters.items() if elapsed},
+                'stages': {stage: histogram.summary() for stage, histogram in sorted(self.stages.items())},
+                'gauges': {name: gauge.summary() for name, gauge in self.gauges.items()},
+            }
+
+    def write_report(self, path):
+        report = self.report()
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2, sort_keys=True)
+        return report
+
+    def progress_line(self):
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            listings = self.counters['listings']
+            errors = sum(value for name, value in self.counters.items() if name.startswith('errors.'))
+            inflight = self.gauges['fetch.inflight'].value if 'fetch.inflight' in self.gauges else 0
+            fetch = self.stages.get('fetch.total')
+            p95 = fetch.percentile(0.95) * 1000 if fetch else 0.0
+            megabytes = self.counters['bytes'] / 1e6
+        return (f"{elapsed:6.0f}s  {listings} listings ({listings / max(elapsed, 1e-9):.1f}/s)  "
+                f"{megabytes:.1f} MB  in flight {inflight}  fetch p95 {p95:.0f} ms  "
+                f"retries {self.counters['retries']}  errors {errors}")
+
+    @contextmanager
+    def progress(self, interval=PROGRESS_INTERVAL, stream=None):
+        """Redraw progress_line() on stream (stderr) every interval seconds"""
+        stream = stream or sys.stderr
+        stop = threading.Event()
+
+        def draw():
+            while not stop.wait(interval):
+                stream.write('\r' + self.progress_line())
+                stream.flush()
+
+        thread = threading.Thread(target=draw, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+            stream.write('\r' + self.progress_line() + '\n')
+
+
+METRICS = Metrics()
+
+
+def print_report(report, stream=None):
+    stream = stream or sys.stdout
+    print(f"{report['elapsed']:.1f}s, " + ', '.join(f'{name} {value}' for name, value
+                                                    in sorted(report['counters'].items())), file=stream)
+    for stage, summary in report['stages'].items():
+        print(f"  {stage:<16} n={summary['count']:<6} p50 {summary['p50'] * 1000:8.2f} ms  "
+              f"p95 {summary['p95'] * 1000:8.2f} ms  p99 {summary['p99'] * 1000:8.2f} ms  "
+              f"total {summary['total']:.2f}s", file=stream)
+    for name, gauge in report['gauges'].items():
+        print(f"  {name:<16} peak {gauge['peak']}, mean {gauge['mean']:.1f}", file=stream)
@@ -0,0 +1,135 @@
+import datetime
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+# Typed values from the display strings on listing pages. The strings
+# repeat across thousands of ads (a crawl sees ~25 mileage brackets and a
+# handful of engine sizes and seller labels), so each distinct string is
+# parsed once and kept in a bounded LRU table: converting a listing is a
+# few dict hits instead of a regex per field. normalize_frame runs the
+# same conversions over DataFrame columns, once per distinct value.
+CACHE_SIZE = 4096
+
+NUMBERS = re.compile(r'\d+')
+DECIMAL = re.compile(r'\d+\.?\d*')
+# Seller labels of the English pages, kept as they are
+SELLER_LABELS = {'Private', 'Store', 'Business'}
+REGISTRATION_FORMATS = ['%m/%Y', '%Y-%m']
+# Listing prices in MKD are compared in EUR at the denar's peg
+MKD_PER_EUR = 61.5
+
+# Macedonian Cyrillic to the Latin spelling people type, then both folded to
+# one form: š/sh/ш -> s, kj/ќ/ć -> k, and so on, as the Latin spellings vary
+CYRILLIC = dict(zip('абвгдѓежзѕијклљмнњопрстќуфхцчџш',
+                    ['a', 'b', 'v', 'g', 'd', 'gj', 'e', 'zh', 'z', 'dz', 'i', 'j', 'k', 'l', 'lj', 'm', 'n', 'nj',
+                     'o', 'p', 'r', 's', 't', 'kj', 'u', 'f', 'h', 'c', 'ch', 'dj', 'sh']))
+DIACRITICS = {'š': 'sh', 'č': 'ch', 'ž': 'zh', 'ć': 'kj', 'ќ': 'kj', 'đ': 'dj', 'ǵ': 'gj'}
+DIGRAPHS = ['zh', 'sh', 'ch', 'dz', 'dj', 'gj', 'kj', 'lj', 'nj']
+_TRANSLITERATE = str.maketrans({**CYRILLIC, **{letter.upper(): latin for letter, latin in CYRILLIC.items()}, **DIACRITICS})
+
+
+class MileageRange(namedtuple('MileageRange', ['start', 'end'])):
+    """A mileage bracket in km, e.g. '200 000 - 249 999' -> (200000, 249999)"""
+
+    __slots__ = ()
+
+    @property
+    def midpoint(self):
+        return (self.start + self.end + 1) // 2
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def mileage_range(value):
+    """MileageRange of a bracket or a single figure; None without a number"""
+    if not isinstance(value, str):
+        return None
+    numbers = NUMBERS.findall(value.replace(' ', ''))
+    if not numbers:
+        return None
+    return MileageRange(int(numbers[0]), int(numbers[-1]))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def engine_size(value):
+    """Litres from e.g. '1.9', '1,9 TDI'; None without a number"""
+    if not isinstance(value, str):
+        return None
+    match = DECIMAL.search(value.replace(',', '.'))
+    return float(match.group()) if match else None
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def registration_date(value):
+    """'YYYY-MM' from a 'MM/YYYY' registration date (or one already normalized)"""
+    if not isinstance(value, str):
+        return None
+    for pattern in REGISTRATION_FORMATS:
+        try:
+            return datetime.datetime.strptime(value.strip(), pattern).strftime('%Y-%m')
+        except ValueError:
+            continue
+    return None
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def seller_type(value):
+    """'Private' for a private person ('Физичко лице'), 'Business' for any other Macedonian label"""
+    if not isinstance(value, str):
+        return None
+    if value in SELLER_LABELS:
+        return value
+    return 'Private' if 'Физичко' in value else 'Business'
+
+
+def fold(text):
+    """Lowercase Latin form of Cyrillic or Latin Macedonian text"""
+    text = text.lower()
+    if not text.isascii():
+        text = text.translate(_TRANSLITERATE)
+    for digraph in DIGRAPHS:
+        if digraph in text:
+            text = text.replace(digraph, digraph[0])
+    return text
+
+
+def cache_info():
+    return {convert.__name__: convert.cache_info()
+            for convert in (mileage_range, engine_size, registration_date, seller_type)}
+
+
+def _converted(series, convert):
+    """convert applied once per distinct value of series; (codes, values) with -1 for missing"""
+    import pandas as pd
+    codes, uniques = pd.factorize(series.astype(object))
+    return codes, [convert(value) for value in uniques]
+
+
+def _take(codes, values, dtype=None):
+    """values[code] for every code, as a pandas array of dtype (None keeps strings as objects)"""
+    import numpy as np
+    import pandas as pd
+    # The trailing None is what code -1 (a missing value) picks
+    taken = np.array(values + [None], dtype=object)[codes]
+    return taken if dtype is None else pd.array(taken, dtype=dtype)
+
+
+def normalize_frame(df):
+    """The conversions above over the columns df has, in place; returns df.
+
+    mileage fills mileage_start and mileage_end, engine_size and
+    registration_date are parsed, and seller_type labels are mapped.
+    """
+    import pandas as pd
+
+    if 'mileage' in df:
+        codes, ranges = _converted(df['mileage'], mileage_range)
+        df['mileage_start'] = _take(codes, [r.start if r else None for r in ranges], 'Int32')
+        df['mileage_end'] = _take(codes, [r.end if r else None for r in ranges], 'Int32')
+    for column, convert, dtype in (('engine_size', engine_size, 'Float64'),
+                                   ('registration_date', registration_date, None),
+                                   ('seller_type', seller_type, None)):
+        # Numeric columns are already converted
+        if column in df and not pd.api.types.is_numeric_dtype(df[column]):
+            df[column] = _take(*_converted(df[column], convert), dtype)
+    return df
@@ -1,16 +1,19 @@
-import requests
-from bs4 import BeautifulSoup
-import pandas as pd
+import argparse
 import time
+import contextlib
+import os
 import re
-import random
-from fake_useragent import UserAgent
-from urllib.parse import urljoin
-import threading
-from tenacity import retry, stop_after_attempt, wait_random_exponential
-import csv
-import concurrent.futures
-from concurrent.futures import ThreadPoolExecutor
+from extract import ExtractionPlan, get_text, parse_html
+from sink import open_sink
+from urls import ad_id_from_url, ad_url
+from metrics import METRICS, print_report
+from record import Listing
+from normalize import engine_size, mileage_range, registration_date, seller_type
+
+# Importing this module only pulls in what parsing needs (lxml and the
+# stdlib), so parse workers and short cron runs start fast. The network
+# stack, BeautifulSoup and the optional image and search stages are
+# imported by the functions that use them.
 
 BASE_URL = "https://www.pazar3.mk"
 
@@ -47,14 +50,6 @@ field_mapping = {
 
 page_number = '1'
 
-def get_headers():
-    ua = UserAgent()
-    return {
-        'User-Agent': ua.random,
-        'Accept-Language': 'mk-MK,en-US;q=0.7',
-        'X-Requested-With': 'XMLHttpRequest'
-}
-
 def safe_extract(soup, selector, attr=None):
     try:
         element = soup.select_one(selector)
@@ -68,109 +63,195 @@ def safe_extract(soup, selector, attr=None):
     except Exception:
         return None
 
-def scrape_listing(url):
+def scrape_listing(url, session=None, limiter=None, breaker=None):
+    from ratelimit import fetch_with_retry
     try:
-        response = requests.get(url, headers=get_headers(), timeout=15)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Core metadata
-        data = {
-            'title': safe_extract(soup, 'h1.ci-text-base', 'text'),
-            'price': clean_price(safe_extract(soup, 'span.actual-price', 'text')),
-            'description': safe_extract(soup, 'div.description-area', 'text'),
-            'url': url,
-            'images': [img['data-src'] for img in soup.select('img.lazyload') if img.has_attr('data-src')],
-            
-            # Address components
-            'address': safe_extract(soup, '.display-ad-address', 'text'),
-            'coordinates': extract_coordinates(soup),
-            
-            # Publication info
-            'publish_date': safe_extract(soup, '.published-date', 'text'),
-            'publish_time': safe_extract(soup, '.published-time', 'text'),
-            'views': safe_extract(soup, '.views-number span', 'text'),
-            
-            # Contact information
-            'phone': safe_extract(soup, 'a[href^="tel:"]', 'text'),
-            'has_message_button': bool(soup.select_one('[data-target="#contactModal"]'))
-        }
+        with METRICS.timer('listing'):
+            response = fetch_with_retry(url, session, limiter, breaker)
+            listing = parse_listing(response.text, url)
+        METRICS.count('listings')
+        return listing
 
-        # Extract and process tags-area
-        tags = soup.select('div.tags-area a.tag-item')
-        for tag in tags:
-            key = safe_extract(tag, 'span', 'text').replace(':', '').strip()
-            value = safe_extract(tag, 'bdi', 'text')
-            if key and value:
-                data[key] = value
-                
-        
-
-        # Enhanced field processing
-        data.update({
-            'price_value': parse_price_value(data.get('price', '')),
-            'price_currency': parse_price_currency(data.get('price', '')),
-            'mileage_start': parse_mileage_range(data.get('Километража', ''), 'start'),
-            'mileage_end': parse_mileage_range(data.get('Километража', ''), 'end'),
-            'manufacturer': data.get('Производител') or data.get('Manufacturer'),
-            'model': data.get('Модел') or data.get('Model'),
-            'registration_date': parse_registration_date(data.get('Регистрација', ''))
-        })
-        
-        price_info = extract_price(soup)
-        data.update({
-            'price_value': price_info['price_value'],
-            'price_currency': price_info['price_currency'],
-            'price_display': price_info['price_display']
-        })
-
-        # Convert numeric fields
-        conversions = {
-            'year': ('Година', int),
-            'engine_size': ('Мотор', parse_engine_size),
-            'seller_type': ('Огласено од', lambda x: 'Private' if 'Физичко' in x else 'Business')
-        }
-        
-        for field, (source, func) in conversions.items():
-            if source in data:
-                try:
-                    data[field] = func(data[source])
-                except (ValueError, TypeError):
-                    data[field] = None
-
-        return {field_mapping.get(k, k): v for k, v in data.items() if v is not None}
-    
     except Exception as e:
+        METRICS.count('failed')
         print(f"Error scraping {url}: {str(e)}")
         return None
 
+# Every selector parse_listing reads, compiled once and resolved in one tree walk
+LISTING_PLAN = ExtractionPlan({
+    'title': 'h1.ci-text-base',
+    'price': 'span.actual-price',
+    'description': 'div.description-area',
+    'images': ('img.lazyload', 'all'),
+    'address': '.display-ad-address',
+    'map_link': 'a.map[data-target="location"]',
+    'publish_date': '.published-date',
+    'publish_time': '.published-time',
+    'views': '.views-number span',
+    'phone': 'a[href^="tel:"]',
+    'message_button': '[data-target="#contactModal"]',
+    'tags': ('div.tags-area a.tag-item', 'all'),
+    'price_value': 'span.format-money-int[value]',
+    'price_currency': 'bdi.new-price > span:not([class])',
+})
+TAG_PLAN = ExtractionPlan({'key': 'span', 'value': 'bdi'})
+
+def parse_listing(html, url):
+    start = time.perf_counter()
+    found = LISTING_PLAN.apply(parse_html(html), include_root=True)
+    tree = time.perf_counter()
+    METRICS.observe('parse.tree', tree - start)
+    map_link = found['map_link']
+
+    # Core metadata
+    data = {
+        'title': get_text(found['title']),
+        'price': clean_price(get_text(found['price'])),
+        'description': get_text(found['description']),
+        'url': url,
+        'images': [img.get('data-src') for img in found['images'] if img.get('data-src') is not None],
+
+        # Address components
+        'address': get_text(found['address']),
+        'coordinates': parse_coordinates(map_link.get('data-coords') if map_link is not None else None),
+
+        # Publication info
+        'publish_date': get_text(found['publish_date']),
+        'publish_time': get_text(found['publish_time']),
+        'views': get_text(found['views']),
+
+        # Contact information
+        'phone': get_text(found['phone']),
+        'has_message_button': found['message_button'] is not None
+    }
+
+    # Extract and process tags-area
+    for tag in found['tags']:
+        parts = TAG_PLAN.apply(tag)
+        key = get_text(parts['key']).replace(':', '').strip()
+        value = get_text(parts['value'])
+        if key and value:
+            data[key] = value
+
+    value_span = found['price_value']
+    price_info = price_fields(
+        int(value_span.get('value')) if value_span is not None else None,
+        get_text(value_span),
+        get_text(found['price_currency']))
+    listing = finish_listing(data, price_info)
+    METRICS.observe('parse.fields', time.perf_counter() - tree)
+    return listing
+
+def parse_listing_record(html, url):
+    """parse_listing as a typed Listing record, as the crawl keeps them"""
+    listing = parse_listing(html, url)
+    return Listing.from_dict(listing) if listing else None
+
+def parse_listing_soup(html, url):
+    """Reference BeautifulSoup parser; parse_listing must return the same dict"""
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # Core metadata
+    data = {
+        'title': safe_extract(soup, 'h1.ci-text-base', 'text'),
+        'price': clean_price(safe_extract(soup, 'span.actual-price', 'text')),
+        'description': safe_extract(soup, 'div.description-area', 'text'),
+        'url': url,
+        'images': [img['data-src'] for img in soup.select('img.lazyload') if img.has_attr('data-src')],
+        
+        # Address components
+        'address': safe_extract(soup, '.display-ad-address', 'text'),
+        'coordinates': extract_coordinates(soup),
+        
+        # Publication info
+        'publish_date': safe_extract(soup, '.published-date', 'text'),
+        'publish_time': safe_extract(soup, '.published-time', 'text'),
+        'views': safe_extract(soup, '.views-number span', 'text'),
+        
+        # Contact information
+        'phone': safe_extract(soup, 'a[href^="tel:"]', 'text'),
+        'has_message_button': bool(soup.select_one('[data-target="#contactModal"]'))
+    }
+
+    # Extract and process tags-area
+    tags = soup.select('div.tags-area a.tag-item')
+    for tag in tags:
+        key = safe_extract(tag, 'span', 'text').replace(':', '').strip()
+        value = safe_extract(tag, 'bdi', 'text')
+        if key and value:
+            data[key] = value
+
+    price_info = extract_price(soup)
+    return finish_listing(data, price_info)
+
+def finish_listing(data, price_info):
+    # Enhanced field processing; the repeated strings are parsed once per crawl, see normalize.py
+    mileage = mileage_range(data.get('Километража'))
+    data.update({
+        'price_value': parse_price_value(data.get('price', '')),
+        'price_currency': parse_price_currency(data.get('price', '')),
+        'mileage_start': mileage.start if mileage else None,
+        'mileage_end': mileage.end if mileage else None,
+        'manufacturer': data.get('Производител') or data.get('Manufacturer'),
+        'model': data.get('Модел') or data.get('Model'),
+        'registration_date': registration_date(data.get('Регистрација'))
+    })
+
+    data.update({
+        'price_value': price_info['price_value'],
+        'price_currency': price_info['price_currency'],
+        'price_display': price_info['price_display']
+    })
+
+    # Convert numeric fields
+    conversions = {
+        'year': ('Година', int),
+        'engine_size': ('Мотор', engine_size),
+        'seller_type': ('Огласено од', seller_type)
+    }
+
+    for field, (source, func) in conversions.items():
+        if source in data:
+            try:
+                data[field] = func(data[source])
+            except (ValueError, TypeError):
+                data[field] = None
+
+    return {field_mapping.get(k, k): v for k, v in data.items() if v is not None}
+
 def extract_coordinates(soup):
     map_link = soup.select_one('a.map[data-target="location"]')
     if map_link and 'data-coords' in map_link.attrs:
-        return tuple(map(float, map_link['data-coords'].split(',')))
+        return parse_coordinates(map_link['data-coords'])
     return None
 
+def parse_coordinates(coords):
+    if coords is None:
+        return None
+    return tuple(map(float, coords.split(',')))
+
 def extract_price(soup):
-    price_data = {
-        'price_value': None,
-        'price_currency': None,
-        'price_display': None
-    }
-    
     # Extract numeric value from hidden attribute
     price_value_span = soup.select_one('span.format-money-int[value]')
-    if price_value_span:
-        price_data['price_value'] = int(price_value_span['value'])
-        price_data['price_display'] = price_value_span.get_text(strip=True)
-    
     # Extract currency
     currency_span = soup.select_one('bdi.new-price > span:not([class])')
-    if currency_span:
-        price_data['price_currency'] = currency_span.get_text(strip=True)
-    
+    return price_fields(
+        int(price_value_span['value']) if price_value_span else None,
+        price_value_span.get_text(strip=True) if price_value_span else None,
+        currency_span.get_text(strip=True) if currency_span else None)
+
+def price_fields(value, display, currency):
+    price_data = {
+        'price_value': value,
+        'price_currency': currency,
+        'price_display': display
+    }
+
     # Create combined display format
     if price_data['price_display'] and price_data['price_currency']:
         price_data['price_display'] = f"{price_data['price_display']} {price_data['price_currency']}"
-    
+
     return price_data
 
 
@@ -202,25 +283,6 @@ def parse_price_currency(price_str):
     if not price_str: return None
     return 'MKD' if 'МКД' in price_str else 'EUR'
 
-def parse_mileage_range(value, type='start'):
-    numbers = re.findall(r'\d+', value.replace(' ', ''))
-    if not numbers: return None
-    try:
-        return int(numbers[0] if type == 'start' else numbers[-1])
-    except (IndexError, ValueError):
-        return None
-
-def parse_registration_date(reg_str):
-    try:
-        return datetime.strptime(reg_str, '%m/%Y').strftime('%Y-%m') if reg_str else None
-    except ValueError:
-        return None
-
-def parse_engine_size(value):
-    if not value: return None
-    return float(re.search(r'\d+\.?\d*', value.replace(',', '.')).group())
-
-
 def clean_price(price_str):
     if price_str:
         return re.sub(r'[^\d]', '', price_str)
@@ -231,61 +293,232 @@ def parse_mileage(value):
     return int(''.join(numbers)) if numbers else None
 
 def scrape_search_results(page_number):
-    # Construct the filename based on the page number
-    filename = f'search_results_page_{page_number}.csv'
-    
-    # Initialize an empty list to store the search results
-    search_results = []
-    
+    """Listing URLs on one page of the live search results"""
+    from discovery import fetch_search_page
+    return fetch_search_page(page_number) or []
+
+def parse_pages(spec):
+    """Search page numbers from a spec like '13-22', '1-5,9' or '7', in order and without repeats"""
+    pages = []
+    for part in spec.split(','):
+        first, dash, last = part.strip().partition('-')
+        try:
+            numbers = range(int(first), int(last) + 1) if dash else [int(first)]
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid page range {part!r}, expected e.g. 13-22 or 1-5,9")
+        pages.extend(number for number in numbers if number not in pages)
+    if not pages or min(pages) < 1:
+        raise argparse.ArgumentTypeError(f"invalid page range {spec!r}, pages start at 1")
+    return pages
+
+
+def crawl_pages(pages, on_result, on_found=None, skip=(), base_url=BASE_URL, **crawl_options):
+    """Fetch the given search pages, then crawl the ads on them whose IDs are not in skip"""
+    from concurrent.futures import ThreadPoolExecutor
+    from cache import ListingCache
+    from crawler import crawl
+    from discovery import DISCOVERY_WORKERS, fetch_search_page
+    from fetch import get_session
+    from ratelimit import CircuitBreaker
+
+    # Search pages and ads are held back by the same breaker
+    session, limiter = get_session(), crawl_options.get('limiter')
+    breaker = crawl_options.setdefault('breaker', CircuitBreaker())
+    urls = {}
+    with METRICS.timer('discover'), ThreadPoolExecutor(max_workers=DISCOVERY_WORKERS) as executor:
+        found = executor.map(lambda page: fetch_search_page(page, base_url, session, limiter, breaker), pages)
+        for page, page_urls in zip(pages, found):
+            if on_found:
+                on_found(page, page_urls or [])
+            urls.update((url, None) for url in page_urls or [] if ad_id_from_url(url) not in skip)
+    crawl(list(urls), parse_listing_record, on_result=on_result, base_url=base_url, cache=ListingCache(),
+          **crawl_options)
+    return len(urls)
+
+
+def _run_shard(shard, pages, results, skip, base_url, rate, max_rate, crawl_options):
+    """Shard process: crawl its pages, sending what it finds and scrapes to the parent"""
+    from ratelimit import AdaptiveRateLimiter
+    limiter = AdaptiveRateLimiter(rate, max_rate=max_rate)
+    count = crawl_pages(pages, lambda listing: results.put(('listing', listing)),
+                        lambda page, urls: results.put(('found', page, urls)), skip, base_url,
+                        limiter=limiter, **crawl_options)
+    results.put(('done', shard, count))
+
+
+def run_shards(shards, pages, save, on_found, skip=(), base_url=BASE_URL, rate=None, max_rate=None,
+               **crawl_options):
+    """Crawl contiguous slices of pages in `shards` processes, passing every listing to save here.
+
+    The rate budget and, unless parse_workers is given, the parse workers
+    are split between the shards, so all of them together stay within the
+    budget and the CPUs. A shard that dies loses only its unsaved ads; they are
+    picked up by the next run.
+    """
+    import multiprocessing
+    import queue
+    from crawler import PARSE_WORKERS
+    from ratelimit import MAX_RATE, RATE
+
+    rate, max_rate = rate or RATE, max_rate or MAX_RATE
+    shards = min(shards, len(pages))
+    size = -(-len(pages) // shards)
+    slices = [pages[start:start + size] for start in range(0, len(pages), size)]
+    crawl_options.setdefault('parse_workers', max(1, PARSE_WORKERS // len(slices)))
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue(maxsize=1000)
+    skip = frozenset(skip)
+    processes = [context.Process(target=_run_shard, args=(shard, chunk, results, skip, base_url, rate / len(slices),
+                                                          max_rate / len(slices), crawl_options))
+                 for shard, chunk in enumerate(slices)]
+    for process in processes:
+        process.start()
+    running = len(processes)
     try:
-        # Open the CSV file for reading
-        with open(filename, mode='r', newline='', encoding='utf-8') as file:
-            # Create a CSV reader object
-            csv_reader = csv.reader(file)
-            
-            # Skip the header row if your CSV has headers
-            next(csv_reader, None)
-            
-            # Iterate over each row in the CSV
-            for row in csv_reader:
-                # Join the list of strings into a single string separated by commas
-                row_string = ','.join(row)
-                # Append the string to the search_results list
-                search_results.append(row_string)
-                
-    except FileNotFoundError:
-        print(f"Error: The file '{filename}' does not exist.")
-    except Exception as e:
-        print(f"An error occurred: {e}")
-    
-    return search_results
-
-def main():
-    all_data = []
-
-    # Process pages 1 to 12 sequentially
-    for page_number in range(13, 23):
-        print(f"Processing page {page_number}...")
-        listing_urls = scrape_search_results(page_number)  # Get listing URLs for the current page
-
-        # Process each listing in parallel for this page
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            futures = [executor.submit(scrape_listing, url) for url in listing_urls]
-            for future in concurrent.futures.as_completed(futures):
-                try:
-                    result = future.result()
-                    if result:
-                        all_data.append(result)
-                except Exception as e:
-                    print(f"Error scraping listing: {e}")
-
-        # Optional: add a delay between pages to avoid overwhelming the server
-        time.sleep(5)
-
-    # Save the collected data to a CSV file after processing all pages
-    if all_data:
-        df = pd.DataFrame(all_data).rename(columns=field_mapping)
-        df.to_csv('sequential_car_listings2.csv', index=False)
+        while running:
+            try:
+                message = results.get(timeout=1)
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes):
+                    print(f"{running} shard(s) exited without finishing")
+                    break
+                continue
+            if message[0] == 'listing':
+                save(message[1])
+            elif message[0] == 'found':
+                on_found(*message[1:])
+            else:
+                _, shard, count = message
+                running -= 1
+                print(f"Shard {shard} (pages {slices[shard][0]}-{slices[shard][-1]}) done: {count} ads")
+    finally:
+        # If saving failed here, the shards would block on the full queue forever
+        for process in processes:
+            if running:
+                process.terminate()
+            process.join()
+
+
+def main(incremental=False, output='sequential_car_listings2.csv', base_url=BASE_URL, full=False,
+         report='crawl_report.json', progress=False, images=False, index=False, pages=None, ads=None, shards=1,
+         sink_format=None, rate=None, max_rate=None, **crawl_options):
+    """Crawl listings into output.
+
+    By default the search results are walked until they reach known ads
+    and every pending ad in the frontier is scraped. `pages` crawls those
+    search pages instead (split between `shards` processes when > 1), and
+    `ads` crawls just those ad URLs or IDs.
+    """
+    from discovery import Frontier, discover
+    from ratelimit import AdaptiveRateLimiter, CircuitBreaker
+    METRICS.reset()
+    frontier = Frontier()
+    if shards > 1 and not pages:
+        raise ValueError("shards need a page range to split")
+    if shards <= 1:
+        limits = {'rate': rate, 'max_rate': max_rate}
+        crawl_options.setdefault('limiter', AdaptiveRateLimiter(**{key: value for key, value in limits.items() if value}))
+        crawl_options.setdefault('breaker', CircuitBreaker())
+
+    # Listings are appended as they finish; an interrupted crawl resumes where it stopped
+    # Saved listings go into the search index as they come in
+    search = None
+    if index:
+        from search_index import INDEX_PATH, SearchIndex
+        search = SearchIndex.load() if os.path.exists(INDEX_PATH) else SearchIndex()
+    with open_sink(output, sink_format) as sink:
+        completed = sink.completed()
+        if completed:
+            print(f"Resuming crawl, {len(completed)} listings already saved")
+        # Ads are done once their batch is checkpointed; ads that failed stay pending for the next run
+        sink.on_flush = lambda batch: frontier.mark_done(listing['url'] for listing in batch)
+
+        def save(listing):
+            with METRICS.timer('sink.write'):
+                sink.write(listing)
+            if search is not None:
+                search.add([listing])
+
+        def found(page, urls):
+            frontier.add(urls, page)
+
+        with METRICS.progress() if progress else contextlib.nullcontext():
+            if pages and shards > 1:
+                run_shards(shards, pages, save, found, completed, base_url, rate, max_rate,
+                           incremental=incremental, **crawl_options)
+            elif pages:
+                crawl_pages(pages, save, found, completed, base_url, incremental=incremental, **crawl_options)
+            else:
+                from cache import ListingCache
+                from crawler import crawl
+                if ads:
+                    listing_urls = [ad_url(ad_id_from_url(ad) or ad) for ad in ads]
+                    frontier.add(listing_urls)
+                else:
+                    # New ads go into the persistent frontier; discovery stops at the first page of known ads
+                    with METRICS.timer('discover'):
+                        stats = discover(frontier, base_url, full=full, limiter=crawl_options['limiter'],
+                                         breaker=crawl_options['breaker'])
+                    print(f"Discovered {stats['new']} new ads on {stats['pages']} search pages")
+                    listing_urls = frontier.pending()
+                # Raw pages are cached, so an incremental run only parses new or changed ads
+                crawl([url for url in listing_urls if ad_id_from_url(url) not in completed], parse_listing_record,
+                      on_result=save, base_url=base_url, cache=ListingCache(), incremental=incremental,
+                      **crawl_options)
+    frontier.mark_done(ad_url(ad_id) for ad_id in completed)
+    frontier.close()
+    print(f"Saved {sink.written} listings")
+    if search is not None:
+        search.save()
+        print(f"Search index: {len(search)} listings")
+
+    # Optional photo stage: thumbnails for the dashboards, only photos not stored yet. The
+    # photo URLs are read back from what the sink wrote, a batch at a time
+    if images:
+        from images import ImageStore, fetch_images, iter_listings_images
+        store = ImageStore()
+        with METRICS.timer('images'):
+            image_stats = fetch_images(iter_listings_images(sink.files), store,
+                                       base_url=None if base_url == BASE_URL else base_url)
+        store.close()
+        print(f"Downloaded {image_stats['downloaded']} photos, made {image_stats['thumbnails']} thumbnails")
+    if report:
+        print_report(METRICS.write_report(report))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Crawl pazar3.mk car listings")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--pages', type=parse_pages,
+                        help="search pages to crawl, e.g. 13-22 or 1-5,9 (default: walk until known ads)")
+    source.add_argument('--ads', nargs='+', help="crawl just these ad URLs or IDs")
+    source.add_argument('--ads-file', help="file with one ad URL or ID per line")
+    parser.add_argument('--full', action='store_true', help="walk every search page, not just the new ones")
+    parser.add_argument('--incremental', action='store_true', help="only parse ads that changed since the last crawl")
+    parser.add_argument('--output', default='sequential_car_listings2.csv')
+    parser.add_argument('--format', dest='sink_format', choices=['csv', 'parquet'],
+                        help="output format (default: csv for .csv paths, a Parquet dataset otherwise)")
+    parser.add_argument('--shards', type=int, default=1, help="processes to split --pages between")
+    # Unset options keep the defaults in crawler.py and ratelimit.py
+    parser.add_argument('--concurrency', type=int, help="fetches in flight per process")
+    parser.add_argument('--per-host', type=int, help="fetches in flight per host")
+    parser.add_argument('--parse-workers', type=int, help="parse processes per crawl process; 0 parses on the fetch threads")
+    parser.add_argument('--rate', type=float, help="requests/sec to start at")
+    parser.add_argument('--max-rate', type=float, help="requests/sec never to exceed, across all shards")
+    parser.add_argument('--base-url', default=BASE_URL)
+    parser.add_argument('--images', action='store_true', help="download photos and make thumbnails")
+    parser.add_argument('--index', action='store_true', help="add the listings to the search index")
+    parser.add_argument('--progress', action='store_true')
+    parser.add_argument('--report', default='crawl_report.json', help="metrics report path; '' for none")
+    args = parser.parse_args(argv)
+    if args.ads_file:
+        with open(args.ads_file, encoding='utf-8') as file:
+            args.ads = [line.strip() for line in file if line.strip() and not line.startswith('#')]
+    if args.shards > 1 and not args.pages:
+        parser.error("--shards needs --pages")
+    del args.ads_file
+    return {key: value for key, value in vars(args).items() if value is not None}
+
 
 if __name__ == "__main__":
-    main()
+    main(**parse_args())
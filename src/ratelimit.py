@@ -0,0 +1,233 @@
+import asyncio
+import threading
+import time
+
+import requests
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+
+from fetch import fetch
+from metrics import METRICS
+
+# Requests per second the crawl starts at, and the range AIMD may move it in
+RATE = 4.0
+MIN_RATE = 0.5
+MAX_RATE = 20.0
+# Responses slower than this, or an error rate above this, count as the server struggling
+TARGET_LATENCY = 2.0
+MAX_ERROR_RATE = 0.1
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# The ad or photo was taken down; asking again will not bring it back
+GONE_STATUSES = {404, 410}
+RETRIES = 4
+
+
+class RetryableStatus(Exception):
+    def __init__(self, status, retry_after=None):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+def count_retry(retry_state):
+    METRICS.count('retries')
+
+
+# Jittered exponential backoff shared by the sync and async fetch paths
+RETRY_POLICY = dict(
+    retry=retry_if_exception_type((RetryableStatus, requests.ConnectionError, requests.Timeout)),
+    stop=stop_after_attempt(RETRIES),
+    wait=wait_random_exponential(multiplier=0.5, max=30),
+    before_sleep=count_retry,
+    reraise=True,
+)
+
+
+def retry_after(response):
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def check_status(response):
+    if response.status_code in RETRY_STATUSES:
+        METRICS.count(f'errors.http_{response.status_code}')
+        raise RetryableStatus(response.status_code, retry_after(response))
+    return response
+
+
+class AdaptiveRateLimiter:
+    """Token bucket whose rate follows AIMD on the responses it sees.
+
+    Every fast success adds `increase` requests/sec (a full request/sec
+    until the first throttle, like TCP slow start). A 429, a slow response
+    or a recent error rate (EWMA over responses) above `max_error_rate`
+    multiplies the rate by `decrease`, at most once per `cooldown` so one
+    burst of 429s is treated as a single signal; isolated 5xx responses
+    are left to the retries. A Retry-After header empties the bucket for
+    that long.
+    """
+
+    def __init__(self, rate=RATE, min_rate=MIN_RATE, max_rate=MAX_RATE, burst=None,
+                 target_latency=TARGET_LATENCY, max_error_rate=MAX_ERROR_RATE, increase=0.1, decrease=0.5,
+                 cooldown=1.0):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst or max(1.0, rate)
+        self.target_latency = target_latency
+        self.max_error_rate = max_error_rate
+        self.error_rate = 0.0
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.tokens = self.burst
+        self._updated = time.monotonic()
+        self._last_decrease = 0.0
+        self.slow_start = True
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self):
+        """Take a token and return how long to wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+    def wait(self):
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+
+    def on_success(self, latency):
+        if latency > self.target_latency:
+            self.on_throttle()
+            return
+        with self._lock:
+            self.error_rate *= 0.95
+            self.rate = min(self.max_rate, self.rate + (1.0 if self.slow_start else self.increase))
+
+    def on_throttle(self, retry_after=None):
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.slow_start = False
+            if now - self._last_decrease >= self.cooldown:
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self._last_decrease = now
+            if retry_after:
+                self.tokens = min(self.tokens, -retry_after * self.rate)
+
+    def on_error(self):
+        with self._lock:
+            self.error_rate = self.error_rate * 0.95 + 0.05
+            struggling = self.error_rate > self.max_error_rate
+        if struggling:
+            self.on_throttle()
+
+    def on_response_error(self, error):
+        """Feed a failed fetch (RetryableStatus or connection error) back into the rate"""
+        if getattr(error, 'status', None) == 429:
+            self.on_throttle(error.retry_after)
+        else:
+            self.on_error()
+
+
+class CircuitBreaker:
+    """Stops all fetching after `threshold` consecutive failures.
+
+    While open, callers wait `reset_timeout` seconds; then a single probe
+    request is let through (half-open). Its success closes the circuit,
+    its failure opens it again.
+    """
+
+    def __init__(self, threshold=10, reset_timeout=30.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half-open' if self.probing else 'open'
+
+    def wait_time(self):
+        """Seconds to wait before a request may go out; 0 claims the probe if half-open"""
+        with self._lock:
+            if self.opened_at is None:
+                return 0.0
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0:
+                return remaining
+            if self.probing:
+                return min(1.0, self.reset_timeout)
+            self.probing = True
+            return 0.0
+
+    async def acquire(self):
+        while True:
+            delay = self.wait_time()
+            if not delay:
+                return
+            await asyncio.sleep(delay)
+
+    def wait(self):
+        while True:
+            delay = self.wait_time()
+            if not delay:
+                return
+            time.sleep(delay)
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.threshold:
+                if self.opened_at is None or self.probing:
+                    self.trips += 1
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+
+@retry(**RETRY_POLICY)
+def fetch_with_retry(url, session=None, limiter=None, breaker=None):
+    """fetch() with backoff on 429/5xx and connection errors, paced by limiter and held while breaker is open"""
+    if breaker:
+        breaker.wait()
+    if limiter:
+        limiter.wait()
+    start = time.monotonic()
+    try:
+        response = check_status(fetch(url, session))
+    except (RetryableStatus, requests.ConnectionError, requests.Timeout) as e:
+        if limiter:
+            limiter.on_response_error(e)
+        if breaker:
+            breaker.record_failure()
+        raise
+    if limiter:
+        limiter.on_success(time.monotonic() - start)
+    if breaker:
+        breaker.record_success()
+    return response
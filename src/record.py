@@ -0,0 +1,237 @@
+import json
+import math
+import re
+import sys
+from collections.abc import Mapping
+from operator import attrgetter
+
+from normalize import mileage_range, seller_type
+
+# Fixed schema for one listing, in sink.LISTING_COLUMNS order. Numeric
+# fields are parsed once, categorical strings are interned (a crawl holds
+# a handful of distinct fuel types, not one copy per listing) and anything
+# else a page carries goes into `extra`.
+TEXT_FIELDS = ['title', 'description', 'url', 'address', 'publish_date', 'publish_time', 'phone', 'price',
+               'registration_date']
+CATEGORY_FIELDS = ['condition', 'transmission', 'mileage', 'fuel_type', 'registration', 'listing_type',
+                   'seller_type', 'location', 'color', 'manufacturer', 'model', 'currency']
+INT_FIELDS = ['views', 'year', 'mileage_start', 'mileage_end']
+FLOAT_FIELDS = ['price_numeric', 'engine_size']
+FIELDS = [
+    'title', 'description', 'url', 'images', 'address', 'publish_date', 'publish_time', 'views',
+    'phone', 'has_message_button', 'condition', 'year', 'transmission', 'mileage', 'fuel_type',
+    'registration', 'listing_type', 'seller_type', 'location', 'color', 'manufacturer', 'model',
+    'price_numeric', 'currency', 'price', 'coordinates', 'mileage_start', 'mileage_end',
+    'registration_date', 'engine_size', 'extra',
+]
+
+# Tag labels of the Macedonian pages, as scrape_listing leaves them
+MACEDONIAN_LABELS = {
+    'Состојба': 'condition',
+    'Година': 'year',
+    'Менувач': 'transmission',
+    'Километража': 'mileage',
+    'Гориво': 'fuel_type',
+    'Регистрација': 'registration',
+    'Вид на оглас': 'listing_type',
+    'Огласено од': 'seller_type',
+    'Локација': 'location',
+    'Боја': 'color',
+    'Производител': 'manufacturer',
+    'Модел': 'model',
+}
+
+NUMBER = re.compile(r'-?\d+(?:\.\d+)?')
+
+
+def _missing(value):
+    return value is None or value == '' or (isinstance(value, float) and math.isnan(value))
+
+
+def _number(value):
+    if _missing(value):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    match = NUMBER.search(str(value).replace(' ', '').replace(',', '.'))
+    return float(match.group()) if match else None
+
+
+def _int(value):
+    number = _number(value)
+    return None if number is None else int(round(number))
+
+
+def _float(value):
+    number = _number(value)
+    return None if number is None else float(number)
+
+
+def _category(value):
+    return None if _missing(value) else sys.intern(str(value))
+
+
+def _text(value):
+    if _missing(value):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _coordinates(value):
+    if _missing(value):
+        return None
+    if isinstance(value, str):
+        value = value.strip('()[] ').split(',')
+    try:
+        lat, lon = (float(part) for part in value)
+    except (TypeError, ValueError):
+        return None
+    return lat, lon
+
+
+PARSERS = {
+    **{field: _text for field in TEXT_FIELDS},
+    **{field: _category for field in CATEGORY_FIELDS},
+    **{field: _int for field in INT_FIELDS},
+    **{field: _float for field in FLOAT_FIELDS},
+    'images': lambda value: list(value) if isinstance(value, (list, tuple)) else ([] if _missing(value) else [value]),
+    'has_message_button': lambda value: None if _missing(value) else bool(value),
+    'coordinates': _coordinates,
+    'extra': lambda value: value or None,
+}
+
+
+class Listing(Mapping):
+    """One scraped listing with a fixed set of typed fields.
+
+    Built from scrape_listing's dict with from_dict(). It still reads like
+    that dict (listing['url'], .get(), .items()), so sinks and callers
+    take either, but every field is present, missing ones as None.
+    """
+
+    __slots__ = FIELDS
+
+    def __init__(self, **fields):
+        for field in FIELDS:
+            setattr(self, field, fields.get(field))
+
+    @classmethod
+    def from_dict(cls, data):
+        values = {}
+        labelled = {}
+        extra = {}
+        for key, value in data.items():
+            if key in PARSERS and key != 'extra':
+                values[key] = value
+            elif key in MACEDONIAN_LABELS:
+                labelled[MACEDONIAN_LABELS[key]] = value
+            else:
+                extra[key] = value
+        # A Macedonian tag only fills a field the dict has no canonical value for:
+        # finish_listing derives e.g. seller_type 'Private' from 'Огласено од'
+        for field, value in labelled.items():
+            if _missing(values.get(field)):
+                values[field] = seller_type(value) if field == 'seller_type' else value
+        listing = cls.__new__(cls)
+        for field in FIELDS:
+            setattr(listing, field, PARSERS[field](values.get(field)))
+        if listing.mileage_start is None and listing.mileage is not None:
+            mileage = mileage_range(listing.mileage)
+            if mileage:
+                listing.mileage_start, listing.mileage_end = mileage
+        listing.extra = extra or None
+        return listing
+
+    def __getitem__(self, key):
+        if key in PARSERS:
+            return getattr(self, key)
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __iter__(self):
+        yield from FIELDS[:-1]
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self):
+        return len(FIELDS) - 1 + len(self.extra or ())
+
+    def __getstate__(self):
+        return tuple(getattr(self, field) for field in FIELDS)
+
+    def __setstate__(self, state):
+        for field, value in zip(FIELDS, state):
+            setattr(self, field, value)
+
+    def __repr__(self):
+        return f'Listing({self.url!r}, {self.title!r})'
+
+
+def listings_from_dicts(rows):
+    return [row if isinstance(row, Listing) else Listing.from_dict(row) for row in rows]
+
+
+def _columns(records):
+    return {field: list(map(attrgetter(field), records)) for field in FIELDS}
+
+
+def _categorical(values):
+    """Categorical coded in one dict pass, categories in order of first appearance"""
+    import numpy as np
+    import pandas as pd
+
+    categories = {}
+    codes = np.fromiter((-1 if value is None else categories.setdefault(value, len(categories)) for value in values),
+                        dtype=np.int32, count=len(values))
+    return pd.Categorical.from_codes(codes, categories=list(categories))
+
+
+def records_to_frame(records):
+    """DataFrame with one typed column per field, built column by column.
+
+    Strings and numbers are converted by Arrow and categories coded in one
+    pass, which beats pd.DataFrame() over the same listings as dicts.
+    """
+    import pandas as pd
+    import pyarrow as pa
+
+    columns = _columns(records)
+    frame = {}
+    for field in FIELDS:
+        values = columns[field]
+        if field in CATEGORY_FIELDS:
+            frame[field] = _categorical(values)
+        elif field in INT_FIELDS:
+            frame[field] = pa.array(values, type=pa.int64()).to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+        elif field in FLOAT_FIELDS:
+            frame[field] = pa.array(values, type=pa.float64()).to_pandas(
+                types_mapper={pa.float64(): pd.Float64Dtype()}.get)
+        elif field == 'has_message_button':
+            frame[field] = pd.array(values, dtype='boolean')
+        elif field in TEXT_FIELDS:
+            frame[field] = pa.array(values, type=pa.large_string()).to_pandas()
+        else:
+            frame[field] = pd.Series(values, dtype=object)
+    return pd.DataFrame(frame)
+
+
+def records_to_table(records):
+    """Arrow table in storage.LISTING_SCHEMA, without going through pandas"""
+    import pyarrow as pa
+    from storage import LISTING_SCHEMA
+
+    columns = _columns(records)
+    columns['coordinates'] = [None if value is None else {'lat': value[0], 'lon': value[1]}
+                              for value in columns['coordinates']]
+    columns['extra'] = [None if value is None else json.dumps(value, ensure_ascii=False, default=str)
+                        for value in columns['extra']]
+    arrays = []
+    for field in LISTING_SCHEMA:
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(columns[field.name], type=pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(columns[field.name], type=field.type))
+    return pa.Table.from_arrays(arrays, schema=LISTING_SCHEMA)
@@ -0,0 +1,259 @@
+import argparse
+import pickle
+import re
+import time
+from array import array
+
+import numpy as np
+import pandas as pd
+
+from normalize import MKD_PER_EUR, fold
+from urls import ad_id_from_url
+
+# Local search over scraped listings: an inverted index over title and
+# description plus one column per facet, so "diesel Golfs 2010-2012 under
+# 8000 EUR in Skopje mentioning zamena" is a few posting-list intersections
+# and array comparisons instead of a pass over the CSV.
+INDEX_PATH = 'listings_index.pkl'
+CATEGORY_FACETS = ['manufacturer', 'model', 'fuel_type', 'location']
+STORED_FIELDS = ['url', 'title', 'manufacturer', 'model', 'year', 'fuel_type', 'location', 'price_numeric', 'currency']
+TOKEN = re.compile(r'\w+')
+
+# Facet values scraped from the Macedonian pages, under their English names
+FACET_ALIASES = {
+    'fuel_type': {'nafta': 'Diesel', 'benzin': 'Gasoline', 'plin / benzin': 'Gas (LPG) / Gasoline',
+                  'gas / gasoline': 'Gas (LPG) / Gasoline'},
+}
+
+
+def tokenize(text):
+    return TOKEN.findall(fold(text)) if isinstance(text, str) else []
+
+
+def _value(value):
+    if value is None or (isinstance(value, float) and np.isnan(value)) or value == '':
+        return None
+    return value
+
+
+def _number(value):
+    try:
+        number = float(str(value).replace(' ', '')) if isinstance(value, str) else float(value)
+    except (TypeError, ValueError):
+        return np.nan
+    return number
+
+
+def _range(value):
+    """(low, high) bounds from a number, a (low, high) pair or a 'low-high' string; None is open"""
+    if value is None:
+        return None, None
+    if isinstance(value, str):
+        low, dash, high = value.partition('-')
+        if not dash:
+            return float(low), float(low)
+        return (float(low) if low else None), (float(high) if high else None)
+    if isinstance(value, (tuple, list)):
+        return value
+    return value, value
+
+
+class SearchIndex:
+    """Inverted and facet indexes over listings, built and extended incrementally.
+
+    add() indexes listings as they come (dicts, records or DataFrame rows);
+    a listing whose ad ID is already indexed replaces the older copy. Doc
+    IDs only grow, so posting lists stay sorted by appending, and the
+    facet columns are kept as arrays that are rebuilt after each batch.
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.codes = {facet: array('i') for facet in CATEGORY_FACETS}
+        self.values = {facet: [] for facet in CATEGORY_FACETS}
+        self.value_codes = {facet: {} for facet in CATEGORY_FACETS}
+        self.years = array('d')
+        self.prices = array('d')
+        self.live = array('b')
+        self.stored = []
+        self.docs = {}
+        self._columns = None
+
+    def __len__(self):
+        return len(self.docs)
+
+    def _code(self, facet, value):
+        value = _value(value)
+        if value is None:
+            return -1
+        value = FACET_ALIASES.get(facet, {}).get(fold(str(value)), str(value))
+        codes = self.value_codes[facet]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(self.values[facet])
+            self.values[facet].append(value)
+        return code
+
+    def add(self, listings):
+        """Index listings (an iterable of mappings, or a DataFrame); returns how many"""
+        if isinstance(listings, pd.DataFrame):
+            listings = listings.to_dict('records')
+        added = 0
+        for listing in listings:
+            doc = len(self.stored)
+            key = ad_id_from_url(listing.get('url')) or listing.get('url')
+            previous = self.docs.get(key)
+            if previous is not None:
+                self.live[previous] = 0
+            self.docs[key] = doc
+            for token in set(tokenize(listing.get('title'))) | set(tokenize(listing.get('description'))):
+                self.postings.setdefault(token, array('i')).append(doc)
+            for facet in CATEGORY_FACETS:
+                self.codes[facet].append(self._code(facet, listing.get(facet)))
+            self.years.append(_number(listing.get('year')))
+            price = _number(listing.get('price_numeric'))
+            self.prices.append(price / MKD_PER_EUR if listing.get('currency') == 'MKD' else price)
+            self.live.append(1)
+            self.stored.append(tuple(_value(listing.get(field)) for field in STORED_FIELDS))
+            added += 1
+        self._columns = None
+        return added
+
+    def columns(self):
+        if self._columns is None:
+            # Copies: an array.array cannot grow while numpy views of it exist
+            self._columns = {
+                **{facet: np.array(self.codes[facet], dtype=np.int32) for facet in CATEGORY_FACETS},
+                'year': np.array(self.years, dtype=np.float64),
+                'price': np.array(self.prices, dtype=np.float64),
+                'live': np.array(self.live, dtype=bool),
+            }
+        return self._columns
+
+    def _matching_codes(self, facet, wanted):
+        """Codes of values equal to any wanted value, or with it as one of their comma-separated parts"""
+        wanted = {fold(FACET_ALIASES.get(facet, {}).get(fold(str(value)), str(value))) for value in wanted}
+        return [code for code, value in enumerate(self.values[facet])
+                if fold(value) in wanted or any(part.strip() in wanted for part in fold(value).split(','))]
+
+    def _posting(self, token):
+        posting = self.postings.get(token)
+        return np.array(posting, dtype=np.int32) if posting else np.empty(0, dtype=np.int32)
+
+    def _terms(self, text):
+        """Sorted doc IDs containing every term; `term*` matches any word starting with term"""
+        docs = None
+        for term in text.split():
+            prefix = term.endswith('*')
+            tokens = tokenize(term)
+            if not tokens:
+                continue
+            if prefix:
+                found = np.unique(np.concatenate([self._posting(token) for token in self.postings
+                                                  if token.startswith(tokens[-1])] or [np.empty(0, dtype=np.int32)]))
+                tokens = tokens[:-1]
+            else:
+                found = None
+            for token in tokens:
+                posting = self._posting(token)
+                found = posting if found is None else np.intersect1d(found, posting, assume_unique=True)
+            if found is not None:
+                docs = found if docs is None else np.intersect1d(docs, found, assume_unique=True)
+        return docs
+
+    def match(self, text=None, year=None, price=None, **facets):
+        """Doc IDs matching the text terms and every facet filter.
+
+        Category facets take a value or a list of values; year and price
+        take a number, a (low, high) pair or a 'low-high' string, either
+        bound open.
+        """
+        columns = self.columns()
+        mask = columns['live'].copy()
+        for facet, wanted in facets.items():
+            if facet not in CATEGORY_FACETS:
+                raise ValueError(f"unknown facet {facet!r}, expected one of {CATEGORY_FACETS}")
+            wanted = wanted if isinstance(wanted, (list, tuple, set)) else [wanted]
+            mask &= np.isin(columns[facet], self._matching_codes(facet, wanted))
+        for column, bounds in (('year', year), ('price', price)):
+            low, high = _range(bounds)
+            if low is not None:
+                mask &= columns[column] >= low
+            if high is not None:
+                mask &= columns[column] <= high
+        docs = self._terms(text) if text else None
+        if docs is None:
+            return np.flatnonzero(mask)
+        return docs[mask[docs]]
+
+    def search(self, text=None, limit=20, **filters):
+        """Matching listings, most recently indexed first, as a DataFrame of STORED_FIELDS; and the number of matches"""
+        docs = self.match(text, **filters)
+        hits = pd.DataFrame([self.stored[doc] for doc in docs[::-1][:limit]], columns=STORED_FIELDS)
+        return hits, len(docs)
+
+    def facet_counts(self, facet, text=None, **filters):
+        """Matching listings per value of facet (or per year), most common first"""
+        docs = self.match(text, **filters)
+        if facet == 'year':
+            years = self.columns()['year'][docs]
+            return pd.Series(years[~np.isnan(years)].astype(int)).value_counts()
+        codes = self.columns()[facet][docs]
+        counts = np.bincount(codes[codes >= 0], minlength=len(self.values[facet]))
+        return pd.Series(counts, index=self.values[facet], name=facet).loc[lambda c: c > 0].sort_values(ascending=False)
+
+    def save(self, path=INDEX_PATH):
+        self._columns = None
+        with open(path, 'wb') as file:
+            pickle.dump(self, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path=INDEX_PATH):
+        with open(path, 'rb') as file:
+            return pickle.load(file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full-text and faceted search over the scraped listings")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="index listings, or add new ones to the index with --update")
+    build.add_argument('listings', nargs='*', default=['sequential_car_listings_cleaned.csv'],
+                       help="scraper CSVs, Parquet files or datasets")
+    build.add_argument('--update', action='store_true', help=f"add to the existing {INDEX_PATH}")
+    query = commands.add_parser('query', help="e.g. query zamena --fuel_type Diesel --year 2010-2012 --price -8000")
+    query.add_argument('text', nargs='*', help="words that must all appear; word* matches a prefix")
+    for facet in CATEGORY_FACETS:
+        query.add_argument(f'--{facet}', nargs='+')
+    query.add_argument('--year', help="year or range, e.g. 2010-2012")
+    query.add_argument('--price', help="EUR range, e.g. 5000-8000 or -8000")
+    query.add_argument('--limit', type=int, default=20)
+    query.add_argument('--facet', choices=[*CATEGORY_FACETS, 'year'], help="count the matches per value instead")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        from storage import load_listings
+        start = time.perf_counter()
+        index = SearchIndex.load() if args.update else SearchIndex()
+        added = sum(index.add(load_listings(path)) for path in args.listings)
+        index.save()
+        print(f"Indexed {added} listings ({len(index)} total, {len(index.postings)} terms) "
+              f"in {time.perf_counter() - start:.2f}s")
+        return
+
+    index = SearchIndex.load()
+    filters = {facet: getattr(args, facet) for facet in CATEGORY_FACETS if getattr(args, facet)}
+    start = time.perf_counter()
+    if args.facet:
+        result = index.facet_counts(args.facet, ' '.join(args.text), year=args.year, price=args.price, **filters)
+        elapsed = time.perf_counter() - start
+        print(result.to_string())
+    else:
+        result, total = index.search(' '.join(args.text), args.limit, year=args.year, price=args.price, **filters)
+        elapsed = time.perf_counter() - start
+        print(result.to_string(index=False))
+        print(f"{total} matches")
+    print(f"in {elapsed * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
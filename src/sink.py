@@ -0,0 +1,158 @@
+import csv
+import json
+import os
+
+from urls import ad_id_from_url
+
+# Column order of the scraper CSVs, followed by fields only some pages have.
+# Anything else a listing carries (e.g. untranslated tag labels) is kept as
+# JSON in `extra`, so every batch is written with the same header.
+LISTING_COLUMNS = [
+    'title', 'description', 'url', 'images', 'address', 'publish_date', 'publish_time', 'views',
+    'phone', 'has_message_button', 'condition', 'year', 'transmission', 'mileage', 'fuel_type',
+    'registration', 'listing_type', 'seller_type', 'location', 'color', 'manufacturer', 'model',
+    'price_numeric', 'currency', 'price', 'coordinates', 'mileage_start', 'mileage_end',
+    'registration_date', 'engine_size', 'extra',
+]
+ROW_GROUP = 1000
+
+
+class ListingSink:
+    """Append listings in batches, checkpointing the ads written.
+
+    The checkpoint (`<path>.done`) lists one ad ID per line and is only
+    extended after the batch holding those ads is flushed to disk; a `#`
+    line closes each batch, with the size the output had then if the sink
+    has one. If it exists when the sink is opened, the previous crawl was
+    interrupted: rows are appended and completed() tells the caller what
+    to skip. Ads after the last `#` were cut off mid-batch and count as
+    not written. A clean close() removes it, so the next crawl starts from
+    scratch. Subclasses write the rows themselves in _write_rows(), and
+    on_flush, if set, is called with each batch once it is checkpointed.
+    """
+
+    def __init__(self, path, columns=LISTING_COLUMNS, batch_size=ROW_GROUP):
+        self.path = path
+        self.columns = columns
+        self.batch_size = batch_size
+        self.checkpoint_path = f'{path}.done'
+        self.resuming = os.path.exists(self.checkpoint_path) and os.path.exists(path)
+        self.rows = []
+        self.written = 0
+        self.on_flush = None
+        self._completed, self.position = self._read_checkpoint() if self.resuming else (set(), None)
+        self._checkpoint = open(self.checkpoint_path, 'a' if self.resuming else 'w', encoding='utf-8')
+
+    def _read_checkpoint(self):
+        """(ad IDs, output size) as of the last complete batch; a cut-off batch is truncated away"""
+        ad_ids, batch = set(), []
+        position, end, offset = None, 0, 0
+        with open(self.checkpoint_path, 'rb') as file:
+            for line in file:
+                offset += len(line)
+                if not line.endswith(b'\n'):
+                    break
+                if line.startswith(b'#'):
+                    ad_ids.update(batch)
+                    batch = []
+                    position = int(line[1:]) if line[1:].strip() else None
+                    end = offset
+                elif line.strip():
+                    batch.append(line.strip().decode('utf-8'))
+        os.truncate(self.checkpoint_path, end)
+        return ad_ids, position
+
+    def completed(self):
+        return set(self._completed)
+
+    def row(self, listing):
+        row = {}
+        extra = {}
+        for key, value in listing.items():
+            if key in self.columns:
+                row[key] = value
+            else:
+                extra[key] = value
+        if extra and 'extra' in self.columns:
+            row['extra'] = json.dumps(extra, ensure_ascii=False, default=str)
+        return row
+
+    def write(self, listing):
+        self.rows.append(listing)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def _write_rows(self, rows):
+        raise NotImplementedError
+
+    def _size(self):
+        """Size of the output once flushed, if rows beyond it can be cut off on resume"""
+        return None
+
+    def flush(self):
+        if not self.rows:
+            return
+        self._write_rows([self.row(listing) for listing in self.rows])
+        size = self._size()
+        self._checkpoint.writelines(f'{ad_id_from_url(listing.get("url")) or listing.get("url")}\n'
+                                    for listing in self.rows)
+        self._checkpoint.write(f'#{"" if size is None else size}\n')
+        self._checkpoint.flush()
+        self.written += len(self.rows)
+        batch, self.rows = self.rows, []
+        if self.on_flush:
+            self.on_flush(batch)
+
+    def _close(self):
+        pass
+
+    def close(self, complete=True):
+        self.flush()
+        self._close()
+        self._checkpoint.close()
+        if complete:
+            os.remove(self.checkpoint_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(complete=exc_type is None)
+
+
+class CsvSink(ListingSink):
+    """ListingSink writing one CSV file with a fixed header.
+
+    On resume the file is cut back to its size at the last checkpointed
+    batch, so rows written just before a crash are not there twice.
+    """
+
+    def __init__(self, path, columns=LISTING_COLUMNS, batch_size=ROW_GROUP):
+        super().__init__(path, columns, batch_size)
+        self.files = [path]
+        resume = self.resuming and self.position is not None
+        if resume:
+            os.truncate(path, self.position)
+        self._file = open(path, 'a' if resume else 'w', newline='', encoding='utf-8')
+        self._writer = csv.DictWriter(self._file, fieldnames=columns)
+        if not resume:
+            self._writer.writeheader()
+
+    def _write_rows(self, rows):
+        self._writer.writerows(rows)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _size(self):
+        return os.fstat(self._file.fileno()).st_size
+
+    def _close(self):
+        self._file.close()
+
+
+def open_sink(path, format=None, **kwargs):
+    """CsvSink for .csv paths, a partitioned ParquetSink (needs pyarrow) otherwise; format ('csv' or 'parquet') overrides"""
+    if format == 'csv' or (format is None and path.endswith('.csv')):
+        return CsvSink(path, **kwargs)
+    from storage import ParquetSink
+    return ParquetSink(path, **kwargs)
@@ -0,0 +1,202 @@
+import ast
+import datetime
+import math
+import os
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from sink import LISTING_COLUMNS, ROW_GROUP, ListingSink
+
+# Columnar storage for listings: Parquet files partitioned by crawl date
+# (<root>/crawl_date=YYYY-MM-DD/part-*.parquet), one row group per batch.
+LISTINGS_DIR = 'listings'
+
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
+COORDINATES = pa.struct([('lat', pa.float64()), ('lon', pa.float64())])
+# Keep integer columns with gaps as nullable ints instead of floats
+PANDAS_TYPES = {pa.int16(): pd.Int16Dtype(), pa.int32(): pd.Int32Dtype(), pa.int64(): pd.Int64Dtype()}
+
+LISTING_SCHEMA = pa.schema([
+    ('title', pa.string()),
+    ('description', pa.string()),
+    ('url', pa.string()),
+    ('images', pa.list_(pa.string())),
+    ('address', pa.string()),
+    ('publish_date', pa.string()),
+    ('publish_time', pa.string()),
+    ('views', pa.int32()),
+    ('phone', pa.string()),
+    ('has_message_button', pa.bool_()),
+    ('condition', CATEGORY),
+    ('year', pa.int16()),
+    ('transmission', CATEGORY),
+    ('mileage', CATEGORY),
+    ('fuel_type', CATEGORY),
+    ('registration', CATEGORY),
+    ('listing_type', CATEGORY),
+    ('seller_type', CATEGORY),
+    ('location', CATEGORY),
+    ('color', CATEGORY),
+    ('manufacturer', CATEGORY),
+    ('model', CATEGORY),
+    ('price_numeric', pa.float64()),
+    ('currency', CATEGORY),
+    ('price', pa.string()),
+    ('coordinates', COORDINATES),
+    ('mileage_start', pa.int32()),
+    ('mileage_end', pa.int32()),
+    ('registration_date', pa.string()),
+    ('engine_size', pa.float32()),
+    ('extra', pa.string()),
+])
+
+
+def _missing(value):
+    if isinstance(value, str):
+        return value == ''
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def _as_list(value):
+    if _missing(value):
+        return None
+    if isinstance(value, str):
+        try:
+            value = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            return [value]
+    return [str(item) for item in value]
+
+
+def _as_coordinates(value):
+    if _missing(value):
+        return None
+    if isinstance(value, dict):
+        return value
+    if isinstance(value, str):
+        value = value.strip('()[] ').split(',')
+    try:
+        lat, lon = (float(part) for part in value)
+    except (TypeError, ValueError):
+        return None
+    return {'lat': lat, 'lon': lon}
+
+
+def _as_bool(value):
+    if _missing(value):
+        return None
+    if isinstance(value, str):
+        return value.strip().lower() == 'true'
+    return bool(value)
+
+
+def _as_string(value):
+    if _missing(value):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _column(values, field):
+    values = pd.Series(values, dtype=object)
+    if field.type == COORDINATES:
+        return pa.array(values.map(_as_coordinates), type=field.type, from_pandas=True)
+    if pa.types.is_list(field.type):
+        return pa.array(values.map(_as_list), type=field.type, from_pandas=True)
+    if pa.types.is_boolean(field.type):
+        return pa.array(values.map(_as_bool), type=field.type, from_pandas=True)
+    if pa.types.is_integer(field.type) or pa.types.is_floating(field.type):
+        numbers = pd.to_numeric(values.map(_as_string).str.replace(' ', ''), errors='coerce')
+        if pa.types.is_integer(field.type):
+            numbers = numbers.round()
+        return pa.array(numbers, type=field.type, from_pandas=True)
+    return pa.array(values.map(_as_string), type=field.type, from_pandas=True)
+
+
+def to_table(rows, schema=LISTING_SCHEMA):
+    """Typed Arrow table from listing dicts or a DataFrame (e.g. a scraper CSV)"""
+    frame = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows)
+    length = len(frame)
+    arrays = [_column(frame[field.name] if field.name in frame else [None] * length, field)
+              for field in schema]
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def partition_path(root, crawl_date=None):
+    crawl_date = crawl_date or datetime.date.today()
+    return os.path.join(root, f'crawl_date={crawl_date.isoformat()}')
+
+
+def write_listings(rows, root=LISTINGS_DIR, crawl_date=None, row_group_size=ROW_GROUP):
+    """Write one Parquet part file into the crawl_date partition of root"""
+    directory = partition_path(root, crawl_date)
+    os.makedirs(directory, exist_ok=True)
+    name = f'part-{time.time_ns()}.parquet'
+    # Dot-prefixed until complete, so readers of the dataset never see it
+    tmp = os.path.join(directory, f'.{name}')
+    pq.write_table(to_table(rows), tmp, row_group_size=row_group_size)
+    path = os.path.join(directory, name)
+    os.replace(tmp, path)
+    return path
+
+
+def save_listings(rows, path, row_group_size=ROW_GROUP):
+    """Write listings to a single Parquet file, e.g. the cleaned dataset"""
+    pq.write_table(to_table(rows), path, row_group_size=row_group_size)
+
+
+def read_listings(root=LISTINGS_DIR, columns=None, filters=None):
+    """Load listings as a DataFrame, reading only the requested columns.
+
+    `filters` uses pyarrow's syntax, e.g. [('crawl_date', '>=', '2025-02-01')]
+    to skip whole partitions, or [('year', '>=', 2010)] for row groups.
+    """
+    dataset = ds.dataset(root, format='parquet', partitioning='hive')
+    table = dataset.to_table(columns=columns, filter=pq.filters_to_expression(filters) if filters else None)
+    return table.to_pandas(types_mapper=PANDAS_TYPES.get)
+
+
+def load_listings(path, columns=None):
+    """Load a scraper CSV, a Parquet file or a partitioned dataset into a DataFrame"""
+    if path.endswith('.csv'):
+        return pd.read_csv(path, usecols=columns)
+    return read_listings(path, columns=columns)
+
+
+class ParquetSink(ListingSink):
+    """ListingSink writing each batch as its own part file in today's partition.
+
+    A part file is renamed into place only once complete, so a crash never
+    leaves a half-written file next to the checkpoint. A new crawl replaces
+    the parts already in the partition, as CsvSink rewrites its file, so a
+    second crawl on the same day does not load every ad twice; a resumed
+    one adds to them.
+    """
+
+    def __init__(self, path=LISTINGS_DIR, columns=LISTING_COLUMNS, batch_size=ROW_GROUP, crawl_date=None):
+        os.makedirs(path, exist_ok=True)
+        super().__init__(path, columns, batch_size)
+        self.crawl_date = crawl_date
+        self.files = []
+        directory = partition_path(path, crawl_date)
+        if not self.resuming and os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if name.endswith('.parquet'):
+                    os.remove(os.path.join(directory, name))
+
+    def _write_rows(self, rows):
+        path = write_listings(rows, self.path, self.crawl_date, row_group_size=len(rows))
+        self.files.append(path)
+
+
+if __name__ == "__main__":
+    # Convert the existing scraper CSVs into the Parquet dataset
+    import glob
+    for csv_path in sorted(glob.glob('*car_listings*.csv')):
+        mtime = datetime.date.fromtimestamp(os.path.getmtime(csv_path))
+        print(f"{csv_path} -> {write_listings(pd.read_csv(csv_path), crawl_date=mtime)}")
@@ -0,0 +1,33 @@
+import re
+from urllib.parse import urlsplit
+
+BASE_URL = "https://www.pazar3.mk"
+
+AD_ID = re.compile(r'/ad/(\d+)')
+
+
+def ad_id_from_url(url):
+    match = AD_ID.search(url or '')
+    return match.group(1) if match else None
+
+
+def ad_url(ad_id, base_url=BASE_URL):
+    return f'{base_url}/ad/{ad_id}'
+
+
+def rebase_url(url, base_url):
+    """Point a listing URL at another host, e.g. the local fixture server"""
+    if not base_url:
+        return url
+    parts = urlsplit(url)
+    return base_url.rstrip('/') + parts.path + (f'?{parts.query}' if parts.query else '')
+
+
+# The search the listings come from (see code.md): VW Golf for sale,
+# model years 2008-2012, newest first
+SEARCH_PATH = '/ads/vehicles/automobiles/vw-volkswagen/golf/golf/for-sale'
+SEARCH_PROPS = '36-37--from-year-2008,36-41--to-year-2012,,,,,'
+
+
+def search_url(page, base_url=BASE_URL):
+    return f'{base_url}{SEARCH_PATH}?Page={page}&Prop={SEARCH_PROPS}'